@@ -0,0 +1,73 @@
+"""Measures the cold start time of the spiral cli.
+
+Runs `spiral --version` and `spiral --platforms` in fresh interpreters and
+reports the median wall time, and lists the slowest imports of each.
+
+Usage:
+    python benchmarks/import_time.py [--runs 10] [--top 10]
+"""
+from pathlib import Path
+import subprocess
+import statistics
+import argparse
+import time
+import sys
+import os
+
+COMMANDS = [['--version'], ['--platforms']]
+
+RUN_CLI = 'import sys; from spiral.cli import main; sys.argv[0] = "spiral"; main()'
+
+
+def run(args: list, extra: list = []) -> subprocess.CompletedProcess:
+    """Runs the cli with args in a new interpreter"""
+    env = dict(os.environ)
+    root = str(Path(__file__).resolve().parent.parent)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    return subprocess.run(
+        [sys.executable, *extra, '-c', RUN_CLI, *args],
+        capture_output=True, text=True, env=env
+    )
+
+
+def wall_time(args: list, runs: int) -> float:
+    """Median wall time in seconds of running the cli with args"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = run(args)
+        times.append(time.perf_counter() - start)
+        if result.returncode not in (0, 1):
+            raise RuntimeError(result.stderr)
+    return statistics.median(times)
+
+
+def slowest_imports(args: list, top: int) -> list[tuple[int, str]]:
+    """The slowest packages imported, with their cumulative time in microseconds, from -X importtime"""
+    result = run(args, ['-X', 'importtime'])
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        # Only packages other than spiral, their submodules are part of their cumulative time
+        if '.' not in name and name != 'spiral':
+            imports.append((int(cumulative), name))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cold start time of the spiral cli')
+    parser.add_argument('--runs', type=int, default=10, help='Number of runs per command')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to list')
+    args = parser.parse_args()
+
+    for command in COMMANDS:
+        print(f"spiral {' '.join(command)}: {wall_time(command, args.runs) * 1000:.0f} ms (median of {args.runs})")
+        for cumulative, name in slowest_imports(command, args.top):
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
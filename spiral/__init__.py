@@ -1,3 +1,33 @@
-from .tools import Tool
-from .agents import Agent, AIAssistant
-from .llms import LLM, Clarifai, Cohere, Groq, OpenAI, Together, Gemini
\ No newline at end of file
+import importlib
+
+EXPORTS = {
+    'Tool': 'spiral.tools',
+    'Agent': 'spiral.agents',
+    'AIAssistant': 'spiral.agents',
+    'AgentResult': 'spiral.agents',
+    'AgentError': 'spiral.agents',
+    'LLM': 'spiral.llms',
+    'Conversation': 'spiral.llms',
+    'SessionStore': 'spiral.llms.store',
+    'Clarifai': 'spiral.llms',
+    'Cohere': 'spiral.llms',
+    'Groq': 'spiral.llms',
+    'OpenAI': 'spiral.llms',
+    'Together': 'spiral.llms',
+    'Gemini': 'spiral.llms',
+}
+"""Names exported by the package and the modules defining them. Modules are imported on first use."""
+
+__all__ = list(EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *EXPORTS])
@@ -1,2 +1,9 @@
 from ..agents.base import Agent
-from ..agents.assistant import AIAssistant
\ No newline at end of file
+from ..agents.assistant import AIAssistant
+from ..agents.memory import ConversationCompactor
+from ..agents.semantic_cache import SemanticCache
+from ..agents.result import AgentResult, AgentStep
+from ..agents.exceptions import (
+    AgentError, MaxStepsExceeded, DeadlineExceeded,
+    ToolNotFoundError, ToolExecutionError, LLMError
+)
@@ -2,18 +2,31 @@ import re
 import ast
 import sys
 import json
+import time
 import asyncio
 import logging
-from typing import Optional, List, Dict, Union, Any, Self
+from contextlib import aclosing
+from typing import Optional, List, Dict, Union, Any, Self, Callable
 
 import uuid
 from pydantic import BaseModel, Field
 
 from ..llms.base import LLM
-from ..tools.base import Tool
+from ..llms.conversation import Conversation
+from ..llms.store import StoredHistory
+from ..llms.context import count_tokens
+from ..llms.usage import Usage, track_usage
+from ..tools.base import Tool, current_session
 from ..tasks.base import Task
 from ..agents.templates import PROMPT_TEMPLATE
-from ..config import AGENTS_FILE
+from ..agents.memory import ConversationCompactor
+from ..agents.semantic_cache import SemanticCache
+from ..agents.result import AgentResult, AgentStep
+from ..agents.exceptions import AgentError, MaxStepsExceeded, DeadlineExceeded, ToolNotFoundError, ToolExecutionError, LLMError
+from ..agents.store import AgentStore
+from ..utils import ainput
+from ..utils.stream import AnswerStream, find_json_object
+from ..utils.loop import run_coroutine
 
 logging.basicConfig(
     format='%(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
@@ -30,7 +43,10 @@ class Agent(BaseModel):
     name: str = Field(default='Avatar')
     
     llm: LLM
-    """Selected llm to use for agent"""
+    """Selected llm to use for agent. It holds no conversation state, so agents can share it."""
+    
+    conversation: Conversation = Field(default_factory=Conversation, exclude=True)
+    """Chat history, system prompt and settings of the agent's conversation"""
     
     tools: List[Tool] = Field(default=[])
     """Tools to be used by agent"""
@@ -41,6 +57,24 @@ class Agent(BaseModel):
     verbose: bool = Field(default=False)
     """Verbose mode flag"""
     
+    stream: bool = Field(default=False)
+    """Print the final answer while it is being generated"""
+    
+    stop_sequences: List[str] = Field(default=['\nUser:'])
+    """Stop sequences passed to the llm so it does not write the next turn itself"""
+    
+    max_steps: int = Field(default=10)
+    """Maximum llm requests run() makes for a query before giving up"""
+    
+    timeout: Optional[float] = None
+    """Seconds run() may take for a query before giving up. None for no deadline."""
+    
+    compactor: Optional[ConversationCompactor] = None
+    """Summarizes older turns of the chat history in the background between user turns"""
+    
+    semantic_cache: Optional[SemanticCache] = None
+    """Reuses final answers to earlier opening queries of conversations that are similar enough to a new one"""
+    
     sub_agents: List['Agent'] = Field(default=[])
     """Sub agents that can be called by this agent"""
     
@@ -50,7 +84,7 @@ class Agent(BaseModel):
     is_sub_agent:  bool = Field(default=False)
     """Flag indicating if agent is a sub agent"""
     
-    id: str = uuid.uuid4().hex
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     """Unique ID for each agent instance"""
     
     parent_id: Optional[str] = None
@@ -68,7 +102,8 @@ class Agent(BaseModel):
         prompt = prompt.replace("{tools}", tools_str)
         prompt = prompt.replace("{available_tools}", json.dumps(available_tools))
         
-        self.llm.system_prompt = prompt
+        self.conversation.system_prompt = prompt
+        self.conversation.stop_sequences = list(dict.fromkeys([*self.llm.stop_sequences, *self.stop_sequences]))
     
     def generate_prompt(self, query: str|dict)->dict:
         """Generates a prompt from a query.
@@ -114,41 +149,6 @@ class Agent(BaseModel):
                 return tool
         return None
     
-    def process_response(self, response: str)-> Union[dict, str]:
-        response = response.strip()
-        response_data = self.extract_json(response)
-        
-        try:
-            if isinstance(response_data, dict):
-                final_result_keys = ['final_answer', 'function_call_result']
-                
-                if response_data['type'].replace('\\', '') in final_result_keys: # type: ignore
-                    return response_data['result'] # type: ignore
-                tool = self.get_tool_by_name(response_data['function']) # type: ignore
-                
-                if not tool:
-                    raise Exception(f'Tool {response_data["function"]} not found') # type: ignore
-               
-                print(f"Running tool '{tool.name.title()}' with parameters: {response_data['arguments']}")
-                
-                if isinstance(response_data['arguments'], list): # type: ignore
-                    result = tool.run(*response_data['arguments']) # type: ignore
-                else:
-                    result = tool.run(response_data['arguments']) # type: ignore
-
-                # if isinstance(result, list) and result[0] == 'image':
-                #     result = result[1]
-                response_json = {}
-                response_json['type'] = 'function_call_result'
-                response_json['result'] = result
-                
-                return response_json
-            else:
-                raise Exception('Not a json object')
-        except Exception as e:
-            # logger.warning(str(e))
-            return response_data
-    
     def extract_json(self, content: str) -> dict | str:
         """
         Extract JSON content from a response string.
@@ -164,8 +164,12 @@ class Agent(BaseModel):
             # escaped_content = re.escape(content)
 
             # Find the start and end index of the JSON string
-            start_index = content.find('{')
-            end_index = content.find('}', start_index) + 1
+            json_object = find_json_object(content)
+            if json_object:
+                start_index, end_index = json_object
+            else:
+                start_index = content.find('{')
+                end_index = content.find('}', start_index) + 1
 
             # Extract the JSON string
             json_str = content[start_index:end_index]
@@ -201,64 +205,339 @@ class Agent(BaseModel):
         else:
             return tool(**params)
     
+    async def astream_response(self, prompt: dict, on_answer: Optional[Callable[[str], Any]] = None)-> str:
+        """Streams a response from the llm, passing final answer text to on_answer as it arrives.
+
+        The stream is closed as soon as the response object is complete, so
+        a function call can be dispatched without waiting for whatever the
+        model generates after it.
+
+        Args:
+            prompt (dict): The prompt to send to the llm
+            on_answer (Callable[[str], Any], optional): Called with each new piece of the final answer
+
+        Returns:
+            str: The response, without tokens generated after the response object
+        """
+        answer = AnswerStream()
+        async with aclosing(self.llm.astream(prompt, conversation=self.conversation)) as stream:
+            async for delta in stream:
+                text = answer.feed(delta)
+                if text and on_answer:
+                    on_answer(text)
+                if answer.complete:
+                    break
+            else:
+                return answer.response
+        
+        if self.llm.cache is not None:
+            # The stream was closed early, so the llm could not cache the response itself
+            await asyncio.to_thread(self.llm.bind(self.conversation).cache_response, prompt, answer.response)
+        return answer.response
+    
+    async def process_query(self, query: str|dict, on_answer: Optional[Callable[[str], Any]] = None)-> Union[dict, str]:
+        """Runs a query through the llm and any tools it calls until there is an answer.
+
+        Args:
+            query (str|dict): The user query
+            on_answer (Callable[[str], Any], optional): Streams the final answer text to this
+                callback as it is generated. Defaults to None.
+
+        Returns:
+            dict|str: The final answer
+        """
+        result = await self.arun(query, on_answer=on_answer)
+        return result.answer
+    
+    def run(self, query: str|dict, **kwds: Any) -> AgentResult:
+        """Runs a query to a final answer without user interaction.
+
+        Takes the same arguments as arun(). Must not be called from a running event loop.
+        Runs share one background event loop, so they reuse the llm's async client
+        and its connections instead of opening new ones every time.
+
+        Example:
+            result = agent.run("What is 24 * 7?", max_steps=5, timeout=60)
+            print(result.answer, result.usage.total_tokens)
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return run_coroutine(self.arun(query, **kwds))
+        raise RuntimeError("Agent.run() cannot be called from a running event loop, await arun() instead")
+    
+    async def arun(
+        self,
+        query: str|dict,
+        max_steps: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_answer: Optional[Callable[[str], Any]] = None,
+        on_tool_call: Optional[Callable[[str, Any], Any]] = None
+    ) -> AgentResult:
+        """Runs a query through the llm and the tools it calls until there is a final answer.
+
+        Each step sends the query, or the result of the last tool call, to
+        the llm. A response calling a tool runs the tool in a worker thread,
+        any other response is the final answer.
+
+        Args:
+            query (str|dict): The user query
+            max_steps (int, optional): Maximum llm requests. Defaults to the agent's max_steps.
+            timeout (float, optional): Seconds the run may take. Defaults to the agent's timeout.
+            on_answer (Callable[[str], Any], optional): Called with each new piece of the final answer as it is generated
+            on_tool_call (Callable[[str, Any], Any], optional): Called with the name and arguments of each tool before it runs
+
+        Returns:
+            AgentResult: The final answer, with the steps taken, their timings and token usage
+
+        Raises:
+            MaxStepsExceeded: There was no final answer after max_steps llm requests
+            DeadlineExceeded: There was no final answer within timeout seconds. A tool that
+                is running can not be stopped, its result is discarded.
+            ToolNotFoundError: The llm called a tool the agent does not have
+            ToolExecutionError: A tool raised an error
+            LLMError: A request to the llm failed
+        """
+        max_steps = max_steps or self.max_steps
+        timeout = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        result = AgentResult(query=query)
+        self.format_system_prompt()
+        
+        # Follow ups like "tell me more" mean something else in every conversation,
+        # so only the first query of a conversation uses the semantic cache
+        first_query = self.is_first_query()
+        cached = self.cached_answer(query) if first_query else None
+        if cached is not None:
+            if on_answer:
+                on_answer(str(cached))
+            result.answer, result.cached = cached, True
+            result.elapsed = time.perf_counter() - started
+            return result
+        
+        deadline = asyncio.timeout(timeout)
+        # Tools keep per conversation state, like PythonREPL's variables, under this id
+        session = current_session.set(self.conversation.id)
+        try:
+            async with deadline:
+                while len(result.steps) < max_steps:
+                    step = await self.run_step(query, result, on_answer, on_tool_call)
+                    if step.tool is None:
+                        result.answer = step.result
+                        break
+                    query = {'type': 'function_call_result', 'result': step.result}
+                else:
+                    raise MaxStepsExceeded(f"No final answer after {max_steps} steps", result)
+        except TimeoutError:
+            if not deadline.expired():
+                raise
+            raise DeadlineExceeded(f"No final answer within {timeout} seconds", result) from None
+        finally:
+            current_session.reset(session)
+            result.elapsed = time.perf_counter() - started
+        
+        if first_query:
+            self.cache_answer(result.query, result.steps[-1].response, result.answer, len(result.steps) > 1)
+        return result
+    
+    async def run_step(
+        self,
+        query: str|dict,
+        result: AgentResult,
+        on_answer: Optional[Callable[[str], Any]] = None,
+        on_tool_call: Optional[Callable[[str, Any], Any]] = None
+    ) -> AgentStep:
+        """Sends a query or tool result to the llm and runs the tool it calls, if any.
+
+        The step is added to result before the tool runs, so errors carry it.
+
+        Args:
+            query (str|dict): The user query, or the result of the last tool call
+            result (AgentResult): The run the step belongs to
+            on_answer (Callable[[str], Any], optional): Called with each new piece of the final answer
+            on_tool_call (Callable[[str, Any], Any], optional): Called with the name and arguments of the tool before it runs
+
+        Returns:
+            AgentStep: The step
+        """
+        prompt = self.generate_prompt(query)['output']
+        llm = self.llm.bind(self.conversation)
+        estimated_input = count_tokens(llm.system_prompt or '') + llm.estimate_tokens(prompt) - llm.max_tokens
+        
+        started = time.perf_counter()
+        with track_usage() as usage:
+            try:
+                response = await self.astream_response(prompt, on_answer)
+            except Exception as e:
+                raise LLMError(f"{self.llm.platform} request failed: {e}", result) from e
+        if not usage.requests:
+            # Providers do not report usage for streamed responses
+            usage = Usage(input_tokens=estimated_input, output_tokens=count_tokens(response), estimated=True)
+        
+        step = AgentStep(response=response, llm_time=time.perf_counter() - started, usage=usage)
+        result.steps.append(step)
+        result.usage.add(usage)
+        self.conversation.history.append(prompt)
+        self.conversation.history.append({'role': 'Assistant', 'type': 'text', 'message': response})
+        
+        if self.verbose:
+            print(response)
+        
+        response_data = self.extract_json(response.strip())
+        if not isinstance(response_data, dict):
+            step.result = response_data
+            return step
+        if str(response_data.get('type', '')).replace('\\', '') in ['final_answer', 'function_call_result']:
+            step.result = response_data.get('result')
+            return step
+        if 'function' not in response_data:
+            step.result = response_data
+            return step
+        
+        step.tool, step.arguments = response_data['function'], response_data.get('arguments', [])
+        tool = self.get_tool_by_name(str(step.tool))
+        if not tool:
+            raise ToolNotFoundError(f"Tool {step.tool} not found", result)
+        
+        if on_tool_call:
+            on_tool_call(tool.name, step.arguments)
+        started = time.perf_counter()
+        try:
+            if isinstance(step.arguments, list):
+                step.result = await asyncio.to_thread(tool.run, *step.arguments)
+            else:
+                step.result = await asyncio.to_thread(tool.run, step.arguments)
+        except Exception as e:
+            raise ToolExecutionError(f"Tool {tool.name} failed: {e}", result) from e
+        finally:
+            step.tool_time = time.perf_counter() - started
+        return step
+    
+    def is_first_query(self) -> bool:
+        """Whether the conversation has no earlier turns, so an answer depends on the query alone"""
+        history = self.conversation.history
+        return not history and not history.summary
+    
+    def cached_answer(self, query: str|dict) -> Optional[Any]:
+        """Returns the semantic cache's answer to a text query, adding the turn to the chat history.
+        Only used for the first query of a conversation, see is_first_query().
+
+        Args:
+            query (str|dict): The user query
+
+        Returns:
+            The cached final answer, or None
+        """
+        if self.semantic_cache is None or not isinstance(query, str):
+            return None
+        answer = self.semantic_cache.get(self.name, query)
+        if answer is None:
+            return None
+        
+        self.conversation.history.append(self.generate_prompt(query)['output'])
+        self.conversation.history.append({
+            'role': 'Assistant', 'type': 'text',
+            'message': json.dumps({'type': 'final_answer', 'result': answer})
+        })
+        return answer
+    
+    def cache_answer(self, query: str|dict, response: str, answer: Any, used_tools: bool = False):
+        """Stores a final answer to a text query in the semantic cache.
+
+        Args:
+            query (str|dict): The user query
+            response (str): The llm's response holding the answer
+            answer (Any): The final answer
+            used_tools (bool, optional): Whether tools were called for the answer. Defaults to False.
+        """
+        if self.semantic_cache is None or not isinstance(query, str):
+            return
+        if used_tools and not self.semantic_cache.cache_tool_answers:
+            return
+        response_data = self.extract_json(response)
+        if isinstance(response_data, dict) and response_data.get('type') == 'final_answer':
+            self.semantic_cache.set(self.name, query, answer)
+    
+    def compact_history(self) -> Optional[asyncio.Task]:
+        """Starts compacting the chat history in the background, if a compactor is set
+        and the history has grown enough. Must be called from a running event loop.
+
+        A stored history also drops the messages its summary covers from memory.
+
+        Returns:
+            asyncio.Task|None: The compaction task, if one was started
+        """
+        history = self.conversation.history
+        if isinstance(history, StoredHistory) and not (self.compactor and self.compactor.running):
+            history.release(self.llm.context_window.pinned_messages if self.llm.context_window else 0)
+        if self.compactor is None:
+            return None
+        return self.compactor.schedule(self.conversation.history, self.llm.bind(self.conversation)) # type: ignore
+    
     async def initialize(self):
         """
         Initialize the llm
         """
         self.format_system_prompt()
 
-        query: str|dict = input("\nUser (q to quit): ")
+        query: str = await ainput("\nUser (q to quit): ")
         while query:
             try:
-                if isinstance(query, str):
-                    if query.lower() in ['q', 'quit', 'exit']:
-                        print('Exiting...')
-                        sys.exit(1)
-                        
-                    elif query.lower() == 'add agent':
-                            new_agent = Agent.create_agent(is_sub_agent=True, parent_id=self.id)
-                            if new_agent:
-                                self.add_sub_agent(new_agent)
-                                print(f"\nAgent {new_agent.name} added successfully!")
-                            else:
-                                print("\nError creating agent")
-                            
-                            query = input("\nUser (q to quit): ")
-                            continue
+                if query.lower() in ['q', 'quit', 'exit']:
+                    print('Exiting...')
+                    sys.exit(1)
                     
-                    elif query.lower() == 'list agents':
-                        agents_str = "\nAvailable Agents:"
-                        agents = Agent.list_agents()
-                        sub_agents = [agent for agent in agents if agent.parent_id == self.id]
-                        for index, agent in enumerate(sub_agents):
-                            agents_str += (f"\n[{index}] {agent.name}")
-                        print(agents_str)
-                        query = input("\nUser (q to quit): ")
-                        continue
-                
-                full_prompt = self.generate_prompt(query)
-                response = self.llm(full_prompt['output']) # type: ignore
-                self.llm.chat_history.append(full_prompt['output'])
-                self.llm.chat_history.append({'role': 'Assistant', 'type': 'text', 'message': response})
-
-                if self.verbose:
-                    print(response)
+                elif query.lower() == 'add agent':
+                    new_agent = await asyncio.to_thread(Agent.create_agent, is_sub_agent=True, parent_id=self.id)
+                    if new_agent:
+                        self.add_sub_agent(new_agent)
+                        print(f"\nAgent {new_agent.name} added successfully!")
+                    else:
+                        print("\nError creating agent")
                 
-                result: dict[Any, Any] | str = self.process_response(response)
+                elif query.lower() == 'list agents':
+                    agents_str = "\nAvailable Agents:"
+                    sub_agents = await asyncio.to_thread(AgentStore().list, parent_id=self.id)
+                    for index, agent in enumerate(sub_agents):
+                        agents_str += (f"\n[{index}] {agent.name}")
+                    print(agents_str)
                 
-                if isinstance(result, dict) and result['type'] == 'function_call_result':
-                    # self.llm.chat_history.append({'role': 'Assistant', 'type': 'text', 'message': response.strip()})
-                    query = result
                 else:
-                    print(f"\n{self.name}: {result}")
-                    query = input("\nUser (q to quit): ")
+                    streamed: list[str] = []
+                    
+                    def print_answer(text: str):
+                        if not streamed:
+                            print(f"\n{self.name}: ", end='')
+                        streamed.append(text)
+                        print(text, end='', flush=True)
+                    
+                    def print_tool_call(name: str, arguments: Any):
+                        print(f"Running tool '{name.title()}' with parameters: {arguments}")
+                    
+                    result = await self.arun(
+                        query,
+                        on_answer=print_answer if self.stream else None,
+                        on_tool_call=print_tool_call
+                    )
+                    if streamed:
+                        print()
+                    else:
+                        print(f"\n{self.name}: {result.answer}")
+                    self.compact_history()
+                
+                query = await ainput("\nUser (q to quit): ")
                     
             except KeyboardInterrupt:
                 print('Exiting...')
                 sys.exit(1)
+            except AgentError as e:
+                print(f"\n{self.name}: {e}")
+                self.compact_history()
+                query = await ainput("\nUser (q to quit): ")
             except Exception as e:
+                # The llm already retried transient errors, report this one and keep the session
                 logger.warning(str(e))
-                sys.exit(1)
+                query = await ainput("\nUser (q to quit): ")
 
     def start(self):
         """
@@ -269,7 +548,7 @@ class Agent(BaseModel):
         return task
     
     @classmethod
-    def create_agent(cls,  name: Optional[str]=None, task_description: Optional[str]=None, tools: List[Tool]=[], llm: Optional[LLM]=None, is_sub_agent: bool = False, parent_id=None) -> Self | None:
+    def create_agent(cls,  name: Optional[str]=None, task_description: Optional[str]=None, tools: List[Tool]=[], llm: Optional[LLM]=None, is_sub_agent: bool = False, parent_id=None, store: Optional[AgentStore] = None) -> Self | None:
         """Create a new agent instance
 
         Args:
@@ -279,6 +558,7 @@ class Agent(BaseModel):
             tools (List[Tool], optional): List of tools available to the agent. Defaults to [].
             is_sub_agent (bool, optional): Set whether agent is a sub_agent. Defaults to True.
             parent_id (str, optional): Set parent agent id. Defaults to None.
+            store (AgentStore, optional): Store to save the agent in. Defaults to AgentStore().
         
         Returns:
             Agent: New agent instance
@@ -304,13 +584,7 @@ class Agent(BaseModel):
             if llm:   
                 task = Task(description=task_description)
                 new_agent = cls(name=name, llm=llm, task=task, tools=tools, is_sub_agent=is_sub_agent, parent_id=parent_id)
-                with open(AGENTS_FILE, 'r') as file:
-                    content = file.read()
-                    agents = json.loads(content) if content else []
-                    agents.append(new_agent.dict())        #type: ignore
-                
-                with open(AGENTS_FILE, 'w') as file:
-                    json.dump(agents, file, indent=4)
+                (store or AgentStore()).save(new_agent)
                     
                 return new_agent
             
@@ -319,43 +593,39 @@ class Agent(BaseModel):
             sys.exit(1)
     
     @staticmethod
-    def list_agents(id: str = "")-> List['Agent']:
+    def list_agents(id: str = "", store: Optional[AgentStore] = None)-> List['Agent']:
         """List all agents or just one agent when <id> is provided
 
+        Loading an agent creates its llm. Use AgentStore().list() to list
+        agents without loading them.
+
         Args:
             id (str): Id of the agent (Optional)
+            store (AgentStore, optional): Store to load agents from. Defaults to AgentStore().
         """
         try:
-            agents: List['Agent'] = []
-            with open(AGENTS_FILE, 'r') as file:
-                content = file.read()
-                loaded_agents: list[dict] = json.loads(content) if content else []
-                # agents = [Agent(**agent) for agent in agents]   #type: ignore
-                for agent in loaded_agents:
-                    llm = LLM.load_llm(agent["llm"]["platform"])
-                    loaded_agent = Agent(**agent)
-                    if llm:
-                        loaded_agent.llm = llm(**agent["llm"])
-                    agents.append(loaded_agent)
-            return agents
+            store = store or AgentStore()
+            if id:
+                record = store.get(id)
+                return [record.load()] if record else []
+            return [record.load() for record in store.list(with_data=True)]
                 
         except Exception as e:
             logger.exception(e)
             return []
         
     @classmethod
-    def load_agent(cls, agent_name: str):
-        """Dynamically load Agent based on name"""
+    def load_agent(cls, agent_name: str, store: Optional[AgentStore] = None):
+        """Dynamically load Agent based on name
+
+        Args:
+            agent_name (str): Name of the agent, ignoring case
+            store (AgentStore, optional): Store to load the agent from. Defaults to AgentStore().
+        """
         try:
-            agent_name = agent_name.lower()
-            agents = cls.list_agents()
-            loaded_agents: list[Agent] = [agent for agent in agents if agent.name.lower() == agent_name]
-            if len(loaded_agents):
-                agent = loaded_agents[0]
-                # loaded_llm = LLM.load_llm(agent.llm.platform)
-                # if loaded_llm:
-                #     agent.llm = loaded_llm(**agent.llm.dict())
-                return agent
+            record = (store or AgentStore()).find(agent_name)
+            if record:
+                return record.load(cls)
         except Exception as e:
             logger.exception(e)
             # logging.error(str(e))
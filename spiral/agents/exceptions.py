@@ -0,0 +1,38 @@
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ..agents.result import AgentResult
+
+
+class AgentError(Exception):
+    """Base class of the errors raised while running an agent.
+
+    Args:
+        message (str): Description of the error
+        result (AgentResult, optional): The steps run before the error
+    """
+
+    def __init__(self, message: str, result: Optional['AgentResult'] = None):
+        super().__init__(message)
+        self.result = result
+        """The steps run before the error, with their timings and usage"""
+
+
+class MaxStepsExceeded(AgentError):
+    """The agent did not reach a final answer within its step budget"""
+
+
+class DeadlineExceeded(AgentError, TimeoutError):
+    """The agent did not reach a final answer before its deadline"""
+
+
+class ToolNotFoundError(AgentError):
+    """The llm called a tool the agent does not have"""
+
+
+class ToolExecutionError(AgentError):
+    """A tool raised an error. The tool's exception is the __cause__."""
+
+
+class LLMError(AgentError):
+    """A request to the llm failed after its retries. The llm's exception is the __cause__."""
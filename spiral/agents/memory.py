@@ -0,0 +1,121 @@
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Callable, Optional
+import asyncio
+import logging
+
+from ..llms.base import LLM
+from ..llms.history import ChatHistory
+from ..llms.context import asummarize, count_tokens
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+
+class ConversationCompactor(BaseModel):
+    """Compacts older turns of a chat history into a running summary.
+
+    Compaction runs as a background task between user turns, so it never
+    delays a response. The summary is stored on the ChatHistory (summary
+    and summary_index), and the llm's context window sends it in place of
+    the summarized turns. Request payloads therefore stay roughly the same
+    size however long the session runs.
+
+    Args:
+        llm (LLM, optional): Llm used to summarize. Defaults to the conversation's llm.
+        trigger_tokens (int): Compact once the unsummarized history is larger than this
+        keep_last (int): Number of latest messages that are never summarized
+    """
+
+    llm: Optional[LLM] = None
+    """Llm used to summarize, e.g. a cheaper model. Defaults to the conversation's llm."""
+
+    trigger_tokens: int = Field(default=4000)
+    """Compact once the unsummarized history is estimated to be larger than this"""
+
+    keep_last: int = Field(default=6)
+    """Number of latest messages that are never summarized"""
+
+    tokenizer: Callable[[str], int] = Field(default=count_tokens, exclude=True)
+    """Counts the tokens in a text"""
+
+    _task: Optional[asyncio.Task] = PrivateAttr(default=None)
+
+    def unsummarized_tokens(self, history: ChatHistory) -> int:
+        """Estimated tokens of the messages not covered by the summary"""
+        return sum(
+            self.tokenizer(str(message.get('message', ''))) if message.get('type') == 'text' else 1000
+            for message in history[history.summary_index:]
+        )
+
+    def compaction_end(self, history: ChatHistory) -> int:
+        """Index up to which the history would be summarized.
+
+        The end is moved back to a user message, so the turns sent after
+        the summary start with one.
+        """
+        end = len(history) - self.keep_last
+        while end > history.summary_index and history[end].get('role', '').lower() != 'user':
+            end -= 1
+        return end
+
+    def needs_compaction(self, history: ChatHistory) -> bool:
+        """Whether the history has grown enough to be compacted"""
+        return (
+            self.compaction_end(history) > history.summary_index
+            and self.unsummarized_tokens(history) > self.trigger_tokens
+        )
+
+    @property
+    def running(self) -> bool:
+        """Whether a compaction is in progress"""
+        return self._task is not None and not self._task.done()
+
+    async def compact(self, history: ChatHistory, llm: LLM):
+        """Summarizes the history up to compaction_end() into its running summary.
+
+        The result is discarded if the history was edited while summarizing.
+
+        Args:
+            history (ChatHistory): The chat history to compact
+            llm (LLM): The conversation's llm, used when no summarizing llm is set
+        """
+        start = history.summary_index
+        end = self.compaction_end(history)
+        if end <= start:
+            return
+
+        revision = history.revision
+        summary = await asummarize(self.llm or llm, history[start:end], history.summary)
+        if history.revision == revision and history.summary_index == start:
+            history.set_summary(summary, end)
+
+    def schedule(self, history: ChatHistory, llm: LLM) -> Optional[asyncio.Task]:
+        """Starts a background compaction if the history needs one and none is running.
+
+        Args:
+            history (ChatHistory): The chat history to compact
+            llm (LLM): The conversation's llm, used when no summarizing llm is set
+
+        Returns:
+            asyncio.Task|None: The compaction task, if one was started
+        """
+        if self.running or not self.needs_compaction(history):
+            return None
+
+        self._task = asyncio.create_task(self.compact(history, llm))
+        self._task.add_done_callback(self._log_failure)
+        return self._task
+
+    async def wait(self):
+        """Waits for a running compaction to finish"""
+        if self.running:
+            await asyncio.wait([self._task]) # type: ignore
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Conversation compaction failed: {task.exception()}")
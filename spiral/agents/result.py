@@ -0,0 +1,51 @@
+from pydantic import BaseModel, Field
+from typing import Any, List, Optional
+
+from ..llms.usage import Usage
+
+
+class AgentStep(BaseModel):
+    """One llm request of an agent run, and the tool it called, if any"""
+
+    response: str
+    """The llm's response"""
+
+    tool: Optional[str] = None
+    """Name of the tool the llm called, None for the final answer"""
+
+    arguments: Any = None
+    """Arguments of the tool call"""
+
+    result: Any = None
+    """Result of the tool call, or the final answer"""
+
+    llm_time: float = Field(default=0.0)
+    """Seconds spent waiting for the llm"""
+
+    tool_time: float = Field(default=0.0)
+    """Seconds spent running the tool"""
+
+    usage: Usage = Field(default_factory=Usage)
+    """Token usage of the llm request"""
+
+
+class AgentResult(BaseModel):
+    """Outcome of Agent.run()"""
+
+    query: Any
+    """The user query"""
+
+    answer: Any = None
+    """The final answer"""
+
+    steps: List[AgentStep] = Field(default=[])
+    """The llm requests made, in order"""
+
+    usage: Usage = Field(default_factory=Usage)
+    """Token usage of all steps"""
+
+    elapsed: float = Field(default=0.0)
+    """Seconds the run took"""
+
+    cached: bool = Field(default=False)
+    """Whether the answer came from the semantic cache"""
@@ -0,0 +1,220 @@
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Any, Callable, Dict, Optional
+import threading
+import hashlib
+import logging
+import re
+import time
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+WORD_PATTERN = re.compile(r'\w+')
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by can could do does for from how i in is it its me my of on or "
+    "please s should so t that the this to was what whats when where which who why will with would you your".split()
+)
+"""Common words, which say little about what a query is about"""
+
+STOP_WORD_WEIGHT = 0.1
+"""Weight of stop words relative to other words"""
+
+NEGATIONS = frozenset(
+    "no not never none nor without cannot don doesn didn isn aren wasn weren won wouldn shouldn couldn".split()
+)
+"""Words that reverse the meaning of a query, so "with sugar" and "without sugar" must not match"""
+
+NEGATION_WEIGHT = 3.0
+"""Weight of negations relative to other words"""
+
+
+def hashing_embedding(text: str, dimensions: int = 1024) -> Any:
+    """Embeds a text offline with a hashing vectorizer.
+
+    Words and character trigrams of the words are hashed into a signed,
+    l2 normalized vector, so paraphrases that share most words and word
+    forms end up close to each other. Stop words get a low weight, so the
+    content words decide the similarity, and negations a high one, so a
+    query and its negation do not match.
+
+    Args:
+        text (str): The text to embed
+        dimensions (int, optional): Size of the vector. Defaults to 1024.
+
+    Returns:
+        numpy.ndarray: The embedding
+    """
+    import numpy as np
+
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in WORD_PATTERN.findall(text.lower()):
+        weight = STOP_WORD_WEIGHT if word in STOP_WORDS else NEGATION_WEIGHT if word in NEGATIONS else 1.0
+        padded = f"<{word}>"
+        features = [word] + [padded[index:index + 3] for index in range(len(padded) - 2)]
+        for position, feature in enumerate(features):
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], 'little') % dimensions
+            sign = 1.0 if digest[4] & 1 else -1.0
+            # Whole words weigh as much as all their trigrams together
+            vector[index] += sign * weight * (1.0 if position == 0 else 1.0 / (len(features) - 1))
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorIndex:
+    """NumPy backed index of normalized vectors and their answers, evicting the least recently used"""
+
+    def __init__(self, dimensions: int, max_entries: int):
+        import numpy as np
+
+        self.max_entries = max_entries
+        self.vectors = np.zeros((min(max_entries, 64), dimensions), dtype=np.float32)
+        """Vectors, one per row. Only the first size rows are used."""
+
+        self.answers: list = []
+        """Answers, in the order of the vectors"""
+
+        self.used = np.zeros(len(self.vectors), dtype=np.float64)
+        """When each entry was last used"""
+
+        self.size = 0
+
+    def search(self, vector: Any) -> tuple[int, float]:
+        """Returns the index and cosine similarity of the closest vector, or (-1, 0.0)"""
+        if not self.size:
+            return -1, 0.0
+        similarities = self.vectors[:self.size] @ vector
+        index = int(similarities.argmax())
+        return index, float(similarities[index])
+
+    def add(self, vector: Any, answer: Any):
+        """Adds a vector, replacing the least recently used one when the index is full"""
+        import numpy as np
+
+        if self.size < self.max_entries:
+            if self.size == len(self.vectors):
+                capacity = min(self.max_entries, len(self.vectors) * 2)
+                self.vectors = np.resize(self.vectors, (capacity, self.vectors.shape[1]))
+                self.used = np.resize(self.used, capacity)
+            index = self.size
+            self.size += 1
+            self.answers.append(answer)
+        else:
+            index = int(self.used[:self.size].argmin())
+            self.answers[index] = answer
+        self.vectors[index] = vector
+        self.used[index] = time.monotonic()
+
+
+class SemanticCache(BaseModel):
+    """Cache of agent answers that also matches paraphrased queries.
+
+    Queries are embedded with an offline embedding function and compared
+    by cosine similarity. An answer is reused when a cached query is at
+    least threshold similar. Each agent uses its own namespace, so agents
+    sharing a cache do not get each other's answers.
+
+    Answers that needed tool calls depend on the state of the world when
+    they were made, so they are not cached unless cache_tool_answers is set.
+
+    Example:
+        agent = Agent(llm=llm, semantic_cache=SemanticCache(threshold=0.97))
+
+    Args:
+        threshold (float): Minimum cosine similarity of a cached query to reuse its answer
+        max_entries (int): Maximum answers kept per namespace
+        dimensions (int): Size of the embeddings of the default embedding function
+        embedder (Callable[[str], numpy.ndarray], optional): Embedding function. Defaults to hashing_embedding.
+        cache_tool_answers (bool): Whether answers that needed tool calls are cached
+    """
+
+    threshold: float = Field(default=0.95)
+    """Minimum cosine similarity of a cached query to reuse its answer"""
+
+    max_entries: int = Field(default=1000)
+    """Maximum answers kept per namespace. The least recently used are evicted."""
+
+    dimensions: int = Field(default=1024)
+    """Size of the embeddings of the default embedding function"""
+
+    embedder: Optional[Callable[[str], Any]] = Field(default=None, exclude=True)
+    """Returns the embedding of a text. Defaults to hashing_embedding."""
+
+    cache_tool_answers: bool = Field(default=False)
+    """Whether answers that needed tool calls are cached"""
+
+    _indexes: Dict[str, VectorIndex] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _stats: dict = PrivateAttr(default_factory=lambda: {'hits': 0, 'misses': 0})
+
+    def __deepcopy__(self, memo: Optional[dict] = None) -> 'SemanticCache':
+        # The cache is shared, copies of an agent keep using it
+        return self
+
+    @property
+    def stats(self) -> dict:
+        """Hit and miss counters, and the number of answers per namespace"""
+        with self._lock:
+            return dict(self._stats, entries={name: index.size for name, index in self._indexes.items()})
+
+    def embed(self, text: str) -> Any:
+        """Normalized embedding of a text"""
+        import numpy as np
+
+        if self.embedder is None:
+            return hashing_embedding(text, self.dimensions)
+        vector = np.asarray(self.embedder(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, namespace: str, query: str) -> Optional[Any]:
+        """Returns the cached answer to a query or a paraphrase of it, or None.
+
+        Args:
+            namespace (str): The namespace, usually the agent's name
+            query (str): The query
+        """
+        vector = self.embed(query)
+        with self._lock:
+            index = self._indexes.get(namespace)
+            position, similarity = index.search(vector) if index else (-1, 0.0)
+            if position == -1 or similarity < self.threshold:
+                self._stats['misses'] += 1
+                return None
+            index.used[position] = time.monotonic() # type: ignore
+            self._stats['hits'] += 1
+            return index.answers[position] # type: ignore
+
+    def set(self, namespace: str, query: str, answer: Any):
+        """Caches the answer to a query.
+
+        Args:
+            namespace (str): The namespace, usually the agent's name
+            query (str): The query
+            answer (Any): The final answer
+        """
+        vector = self.embed(query)
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = self._indexes[namespace] = VectorIndex(len(vector), self.max_entries)
+            position, similarity = index.search(vector)
+            if position != -1 and similarity >= 0.999:
+                index.answers[position] = answer
+                index.used[position] = time.monotonic()
+            else:
+                index.add(vector, answer)
+
+    def clear(self, namespace: Optional[str] = None):
+        """Removes the answers of a namespace, or of all namespaces"""
+        with self._lock:
+            if namespace is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(namespace, None)
@@ -0,0 +1,247 @@
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Any, List, Optional, Type, TYPE_CHECKING
+import threading
+import logging
+import sqlite3
+import json
+import time
+import uuid
+
+from ..config import AGENTS_DB, AGENTS_FILE
+
+if TYPE_CHECKING:
+    from ..agents.base import Agent
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+
+class AgentRecord(BaseModel):
+    """A saved agent, without its llm and tools loaded"""
+
+    id: str
+    """Unique ID of the agent"""
+
+    name: str
+    """Name of the agent"""
+
+    platform: str = Field(default='')
+    """Platform of the agent's llm"""
+
+    model: str = Field(default='')
+    """Model of the agent's llm"""
+
+    parent_id: Optional[str] = None
+    """ID of the parent agent, for sub agents"""
+
+    data: dict = Field(default={}, repr=False)
+    """The saved agent"""
+
+    def load(self, agent_class: Optional[Type['Agent']] = None) -> 'Agent':
+        """Creates the agent and its llm
+
+        Args:
+            agent_class (Type[Agent], optional): Class of the agent. Defaults to Agent.
+        """
+        from ..agents.base import Agent
+        from ..llms.base import LLM
+
+        data = dict(self.data)
+        # Unset fields get the llm's defaults
+        llm_data = {key: value for key, value in (data.pop('llm', None) or {}).items() if value is not None}
+        llm_class = LLM.load_llm(self.platform) if self.platform else None
+        llm = (llm_class or LLM)(**llm_data)
+        return (agent_class or Agent)(**data, llm=llm)
+
+
+class AgentStore(BaseModel):
+    """Saved agents, in a SQLite database indexed by id, name and parent.
+
+    Listing and looking up agents reads only the rows needed, and does not
+    create llms until an agent is loaded. Writes are transactions, so
+    concurrent processes do not lose each other's agents.
+
+    Agents saved in AGENTS_FILE by earlier versions are imported the first
+    time the store is opened.
+
+    Example:
+        store = AgentStore()
+        store.save(agent)
+        agent = store.find('Adam').load()
+
+    Args:
+        path (str, optional): SQLite database file. Defaults to AGENTS_DB.
+    """
+
+    path: Optional[str] = Field(default=None)
+    """SQLite database file. Defaults to AGENTS_DB in SPIRAL_WORKDIR."""
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _connection: Optional[sqlite3.Connection] = PrivateAttr(default=None)
+
+    def save(self, agent: 'Agent'):
+        """Adds an agent, or replaces the saved agent with the same id"""
+        data = agent.model_dump()
+        llm = data.get('llm') or {}
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                self._save(connection, data, llm, now)
+
+    def get(self, id: str) -> Optional[AgentRecord]:
+        """The saved agent with an id, or None"""
+        return self._one("SELECT id, name, platform, model, parent_id, data FROM agents WHERE id = ?", (id,))
+
+    def find(self, name: str, parent_id: Optional[str] = None) -> Optional[AgentRecord]:
+        """The first saved agent with a name, ignoring case, or None
+
+        Args:
+            name (str): Name of the agent
+            parent_id (str, optional): Only look at the sub agents of this agent
+        """
+        query = "SELECT id, name, platform, model, parent_id, data FROM agents WHERE name_key = ?"
+        params: tuple = (name.lower(),)
+        if parent_id is not None:
+            query += " AND parent_id = ?"
+            params += (parent_id,)
+        return self._one(query + " ORDER BY created LIMIT 1", params)
+
+    def list(self, parent_id: Optional[str] = None, limit: Optional[int] = None, offset: int = 0, with_data: bool = False) -> List[AgentRecord]:
+        """Saved agents in the order they were created
+
+        Args:
+            parent_id (str, optional): Only list the sub agents of this agent
+            limit (int, optional): Maximum number of agents to list
+            offset (int, optional): Number of agents to skip
+            with_data (bool, optional): Read the saved agents too, so they can be loaded. Defaults to False.
+        """
+        query = f"SELECT id, name, platform, model, parent_id, {'data' if with_data else 'NULL'} FROM agents"
+        params: tuple = ()
+        if parent_id is not None:
+            query += " WHERE parent_id = ?"
+            params = (parent_id,)
+        query += " ORDER BY created LIMIT ? OFFSET ?"
+        params += (limit if limit is not None else -1, offset)
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        return [self._record(row) for row in rows]
+
+    def count(self) -> int:
+        """Number of saved agents"""
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM agents").fetchone()[0]
+
+    def update(self, id: str, **fields: Any) -> Optional[AgentRecord]:
+        """Changes fields of a saved agent. Use llm={...} to change fields of its llm.
+
+        Returns:
+            AgentRecord|None: The updated agent, or None if there is no agent with the id
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                # Reading and writing in one transaction keeps concurrent updates from clashing
+                connection.execute("BEGIN IMMEDIATE")
+                row = connection.execute("SELECT data FROM agents WHERE id = ?", (id,)).fetchone()
+                if row is None:
+                    return None
+                data = json.loads(row[0])
+                llm = {**(data.get('llm') or {}), **fields.pop('llm', {})}
+                data.update(fields, llm=llm)
+                self._save(connection, data, llm, time.time())
+        return self.get(id)
+
+    def remove(self, id: str) -> bool:
+        """Deletes a saved agent. Its sub agents are kept.
+
+        Returns:
+            bool: Whether an agent was deleted
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute("DELETE FROM agents WHERE id = ?", (id,)).rowcount > 0
+
+    def close(self):
+        """Closes the database connection"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _one(self, query: str, params: tuple) -> Optional[AgentRecord]:
+        with self._lock:
+            row = self._connect().execute(query, params).fetchone()
+        return self._record(row) if row else None
+
+    @staticmethod
+    def _record(row: tuple) -> AgentRecord:
+        id, name, platform, model, parent_id, data = row
+        return AgentRecord(
+            id=id, name=name, platform=platform, model=model, parent_id=parent_id,
+            data=json.loads(data) if data else {}
+        )
+
+    @staticmethod
+    def _save(connection: sqlite3.Connection, data: dict, llm: dict, now: float):
+        connection.execute(
+            "INSERT INTO agents (id, name, name_key, platform, model, parent_id, data, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET name = excluded.name, name_key = excluded.name_key, "
+            "platform = excluded.platform, model = excluded.model, parent_id = excluded.parent_id, "
+            "data = excluded.data, updated = excluded.updated",
+            (
+                data['id'], data['name'], data['name'].lower(), llm.get('platform') or '', llm.get('model') or '',
+                data.get('parent_id'), json.dumps(data, default=str), now, now
+            )
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens the database on first use, importing AGENTS_FILE once. Called with the lock held."""
+        if self._connection is None:
+            connection = sqlite3.connect(self.path or str(AGENTS_DB), check_same_thread=False, timeout=30.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS agents ("
+                "id TEXT PRIMARY KEY, name TEXT NOT NULL, name_key TEXT NOT NULL, platform TEXT NOT NULL, "
+                "model TEXT NOT NULL, parent_id TEXT, data TEXT NOT NULL, created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS agents_name ON agents (name_key, created)")
+            connection.execute("CREATE INDEX IF NOT EXISTS agents_parent ON agents (parent_id, created)")
+            connection.execute("CREATE INDEX IF NOT EXISTS agents_created ON agents (created)")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            connection.commit()
+            if self.path is None:
+                self._import_agents_file(connection)
+            self._connection = connection
+        return self._connection
+
+    def _import_agents_file(self, connection: sqlite3.Connection):
+        """Imports the agents saved in AGENTS_FILE by earlier versions"""
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if connection.execute("SELECT 1 FROM meta WHERE key = 'imported_agents_file'").fetchone():
+                return
+            try:
+                content = AGENTS_FILE.read_text() if AGENTS_FILE.is_file() else ''
+                agents = json.loads(content) if content.strip() else []
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not import {AGENTS_FILE}: {e}")
+                agents = []
+            now = time.time()
+            ids = set()
+            for index, data in enumerate(agents):
+                if not isinstance(data, dict) or not data.get('name'):
+                    continue
+                if not data.get('id') or data['id'] in ids:
+                    # Agents created in one process used to share an id
+                    data['id'] = uuid.uuid4().hex
+                ids.add(data['id'])
+                # Keep the order of the file
+                self._save(connection, data, data.get('llm') or {}, now + index * 1e-6)
+            connection.execute("INSERT INTO meta (key, value) VALUES ('imported_agents_file', ?)", (str(len(agents)),))
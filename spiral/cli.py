@@ -5,22 +5,14 @@ import argparse
 from pathlib import Path
 from argparse import Namespace
 
-from spiral.llms import (
-    Cohere, OpenAI,LLM
-)
-
-from .agents import AIAssistant, Agent
-from .tools import (
-    Calculator, YoutubePlayer,
-    WorldNews, PythonREPL,
-    FSBrowser, SearchTool,
-    InternetBrowser,
-    take_screenshot
-)
-
 from .config import VERSION
 
+# Agents, llms and tools are imported where they are used, so commands
+# like --version and --platforms do not load any provider sdk.
+
 def add_agent():
+    from .agents import Agent
+    
     new_agent = Agent.create_agent() # type: ignore
     if new_agent:
         print(f"\nAgent {new_agent.name} added successfully!")
@@ -29,12 +21,44 @@ def add_agent():
     sys.exit()
 
 def list_agents():
+    from .agents.store import AgentStore
+    
     agents_str = "\nAvailable Agents:"
-    for index, agent in enumerate(Agent.list_agents()):
-        agents_str += (f"\n[{index}] {agent.name}")                 #type: ignore
+    for index, agent in enumerate(AgentStore().list()):
+        agents_str += (f"\n[{index}] {agent.name}")
     print(agents_str)
+
+def show_agent(record):
+    task = record.data.get('task') or {}
+    llm = record.data.get('llm') or {}
+    print(f"\nName: {record.name}")
+    print(f"ID: {record.id}")
+    if record.parent_id:
+        print(f"Parent ID: {record.parent_id}")
+    print(f"Task: {task.get('description', '')}")
+    print(f"Platform: {record.platform}")
+    print(f"Model: {record.model}")
+    print(f"Temperature: {llm.get('temperature', '')}")
+
+def update_agent(store, record):
+    task = record.data.get('task') or {}
+    llm = record.data.get('llm') or {}
+    name = input(f"\n[Enter agent name] [{record.name}]: ") or record.name
+    description = input(f"\n[Enter brief description of agent task] [{task.get('description', '')}]: ")
+    model = input(f"\nEnter model name [{record.model}]: ") or record.model
+    temperature = input(f"\nEnter model temperature [{llm.get('temperature', '')}]: ")
+    
+    fields: dict = {'name': name, 'llm': {'model': model}}
+    if description:
+        fields['task'] = {**task, 'description': description}
+    if temperature:
+        fields['llm']['temperature'] = float(temperature)
+    store.update(record.id, **fields)
+    print(f"\nAgent {name} updated successfully!")
     
 def list_platforms():
+    from .llms import LLM
+    
     print("\nAvailable Platforms:")
     for index, l in enumerate(LLM.list_llms()):
         print(f"[{index}] {l}")
@@ -43,6 +67,21 @@ def manage_agents(args: Namespace):
     try:
         if args.new:
             add_agent()
+        elif args.name:
+            from .agents.store import AgentStore
+            
+            store = AgentStore()
+            record = store.find(args.name)
+            if not record:
+                print(f"\nAgent {args.name} not found")
+                sys.exit(1)
+            if args.remove:
+                store.remove(record.id)
+                print(f"\nAgent {record.name} removed successfully!")
+            elif args.update:
+                update_agent(store, record)
+            else:
+                show_agent(record)
         elif args.list:
             list_agents()
     except KeyboardInterrupt:
@@ -60,58 +99,109 @@ def str_or_file(string):
             return file.read()
     return string
 
+def build_assistant(args: Namespace):
+    """Creates the agent described by the command line arguments"""
+    from .agents import AIAssistant, Agent, ConversationCompactor
+    from .llms import LLM
+    from .tools import take_screenshot
+    
+    platform = None
+    if args.platform:
+        platform = LLM.load_llm(model_name=args.platform)
+    if not platform:
+        from .llms import Cohere
+        platform = Cohere
+    platform = platform()
+    
+    if args.api_key:
+        platform.api_key = args.api_key
+    if args.api_base:
+        platform.api_base = args.api_base
+    if args.model:
+        platform.model = args.model
+    
+    platform.temperature = args.temperature
+    if args.system_prompt:
+        platform.system_prompt = args.system_prompt
+    # llm = TogetherLLM()
+    loaded_agent = None
+    if args.agent:
+        loaded_agent = Agent.load_agent(args.agent)
+        
+        if loaded_agent:
+            assistant = loaded_agent
+        else:
+            assistant_description = "You are an ai assistant. Your main goal is to help the user complete tasks"
+            assistant = AIAssistant.create_agent(name=args.agent, task_description=assistant_description, llm=platform) #type: ignore
+
+    else:
+        assistant = AIAssistant(llm=platform, name=args.name, verbose=args.verbose)
+    
+    if assistant:
+        assistant.llm = platform
+        assistant.name = args.name
+        assistant.stream = args.stream
+        if args.compact or args.compact_platform or args.compact_model:
+            summarizer = None
+            if args.compact_platform or args.compact_model:
+                summarizer_llm = LLM.load_llm(model_name=args.compact_platform) if args.compact_platform else None
+                summarizer = summarizer_llm() if summarizer_llm else platform.model_copy()
+                if args.compact_model:
+                    summarizer.model = args.compact_model
+            assistant.compactor = ConversationCompactor(llm=summarizer)
+        assistant.add_tool(take_screenshot())
+        # assistant.add_tool(Calculator())
+        # assistant.add_tool(YoutubePlayer())
+        # assistant.add_tool(WorldNews())
+        # assistant.add_tool(FSBrowser())
+        # assistant.add_tool(PythonREPL())
+        # assistant.add_tool(InternetBrowser())
+        # assistant.add_tool(SearchTool())
+    return assistant
+
 def start(args: Namespace):
+    if args.platforms:
+        list_platforms()
+        sys.exit()
+    
     try:
-        if args.platforms:
-            list_platforms()
-            sys.exit()
-        elif args.agents:
+        if args.agents:
             list_agents()              #type: ignore
             sys.exit()
-        platform = None
-        if args.platform:
-            platform = LLM.load_llm(model_name=args.platform)
-        platform = platform() if platform else Cohere()
-        
-        if args.api_key:
-            platform.api_key = args.api_key
-        if args.model:
-            platform.model = args.model
-        
-        platform.temperature = args.temperature
-        if args.system_prompt:
-            platform.system_prompt = args.system_prompt
-        # llm = TogetherLLM()
-        loaded_agent = None
-        if args.agent:
-            loaded_agent = Agent.load_agent(args.agent)
-            
-            if loaded_agent:
-                assistant = loaded_agent
-            else:
-                assistant_description = "You are an ai assistant. Your main goal is to help the user complete tasks"
-                assistant = AIAssistant.create_agent(name=args.agent, task_description=assistant_description, llm=platform) #type: ignore
-
-        else:
-            assistant = AIAssistant(llm=platform, name=args.name, verbose=args.verbose)
-        
+        assistant = build_assistant(args)
         if assistant:
-            assistant.llm = platform
-            assistant.name = args.name
-            assistant.add_tool(take_screenshot())
-            # assistant.add_tool(Calculator())
-            # assistant.add_tool(YoutubePlayer())
-            # assistant.add_tool(WorldNews())
-            # assistant.add_tool(FSBrowser())
-            # assistant.add_tool(PythonREPL())
-            # assistant.add_tool(InternetBrowser())
-            # assistant.add_tool(SearchTool())
+            if args.session:
+                from .llms.store import SessionStore
+                
+                assistant.conversation = SessionStore().open_or_create(args.session, agent=assistant.name)
+                if assistant.conversation.history:
+                    print(f"Resumed session {args.session}")
             assistant.start()
     except Exception as e:
         logging.error(str(e))
         parser.print_help()
         sys.exit(1)
 
+def serve(args: Namespace):
+    from .server import AgentServer
+    
+    assistant = build_assistant(args)
+    if not assistant:
+        sys.exit(1)
+    store = None
+    if args.persist:
+        from .llms.store import SessionStore
+        store = SessionStore()
+    server = AgentServer(
+        assistant,
+        max_sessions=args.max_sessions,
+        max_concurrency=args.max_concurrency,
+        max_queue=args.max_queue,
+        drain_timeout=args.drain_timeout,
+        store=store
+    )
+    server.run(host=args.host, port=args.port)
+
 def get_arguments():
     global parser
     
@@ -124,6 +214,16 @@ def get_arguments():
     agents_parser.add_argument('--remove', action='store_true', help='Delete an agent')
     
     agents_parser.set_defaults(func=manage_agents)
+    
+    serve_parser = subparsers.add_parser('serve', help="Serve the agent over HTTP and WebSocket")
+    serve_parser.add_argument('--host', type=str, default='127.0.0.1', help='Set address to listen on')
+    serve_parser.add_argument('--port', type=int, default=8080, help='Set port to listen on')
+    serve_parser.add_argument('--max-sessions', type=int, default=1000, help='Set maximum number of open sessions')
+    serve_parser.add_argument('--max-concurrency', type=int, default=16, help='Set maximum number of queries running at once')
+    serve_parser.add_argument('--max-queue', type=int, default=64, help='Set maximum number of queries waiting to run. Queries over it get 429')
+    serve_parser.add_argument('--drain-timeout', type=float, default=30.0, help='Set seconds to wait for running queries on shutdown')
+    serve_parser.add_argument('--persist', action='store_true', help='Store sessions so they can be resumed after a restart')
+    serve_parser.set_defaults(func=serve)
 
     parser.add_argument('--name', type=str, default='Adam', help='Set name of agent')
     parser.add_argument('--platform', default='', help='Set llm platform to use')
@@ -136,7 +236,12 @@ def get_arguments():
     parser.add_argument('--temperature', type=float, default=0.1, help='Set temperature of model')
     parser.add_argument('--system-prompt', type=str_or_file, default='', help='Set system prompt of model. Can be a string or a text file path')
     parser.add_argument('--prompt-template', type=str_or_file, default='', help='Set prompt template of model. Can be a string or a text file path')
+    parser.add_argument('--session', type=str, default='', help='Set id of a stored session to resume, or to create if it does not exist')
     parser.add_argument('--verbose', action='store_true', help='Set verbose mode')
+    parser.add_argument('--stream', action='store_true', help='Print answers while they are generated')
+    parser.add_argument('--compact', action='store_true', help='Summarize older turns of the conversation in the background')
+    parser.add_argument('--compact-platform', type=str, default='', help='Set llm platform used to summarize older turns. Implies --compact')
+    parser.add_argument('--compact-model', type=str, default='', help='Set model used to summarize older turns. Implies --compact')
     parser.add_argument('-v','--version', action='version', version=f'%(prog)s {VERSION}')
     parser.set_defaults(func=start)
     return parser.parse_args()
@@ -5,15 +5,15 @@ VERSION = '0.2.0'
 SPIRAL_WORKDIR = Path('~').expanduser() / '.spiral'
 
 AGENTS_FILE = SPIRAL_WORKDIR / 'agents.json'
+AGENTS_DB = SPIRAL_WORKDIR / 'agents.db'
 CONFIG_FILE = SPIRAL_WORKDIR / 'config.json'
+CACHE_FILE = SPIRAL_WORKDIR / 'cache.db'
+SESSIONS_FILE = SPIRAL_WORKDIR / 'sessions.db'
+IMAGES_DIR = SPIRAL_WORKDIR / 'images'
 
 if not SPIRAL_WORKDIR.exists() and not SPIRAL_WORKDIR.is_dir():
     SPIRAL_WORKDIR.mkdir()
     
-if not AGENTS_FILE.exists() and not AGENTS_FILE.is_file():
-    with open(AGENTS_FILE, 'w') as file:
-        pass
-        
 if not CONFIG_FILE.exists() and not CONFIG_FILE.is_file():
     with open(CONFIG_FILE, 'w') as file:
         pass
\ No newline at end of file
@@ -1,8 +1,44 @@
 from spiral.llms.base import LLM
-from spiral.llms.groq_llm import Groq
-from spiral.llms.cohere_llm import Cohere
-from spiral.llms.openai_llm import OpenAI
-from spiral.llms.google_llm import Gemini
-from spiral.llms.anthropic_llm import Claude
-from spiral.llms.together_llm import Together
-from spiral.llms.clarifai_llm import Clarifai
\ No newline at end of file
+from spiral.llms.conversation import Conversation
+import importlib
+
+PROVIDERS = {
+    'Clarifai': 'spiral.llms.clarifai_llm',
+    'Claude': 'spiral.llms.anthropic_llm',
+    'Cohere': 'spiral.llms.cohere_llm',
+    'Gemini': 'spiral.llms.google_llm',
+    'Groq': 'spiral.llms.groq_llm',
+    'OpenAI': 'spiral.llms.openai_llm',
+    'Together': 'spiral.llms.together_llm',
+}
+"""Llm backends and the modules defining them.
+
+A backend's module, and with it the provider's sdk, is only imported when
+the backend is first used.
+"""
+
+COMPOSITES = {
+    'Router': 'spiral.llms.router',
+}
+"""Llms built from other llms. They are not listed as platforms."""
+
+OFFLINE = {
+    'Echo': 'spiral.llms.echo_llm',
+}
+"""Llms that answer locally, to try out and test agents and the server.
+They can be loaded by name, e.g. --platform echo, but are not listed as platforms."""
+
+__all__ = ['LLM', 'Conversation', *PROVIDERS, *COMPOSITES, *OFFLINE]
+
+
+def __getattr__(name: str):
+    module = PROVIDERS.get(name) or COMPOSITES.get(name) or OFFLINE.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *PROVIDERS, *COMPOSITES, *OFFLINE])
@@ -1,8 +1,9 @@
 from spiral.llms.base import LLM
-from spiral.utils import image_to_base64
-from typing import Any
+from spiral.llms.usage import record_usage
+from spiral.utils import message_image_base64
+from typing import Any, Iterator, AsyncIterator
 from dotenv import load_dotenv
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic
 import logging
 import sys
 import os
@@ -34,9 +35,6 @@ class Claude(LLM):
     temperature: float = 0.1
     """What sampling temperature to use.""" 
     
-    chat_history: list[str] = []
-    """Chat history"""
-    
     api_key: str = os.getenv('ANTHROPIC_API_KEY', '')
     """ANTHROPIC API key""" 
     
@@ -49,9 +47,70 @@ class Claude(LLM):
     is_multimodal: bool = True
     """Whether the model is multimodal."""
     
+    def create_client(self) -> Anthropic:
+        """Creates a pooled Anthropic client"""
+        return Anthropic(
+            api_key=self.api_key,
+            base_url=self.api_base or None,
+            max_retries=0,
+            http_client=self.http_client()
+        )
+    
+    def create_async_client(self) -> AsyncAnthropic:
+        """Creates a pooled async Anthropic client"""
+        return AsyncAnthropic(
+            api_key=self.api_key,
+            base_url=self.api_base or None,
+            max_retries=0,
+            http_client=self.async_http_client()
+        )
+    
+    def format_message(self, message: dict) -> dict:
+        """Formats a single chat history message for the Claude API.
+
+        Args:
+            message (dict): The message to be formatted.
+
+        Returns:
+            dict: The formatted message.
+        """
+        
+        if message['type'] == 'text':
+            return {
+                "role": message['role'].lower(),
+                "content": [
+                    {
+                        "type": "text",
+                        "text": message['message']
+                    }
+                ]
+            }
+        
+        base64_image = message_image_base64(message)
+        return {
+            "role": message['role'].lower(),
+            "content": [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": "image/jpeg",
+                        "data": base64_image 
+                    }
+                },
+                {
+                    "type": "text",
+                    "text": "This is the result of the latest screenshot"
+                }
+            ]
+        }
+    
     def format_query(self, message: dict[str, str]) -> list:
         """Formats a message for the Claude API.
 
+        Only the query is formatted here, the chat history is formatted
+        once per message and cached.
+
         Args:
             message (dict[str, str]): The message to be formatted for the Claude API.
 
@@ -59,44 +118,22 @@ class Claude(LLM):
             list: A list of formatted messages for the Claude API.
         """
         
-        formatted_message = [*self.chat_history, message]
-        
-        messages = []
-        
-        for fm in formatted_message:
-            if fm['type'] == 'text':
-                messages.append({
-                    "role": fm['role'].lower(),
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": fm['message']
-                        }
-                    ]
-                })
-            else:
-                base64_image = image_to_base64(fm['image'])
-                messages.append({
-                    "role": fm['role'].lower(),
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": base64_image 
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": "This is the result of the latest screenshot"
-                        }
-                    ]
-                })
-            
-        return messages
-
-    def __call__(self, query: dict, **kwds: Any)->str|None:
+        return [*self.formatted_history(message), self.format_message(message)]
+
+    def request_params(self, query: dict) -> dict:
+        """Builds the messages api parameters for a query"""
+        params = {
+            'model': self.model,
+            'max_tokens': self.max_tokens,
+            'temperature': self.temperature,
+            'system': self.system_prompt,
+            'messages': self.format_query(query)
+        }
+        if self.stop_sequences:
+            params['stop_sequences'] = self.stop_sequences
+        return params
+
+    def _call(self, query: dict, **kwds: Any)->str|None:
         """Generates a response to a query using the Claude API.
 
         Args:
@@ -107,13 +144,57 @@ class Claude(LLM):
             str|None: A string containing the generated response.
         """
 
-        client = Anthropic(api_key=self.api_key)
-        result = client.messages.create(
-            model=self.model,
-            max_tokens=self.max_tokens,
-            temperature=self.temperature,
-            system=self.system_prompt,
-            messages=self.format_query(query)
-        )
+        result = self.client.messages.create(**self.request_params(query))
+
+        if result.usage:
+            record_usage(result.usage.input_tokens, result.usage.output_tokens)
+        
+        return result.content[0].text
+
+    async def _acall(self, query: dict, **kwds: Any)->str|None:
+        """Generates a response to a query using the async Claude client.
+
+        Args:
+            query (dict): The query to generate a response to.
+            kwds (dict): Additional keyword arguments to pass to the Claude API.
+
+        Returns:
+            str|None: A string containing the generated response.
+        """
+
+        result = await self.aclient.messages.create(**self.request_params(query))
+
+        if result.usage:
+            record_usage(result.usage.input_tokens, result.usage.output_tokens)
         
-        return result.content[0].text
\ No newline at end of file
+        return result.content[0].text
+
+    def _stream(self, query: dict, **kwds: Any)->Iterator[str]:
+        """Streams the response to a query using the Claude API.
+
+        Args:
+            query (dict): The query to generate a response to.
+            kwds (dict): Additional keyword arguments to pass to the Claude API.
+
+        Yields:
+            str: Text deltas of the generated response.
+        """
+
+        with self.client.messages.stream(**self.request_params(query)) as stream:
+            for text in stream.text_stream:
+                yield text
+
+    async def _astream(self, query: dict, **kwds: Any)->AsyncIterator[str]:
+        """Streams the response to a query using the async Claude client.
+
+        Args:
+            query (dict): The query to generate a response to.
+            kwds (dict): Additional keyword arguments to pass to the Claude API.
+
+        Yields:
+            str: Text deltas of the generated response.
+        """
+
+        async with self.aclient.messages.stream(**self.request_params(query)) as stream:
+            async for text in stream.text_stream:
+                yield text
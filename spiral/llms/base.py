@@ -1,9 +1,23 @@
-from pydantic import BaseModel, Field
-from typing import Any, List, Dict
-from pathlib import Path
+from pydantic import BaseModel, Field, field_validator
+from typing import Any, List, Dict, Iterator, AsyncIterator, Optional, Sequence, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import aclosing, closing
+import threading
 import logging
+import importlib
 import inspect
-import sys
+import asyncio
+import weakref
+import atexit
+import time
+
+from spiral.llms.history import ChatHistory
+from spiral.llms.conversation import Conversation
+from spiral.llms.context import ContextWindow, count_tokens
+from spiral.llms.cache import ResponseCache, request_key
+from spiral.llms.singleflight import SingleFlight
+from spiral.llms.ratelimit import RateLimit, RateLimiter, RetryPolicy, get_limiter, get_status_code, is_retryable
+from spiral.utils.loop import run_coroutine, loop_running
 
 logging.basicConfig(
     format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
@@ -12,6 +26,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger('spiral.log')
 
+_clients: Dict[tuple, Any] = {}
+"""Provider clients shared between LLM instances, keyed by LLM.client_key()"""
+
+_clients_lock = threading.Lock()
+
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+"""Async provider clients, keyed by event loop and then by LLM.client_key()"""
+
+_flights = SingleFlight()
+"""Identical requests in flight, shared by all LLM instances"""
+
 PROMPT_TEMPLATE = """
 You are a helpful, respectful and honest assistant.
 Always answer as helpfully as possible, while being safe.
@@ -81,7 +106,7 @@ class LLM(BaseModel):
         model (str): The name of the OpenAI model to use
         temperature (float): The temperature to use when generating text
         api_key (str): Your OpenAI API key
-        chat_history (list): Chat history
+        chat_history (list): Chat history, used when a call is not given a Conversation
         max_tokens (int): The maximum number of tokens to generate in the completion
         supports_system_prompt (bool): Flag to indicate if system prompt should be supported
         system_prompt (str): System prompt to prepend to queries
@@ -111,35 +136,596 @@ class LLM(BaseModel):
     platform: str = Field(default="")
     """This is set to the name of the class"""
     
-    chat_history: List[Dict[str, str]] = []
+    chat_history: List[Dict[str, Any]] = Field(default_factory=ChatHistory)
     """Chat history stored as a list of responses"""
     
+    context_window: Optional[ContextWindow] = Field(default_factory=ContextWindow)
+    """Keeps the chat history sent within the model's context window, for models of known size. None sends all of it."""
+    
+    stop_sequences: List[str] = Field(default=[])
+    """Sequences where the model stops generating, on platforms that support them."""
+    
+    api_base: str = Field(default='')
+    """Base url of the api. Set if using a local or proxied llm."""
+    
+    max_connections: int = Field(default=100)
+    """Maximum number of open connections in the client pool."""
+    
+    max_keepalive_connections: int = Field(default=20)
+    """Maximum number of idle connections kept alive in the client pool."""
+    
+    keepalive_expiry: float = Field(default=60.0)
+    """Seconds an idle connection is kept alive before it is closed."""
+    
+    request_timeout: float = Field(default=600.0)
+    """Seconds to wait for the api before timing out."""
+    
+    rate_limit: Optional[RateLimit] = Field(default=None)
+    """Rate limits of the provider for the model, shared by all instances with the same platform and model."""
+    
+    retry: Optional[RetryPolicy] = Field(default_factory=RetryPolicy)
+    """Retries of rate limited and transient errors. None disables retries."""
+    
+    cache: Optional[ResponseCache] = Field(default=None)
+    """Caches responses to identical requests. None disables caching."""
+    
+    coalesce: bool = Field(default=True)
+    """Share one request between concurrent callers of an identical request at temperature 0."""
+    
     def __init__(self, **data):
         super().__init__(**data)
         self.platform = self.__class__.__name__
     
+    @field_validator('chat_history')
+    @classmethod
+    def validate_chat_history(cls, value: list) -> ChatHistory:
+        """Keeps chat_history a ChatHistory so formatted messages can be cached"""
+        return value if isinstance(value, ChatHistory) else ChatHistory(value)
+    
+    def format_message(self, message: dict) -> Any:
+        """Formats a single chat history message for the platform's api"""
+        return message
+    
+    def formatted_history(self, query: Optional[dict] = None) -> list:
+        """Returns chat_history formatted for the platform's api.
+
+        Formatted messages are cached on the history, so each turn only
+        formats the messages added since the last one. The context_window
+        then selects the messages that fit alongside the query. Do not
+        modify the returned list.
+
+        Args:
+            query (dict, optional): The query sent with the history
+        """
+        if not isinstance(self.chat_history, ChatHistory):
+            self.chat_history = ChatHistory(self.chat_history)
+        formatted = self.chat_history.formatted(self.platform, self.format_message)
+        if self.context_window is None:
+            return formatted
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return self.context_window.fit(self, formatted, query)
+        # On the event loop the summary was made by asummarize_history(), so the loop is not blocked
+        return self.context_window.fit(self, formatted, query, summarize=False)
+    
+    async def asummarize_history(self, query: Any = None):
+        """Merges older messages into the history's running summary, if the context window needs it.
+
+        Requests are formatted in sync code, so async requests call this
+        first to await the summarizer instead of blocking the event loop.
+
+        Args:
+            query (Any, optional): The query sent with the history
+        """
+        if self.context_window is None or not isinstance(self.chat_history, ChatHistory):
+            return
+        span = self.context_window.summary_span(self, query if isinstance(query, dict) else None)
+        if span:
+            await self.context_window.asummarize(self.chat_history, *span)
+    
+    def client_key(self) -> tuple:
+        """Key under which the provider client is shared.
+
+        Instances with the same key reuse one client (and its connection
+        pool) across turns and across agents. Pool settings are taken from
+        the instance that first creates the client.
+        """
+        return (self.platform, self.api_key, self.api_base)
+    
+    def create_client(self) -> Any:
+        """Creates the provider sdk client. Called once per client_key()"""
+        raise NotImplementedError(f"{self.platform} does not provide a client")
+    
+    @property
+    def client(self) -> Any:
+        """Lazily created provider client shared by all matching instances"""
+        key = self.client_key()
+        client = _clients.get(key)
+        if client is None:
+            with _clients_lock:
+                client = _clients.get(key)
+                if client is None:
+                    client = self.create_client()
+                    _clients[key] = client
+        return client
+    
+    def create_async_client(self) -> Any:
+        """Creates the async provider sdk client. Called once per client_key() and event loop"""
+        raise NotImplementedError(f"{self.platform} does not provide an async client")
+    
+    @property
+    def aclient(self) -> Any:
+        """Lazily created async provider client shared within the running event loop.
+
+        Async clients hold connections bound to the loop they were created
+        in, so each event loop gets its own pool.
+        """
+        loop = asyncio.get_running_loop()
+        clients = _async_clients.setdefault(loop, {})
+        key = self.client_key()
+        client = clients.get(key)
+        if client is None:
+            client = self.create_async_client()
+            clients[key] = client
+        return client
+    
+    def http_limits(self) -> Any:
+        """Connection pool limits for httpx based clients"""
+        import httpx
+        
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+    
+    def http_client(self) -> Any:
+        """Creates a keep-alive httpx client using the configured pool limits"""
+        import httpx
+        
+        return httpx.Client(limits=self.http_limits(), timeout=self.request_timeout)
+    
+    def async_http_client(self) -> Any:
+        """Creates a keep-alive async httpx client using the configured pool limits"""
+        import httpx
+        
+        return httpx.AsyncClient(limits=self.http_limits(), timeout=self.request_timeout)
+    
+    def limiter(self) -> Optional[RateLimiter]:
+        """The shared rate limiter of the platform and model, if rate_limit is set"""
+        if self.rate_limit is None:
+            return None
+        return get_limiter((self.platform, self.model), self.rate_limit)
+    
+    def estimate_tokens(self, query: Any) -> int:
+        """Estimates the tokens a request uses, for tokens per minute limits.
+
+        Providers count max_tokens against the limit up front, so it is
+        included along with the query and the chat history sent.
+        """
+        tokens = count_tokens(str(query)) + self.max_tokens
+        if self.context_window is not None and isinstance(self.chat_history, ChatHistory):
+            history_tokens = sum(self.context_window.token_counts(self.chat_history))
+            tokens += max(min(history_tokens, self.context_window.budget(self)), 0)
+        return tokens
+    
+    def retry_delay(self, error: Exception, attempt: int, limiter: Optional[RateLimiter] = None) -> Optional[float]:
+        """Seconds to wait before retrying a failed request, or None if it should not be retried.
+
+        Rate limit errors also pause the other requests to the same quota
+        for the delay, so they do not run into the limit as well.
+
+        Args:
+            error (Exception): The error the request failed with
+            attempt (int): Number of retries made so far
+            limiter (RateLimiter, optional): The rate limiter of the request
+        """
+        if self.retry is None or attempt >= self.retry.max_retries or not is_retryable(error):
+            return None
+        delay = self.retry.delay(attempt, error)
+        if limiter and get_status_code(error) == 429:
+            limiter.pause(delay)
+        logger.warning(f"{self.platform} request failed ({error}), retrying in {delay:.1f}s")
+        return delay
+    
+    def bind(self, conversation: Optional[Conversation]) -> 'LLM':
+        """Copy of the llm that uses a conversation's history, system prompt and settings.
+
+        The copy shares the llm's api clients, rate limiter and caches, and
+        is cheap to make, so it can be made for every request.
+        """
+        if conversation is None:
+            return self
+        return self.model_copy(update=conversation.settings())
+    
+    def cache_key(self, query: Any) -> Optional[str]:
+        """Key of a request in the response cache, or None if caching is disabled"""
+        if self.cache is None:
+            return None
+        return request_key(self, query)
+    
+    def cache_response(self, query: Any, response: str):
+        """Caches a response to a query, e.g. one read from a stream that was closed early.
+
+        Must be called before the query and response are added to the chat history.
+        """
+        key = self.cache_key(query)
+        if key and isinstance(response, str):
+            self.cache.set(key, response) # type: ignore
+    
+    def coalesces(self, kwds: dict) -> bool:
+        """Whether concurrent identical requests share one request.
+
+        Applies to __call__(), acall() and astream(), which agents use.
+        Sync streams are not coalesced. Requests sampled at a temperature
+        above 0 are expected to give different responses, so they are
+        never coalesced.
+        """
+        return self.coalesce and self.temperature == 0 and not kwds
+    
+    def __call__(self, query: Any, conversation: Optional[Conversation] = None, **kwds: Any) -> Any:
+        """Generates a response to a query.
+
+        Returns a cached response to the same request if there is one, or
+        shares the response of an identical request in flight. Otherwise
+        waits for the rate limit, if any, and retries rate limited and
+        transient errors according to retry.
+
+        Args:
+            query (Any): The query
+            conversation (Conversation, optional): Conversation the query belongs to.
+                Defaults to the llm's own chat history and settings.
+        """
+        if conversation is not None:
+            return self.bind(conversation)(query, **kwds)
+        
+        key = request_key(self, query) if self.cache is not None or self.coalesces(kwds) else None
+        if key and self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        
+        if key and self.coalesces(kwds):
+            response = _flights.do(key, lambda: self._send(query, **kwds))
+        else:
+            response = self._send(query, **kwds)
+        
+        if key and self.cache is not None and isinstance(response, str):
+            self.cache.set(key, response)
+        return response
+    
+    async def acall(self, query: Any, conversation: Optional[Conversation] = None, **kwds: Any) -> Any:
+        """Async version of __call__()"""
+        if conversation is not None:
+            return await self.bind(conversation).acall(query, **kwds)
+        
+        await self.asummarize_history(query)
+        key = request_key(self, query) if self.cache is not None or self.coalesces(kwds) else None
+        if key and self.cache is not None:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                return cached
+        
+        if key and self.coalesces(kwds):
+            response = await _flights.ado(key, lambda: self._asend(query, **kwds))
+        else:
+            response = await self._asend(query, **kwds)
+        
+        if key and self.cache is not None and isinstance(response, str):
+            await self.cache.aset(key, response)
+        return response
+    
+    def _send(self, query: Any, **kwds: Any) -> Any:
+        """Sends a request, waiting for the rate limit and retrying errors"""
+        attempt = 0
+        while True:
+            limiter = self.limiter()
+            if limiter:
+                limiter.acquire(self.estimate_tokens(query))
+            try:
+                return self._call(query, **kwds)
+            except Exception as e:
+                delay = self.retry_delay(e, attempt, limiter)
+                if delay is None:
+                    raise
+            finally:
+                if limiter:
+                    limiter.release()
+            time.sleep(delay)
+            attempt += 1
+    
+    async def _asend(self, query: Any, **kwds: Any) -> Any:
+        """Async version of _send()"""
+        attempt = 0
+        while True:
+            limiter = self.limiter()
+            if limiter:
+                await limiter.aacquire(self.estimate_tokens(query))
+            try:
+                return await self._acall(query, **kwds)
+            except Exception as e:
+                delay = self.retry_delay(e, attempt, limiter)
+                if delay is None:
+                    raise
+            finally:
+                if limiter:
+                    limiter.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    def stream(self, query: Any, conversation: Optional[Conversation] = None, **kwds: Any) -> Iterator[str]:
+        """Yields the response to a query as text deltas while it is generated.
+
+        Like __call__(), yields a cached response at once, waits for the
+        rate limit and retries errors, as long as no text has been yielded
+        yet. Only streams read to the end are cached.
+        """
+        if conversation is not None:
+            with closing(self.bind(conversation).stream(query, **kwds)) as deltas:
+                yield from deltas
+            return
+        
+        key = self.cache_key(query)
+        if key:
+            cached = self.cache.get(key) # type: ignore
+            if cached is not None:
+                yield cached
+                return
+        
+        attempt = 0
+        while True:
+            limiter = self.limiter()
+            if limiter:
+                limiter.acquire(self.estimate_tokens(query))
+            started = False
+            response = []
+            try:
+                with closing(self._stream(query, **kwds)) as deltas:
+                    for delta in deltas:
+                        started = True
+                        response.append(delta)
+                        yield delta
+                if key:
+                    self.cache.set(key, ''.join(response)) # type: ignore
+                return
+            except Exception as e:
+                delay = None if started else self.retry_delay(e, attempt, limiter)
+                if delay is None:
+                    raise
+            finally:
+                if limiter:
+                    limiter.release()
+            time.sleep(delay)
+            attempt += 1
+    
+    async def astream(self, query: Any, conversation: Optional[Conversation] = None, **kwds: Any) -> AsyncIterator[str]:
+        """Async version of stream().
+
+        Concurrent identical streams are coalesced like acall(): callers
+        that arrive while the stream is in flight get the deltas produced
+        so far at once, and the rest as they arrive.
+        """
+        if conversation is not None:
+            async with aclosing(self.bind(conversation).astream(query, **kwds)) as deltas:
+                async for delta in deltas:
+                    yield delta
+            return
+        
+        await self.asummarize_history(query)
+        key = request_key(self, query) if self.cache is not None or self.coalesces(kwds) else None
+        if key and self.cache is not None:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                yield cached
+                return
+        
+        if key and self.coalesces(kwds):
+            stream = _flights.astream(key, lambda: self._astream_send(query, key, **kwds))
+        else:
+            stream = self._astream_send(query, key, **kwds)
+        async with aclosing(stream) as deltas:
+            async for delta in deltas:
+                yield delta
+    
+    async def _astream_send(self, query: Any, key: Optional[str], **kwds: Any) -> AsyncIterator[str]:
+        """Streams a request, waiting for the rate limit and retrying errors until text is received"""
+        attempt = 0
+        while True:
+            limiter = self.limiter()
+            if limiter:
+                await limiter.aacquire(self.estimate_tokens(query))
+            started = False
+            response = []
+            try:
+                async with aclosing(self._astream(query, **kwds)) as deltas:
+                    async for delta in deltas:
+                        started = True
+                        response.append(delta)
+                        yield delta
+                if key and self.cache is not None:
+                    await self.cache.aset(key, ''.join(response))
+                return
+            except Exception as e:
+                delay = None if started else self.retry_delay(e, attempt, limiter)
+                if delay is None:
+                    raise
+            finally:
+                if limiter:
+                    limiter.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    def _call(self, query: Any, **kwds: Any) -> Any:
+        """Sends a request to the platform's api. Implemented by each backend."""
+        raise NotImplementedError(f"{self.platform} does not implement _call")
+    
+    async def _acall(self, query: Any, **kwds: Any) -> Any:
+        """Async version of _call().
+
+        Backends with an async sdk client override this. The default runs
+        the blocking call in a worker thread.
+        """
+        return await asyncio.to_thread(self._call, query, **kwds)
+    
+    def _stream(self, query: Any, **kwds: Any) -> Iterator[str]:
+        """Streams a request to the platform's api.
+
+        Backends that can stream override this. The default yields the
+        complete response once.
+        """
+        yield self._call(query, **kwds)
+    
+    async def _astream(self, query: Any, **kwds: Any) -> AsyncIterator[str]:
+        """Async version of _stream()"""
+        yield await self._acall(query, **kwds)
+    
+    def batch(self, queries: Sequence[Any], max_concurrency: int = 8, return_exceptions: bool = False) -> List[Any]:
+        """Generates responses to many independent queries concurrently.
+
+        Queries are sent over the shared client's connection pool from a
+        pool of worker threads. Each query is answered on its own, together
+        with the chat history, which is not modified.
+
+        Args:
+            queries (Sequence[Any]): The queries
+            max_concurrency (int, optional): Maximum number of requests in flight. Defaults to 8.
+            return_exceptions (bool, optional): Return failures as exceptions in the results
+                instead of raising the first one. Defaults to False.
+
+        Returns:
+            List[Any]: The responses, in the order of the queries
+        """
+        results: List[Any] = [None] * len(queries)
+        for index, result in self.batch_as_completed(queries, max_concurrency, return_exceptions):
+            results[index] = result
+        return results
+    
+    def batch_as_completed(self, queries: Sequence[Any], max_concurrency: int = 8, return_exceptions: bool = False) -> Iterator[Tuple[int, Any]]:
+        """Like batch(), but yields (index, response) pairs as soon as each response is ready.
+
+        Requests that have not started are cancelled when the iterator is
+        closed or a query fails.
+        """
+        if not queries:
+            return
+        # The queries share the chat history. Format, count and hash it once
+        # here, instead of in every worker thread.
+        self.formatted_history()
+        if self.cache is not None or self.coalesces({}):
+            request_key(self, None)
+        workers = max(1, min(max_concurrency, self.max_connections, len(queries)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"spiral-{self.platform}") as executor:
+            futures = {executor.submit(self, query): index for index, query in enumerate(queries)}
+            try:
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if not return_exceptions:
+                            raise
+                        result = e
+                    yield futures[future], result
+            finally:
+                for future in futures:
+                    future.cancel()
+    
+    async def abatch(self, queries: Sequence[Any], max_concurrency: int = 8, return_exceptions: bool = False) -> List[Any]:
+        """Async version of batch(), sending the queries with the async client.
+
+        Args:
+            queries (Sequence[Any]): The queries
+            max_concurrency (int, optional): Maximum number of requests in flight. Defaults to 8.
+            return_exceptions (bool, optional): Return failures as exceptions in the results
+                instead of raising the first one. Defaults to False.
+
+        Returns:
+            List[Any]: The responses, in the order of the queries
+        """
+        results: List[Any] = [None] * len(queries)
+        async for index, result in self.abatch_as_completed(queries, max_concurrency, return_exceptions):
+            results[index] = result
+        return results
+    
+    async def abatch_as_completed(self, queries: Sequence[Any], max_concurrency: int = 8, return_exceptions: bool = False) -> AsyncIterator[Tuple[int, Any]]:
+        """Async version of batch_as_completed()"""
+        semaphore = asyncio.Semaphore(max(1, min(max_concurrency, self.max_connections)))
+        
+        async def run(index: int, query: Any) -> Tuple[int, Any]:
+            async with semaphore:
+                try:
+                    return index, await self.acall(query)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    return index, e
+        
+        tasks = [asyncio.ensure_future(run(index, query)) for index, query in enumerate(queries)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    @staticmethod
+    def close_clients():
+        """Close all shared provider clients and their connection pools,
+        including the async ones of the background loop sync callers like Agent.run() use"""
+        with _clients_lock:
+            clients = list(_clients.values())
+            _clients.clear()
+        
+        if loop_running():
+            try:
+                run_coroutine(LLM.aclose_clients(), timeout=5)
+            except Exception as e:
+                logger.warning(str(e))
+        
+        for client in clients:
+            close = getattr(client, 'close', None) or getattr(getattr(client, 'transport', None), 'close', None)
+            if callable(close):
+                try:
+                    close()
+                except Exception as e:
+                    logger.warning(str(e))
+    
+    @staticmethod
+    async def aclose_clients():
+        """Close the async provider clients created in the running event loop"""
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+        
+        for client in clients.values():
+            close = getattr(client, 'close', None) or getattr(getattr(client, 'transport', None), 'close', None)
+            if callable(close):
+                try:
+                    result = close()
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.warning(str(e))
+    
     @staticmethod
     def list_llms():
         """List all supported LLMs"""
-        try:
-            module_path = Path(__file__, '..').resolve()
-            sys.path.append(str(module_path))
-            module = __import__(str(inspect.getmodulename(Path('__init__.py'))))
-            return [f[0] for f in inspect.getmembers(module, inspect.isclass) if f[0] != 'LLM']
-        except Exception as e:
-            logging.error(str(e))
-            return []
+        from spiral.llms import PROVIDERS
+        return list(PROVIDERS)
     
     @staticmethod
     def load_llm(model_name: str):
-        """Dynamically load LLMs based on name"""
+        """Load an LLM backend by name, importing only its module"""
+        from spiral.llms import PROVIDERS, OFFLINE
         try:
-            model_name = model_name.lower()
-            module_path = Path(__file__, '..').resolve()
-            sys.path.append(str(module_path))
-            module = __import__(str(inspect.getmodulename(Path('__init__.py'))))
-            llm: type[LLM] = [f[1] for f in inspect.getmembers(module, inspect.isclass) if f[0].lower() == model_name][0]
+            modules = {**PROVIDERS, **OFFLINE}
+            names = {name.lower(): name for name in modules}
+            name = names[model_name.lower()]
+            llm: type[LLM] = getattr(importlib.import_module(modules[name]), name)
             return llm
+        except KeyError:
+            logging.error(f"Unknown platform: {model_name}")
+            return None
         except Exception as e:
             logging.error(str(e))
-            return None
\ No newline at end of file
+            return None
+
+atexit.register(LLM.close_clients)
\ No newline at end of file
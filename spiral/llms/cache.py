@@ -0,0 +1,264 @@
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Any, Optional, TYPE_CHECKING
+from collections import OrderedDict
+from PIL import Image
+import threading
+import logging
+import sqlite3
+import asyncio
+import hashlib
+import json
+import time
+
+from spiral.config import CACHE_FILE
+from spiral.llms.history import ChatHistory
+from spiral.utils import image_cache
+
+if TYPE_CHECKING:
+    from spiral.llms.base import LLM
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+
+def message_digest(message: Any) -> str:
+    """Stable hash of a chat history message or query. Images are hashed by content."""
+    def default(value: Any) -> str:
+        if isinstance(value, Image.Image):
+            return f"image:{image_cache.digest(value)}"
+        return repr(value)
+
+    if isinstance(message, dict) and message.get('type') == 'image' and message.get('image') is not None:
+        # The encoded data of an image message is derived from the image
+        message = {key: value for key, value in message.items() if key != 'data'}
+    encoded = json.dumps(message, sort_keys=True, default=default)
+    return hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest()
+
+
+def request_key(llm: 'LLM', query: Any) -> str:
+    """Stable hash of everything that determines an llm's response to a query.
+
+    Covers the platform, model and generation settings, the system prompt,
+    the chat history with its summary, and the query. The hashes of the
+    history messages are cached on the history, so only new messages are
+    hashed.
+    """
+    hasher = hashlib.blake2b(digest_size=20)
+    header = [
+        llm.platform, llm.model, llm.temperature, llm.max_tokens,
+        llm.system_prompt, llm.stop_sequences, llm.api_base
+    ]
+    hasher.update(json.dumps(header, default=repr).encode())
+
+    history = llm.chat_history
+    if isinstance(history, ChatHistory):
+        digests = history.formatted('digest', message_digest)
+        hasher.update(f"{history.summary_index}:{history.summary}".encode())
+    else:
+        digests = [message_digest(message) for message in history]
+    for digest in digests:
+        hasher.update(digest.encode())
+
+    hasher.update(b'query:')
+    hasher.update(message_digest(query).encode())
+    return hasher.hexdigest()
+
+
+class ResponseCache(BaseModel):
+    """Cache of llm responses with an in-memory LRU tier and a persistent SQLite tier.
+
+    Responses are keyed by request_key(), so a response is only reused for
+    exactly the same request. Caching is opt-in: set LLM.cache. Responses
+    are reused whatever the temperature, so it is best suited to
+    temperature 0 workloads.
+
+    Example:
+        llm = OpenAI(temperature=0, cache=ResponseCache(ttl=24 * 3600))
+
+    Args:
+        max_entries (int): Maximum responses kept in memory
+        persistent (bool): Whether responses are also stored on disk
+        path (str, optional): SQLite database file. Defaults to CACHE_FILE.
+        max_disk_entries (int): Maximum responses kept on disk
+        ttl (float, optional): Seconds a response stays valid. None keeps responses until evicted.
+    """
+
+    max_entries: int = Field(default=1024)
+    """Maximum responses kept in memory"""
+
+    persistent: bool = Field(default=True)
+    """Whether responses are also stored on disk, and shared between processes"""
+
+    path: Optional[str] = Field(default=None)
+    """SQLite database file of the disk tier. Defaults to CACHE_FILE in SPIRAL_WORKDIR."""
+
+    max_disk_entries: int = Field(default=100_000)
+    """Maximum responses kept on disk"""
+
+    ttl: Optional[float] = Field(default=None)
+    """Seconds a response stays valid. None keeps responses until they are evicted."""
+
+    _memory: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _connection: Optional[sqlite3.Connection] = PrivateAttr(default=None)
+    _writes: int = PrivateAttr(default=0)
+    _stats: dict = PrivateAttr(default_factory=lambda: {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0})
+
+    def __deepcopy__(self, memo: Optional[dict] = None) -> 'ResponseCache':
+        # The cache is shared, copies of an llm keep using it
+        return self
+
+    @property
+    def stats(self) -> dict:
+        """Hit and miss counters"""
+        with self._lock:
+            return dict(self._stats, memory_entries=len(self._memory))
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached response of a request, or None"""
+        now = time.time()
+        with self._lock:
+            response = self._memory_get(key, now)
+            if response is not None:
+                return response
+            response = self._disk_get(key, now)
+            if response is None:
+                self._stats['misses'] += 1
+            else:
+                self._stats['hits'] += 1
+                self._stats['disk_hits'] += 1
+            return response
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Async version of get(). The disk tier is read in a worker thread."""
+        now = time.time()
+        with self._lock:
+            response = self._memory_get(key, now)
+            if response is not None or not self.persistent:
+                if response is None:
+                    self._stats['misses'] += 1
+                return response
+        return await asyncio.to_thread(self.get, key)
+
+    def set(self, key: str, response: str):
+        """Caches the response of a request"""
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._memory_set(key, response, expires)
+            if self.persistent:
+                self._disk_set(key, response, expires)
+
+    async def aset(self, key: str, response: str):
+        """Async version of set(). The disk tier is written in a worker thread."""
+        if not self.persistent:
+            self.set(key, response)
+            return
+        await asyncio.to_thread(self.set, key, response)
+
+    def clear(self):
+        """Removes all cached responses from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            connection = self._disk()
+            if connection:
+                with connection:
+                    connection.execute("DELETE FROM responses")
+
+    def close(self):
+        """Closes the disk tier's database connection"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _memory_get(self, key: str, now: float) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        response, expires = entry
+        if expires is not None and expires <= now:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        self._stats['hits'] += 1
+        self._stats['memory_hits'] += 1
+        return response
+
+    def _memory_set(self, key: str, response: str, expires: Optional[float]):
+        self._memory[key] = (response, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        """Opens the database on first use. Called with the lock held."""
+        if not self.persistent:
+            return None
+        if self._connection is None:
+            try:
+                connection = sqlite3.connect(self.path or str(CACHE_FILE), check_same_thread=False, timeout=5.0)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, response TEXT NOT NULL, expires REAL, accessed REAL NOT NULL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+                connection.commit()
+                self._connection = connection
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache disk tier disabled: {e}")
+                self.persistent = False
+                return None
+        return self._connection
+
+    def _disk_get(self, key: str, now: float) -> Optional[str]:
+        connection = self._disk()
+        if connection is None:
+            return None
+        try:
+            row = connection.execute("SELECT response, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, expires = row
+            with connection:
+                if expires is not None and expires <= now:
+                    connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache read failed: {e}")
+            return None
+        self._memory_set(key, response, expires)
+        return response
+
+    def _disk_set(self, key: str, response: str, expires: Optional[float]):
+        connection = self._disk()
+        if connection is None:
+            return
+        now = time.time()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, expires, accessed) VALUES (?, ?, ?, ?)",
+                    (key, response, expires, now)
+                )
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    self._trim(connection, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache write failed: {e}")
+
+    def _trim(self, connection: sqlite3.Connection, now: float):
+        """Removes expired responses and the least recently used ones over max_disk_entries"""
+        connection.execute("DELETE FROM responses WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        count = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_disk_entries:
+            connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                (count - self.max_disk_entries,)
+            )
@@ -29,13 +29,21 @@ class Clarifai(LLM):
     temperature: float = 0.1
     """What sampling temperature to use.""" 
     
-    chat_history: list[str] = []
-    """Chat history"""
-    
     api_key: str = os.getenv('CLARIFAI_API_KEY', '')
     """Clarifai Personal Access Token""" 
+    
+    def client_key(self) -> tuple:
+        """Clarifai clients are bound to a model url"""
+        return (*super().client_key(), self.model)
+    
+    def create_client(self) -> Model:
+        """Creates a Clarifai model client"""
+        kwargs = {'url': self.model, 'pat': self.api_key or None}
+        if self.api_base:
+            kwargs['base_url'] = self.api_base
+        return Model(**kwargs)
 
-    def __call__(self, query, **kwds: Any)->str:
+    def _call(self, query, **kwds: Any)->str:
         """Generates a response to a query using the Clarifai API.
 
         Args:
@@ -46,9 +54,8 @@ class Clarifai(LLM):
         A string containing the generated response.
         """
 
-        client = Model(url=self.model)
         query = f"<s> [INST] {query} [/INST]"
-        result = client.predict_by_bytes(query.encode(), input_type="text")
+        result = self.client.predict_by_bytes(query.encode(), input_type="text")
             
         return result.outputs[0].data.text.raw
     
\ No newline at end of file
@@ -1,6 +1,6 @@
 import cohere
 from spiral.llms.base import LLM
-from typing import Any, Optional
+from typing import Any, Optional, Iterator, AsyncIterator
 from dotenv import load_dotenv
 import logging
 import sys
@@ -36,6 +36,22 @@ class Cohere(LLM):
     api_key: str = os.getenv('CO_API_KEY', '')
     """Cohere API key""" 
     
+    def create_client(self) -> cohere.Client:
+        """Creates a Cohere client. The api key is only checked once."""
+        return cohere.Client(
+            api_key=self.api_key,
+            api_url=self.api_base or None,
+            timeout=int(self.request_timeout)
+        )
+    
+    def create_async_client(self) -> cohere.AsyncClient:
+        """Creates an async Cohere client"""
+        return cohere.AsyncClient(
+            api_key=self.api_key,
+            api_url=self.api_base or None,
+            timeout=int(self.request_timeout)
+        )
+    
     def format_query(self, message: str) -> str:
         """Formats a message for the Cohere API"""
 
@@ -43,7 +59,26 @@ class Cohere(LLM):
 
         return formatted_message
 
-    def __call__(self, query, **kwds: Any)->str:
+    def format_message(self, message: dict) -> dict:
+        """Formats a single chat history message for the Cohere API"""
+        return {
+            'role': 'CHATBOT' if message['role'].lower() == 'assistant' else 'USER',
+            'message': message.get('message', '')
+        }
+
+    def request_params(self, query) -> dict:
+        """Builds the chat parameters for a query"""
+        return {
+            'model': self.model,
+            'message': query['message'],
+            'temperature': self.temperature,
+            'chat_history': self.formatted_history(query),
+            'prompt_truncation': 'auto',
+            'citation_quality': 'accurate',
+            'connectors': [{"id": "web-search"}]
+        }
+
+    def _call(self, query, **kwds: Any)->str:
         """Generates a response to a query using the Cohere API.
 
         Args:
@@ -53,19 +88,59 @@ class Cohere(LLM):
         Returns:
         A string containing the generated response.
         """
-        client = cohere.Client(api_key=self.api_key)
-        response = client.chat( 
-            model=self.model,
-            message=query['message'],
-            temperature=self.temperature,
-            chat_history=self.chat_history,
-            prompt_truncation='auto',
-            stream=False,
-            citation_quality='accurate',
-            connectors=[{"id": "web-search"}]
-        )
+        response = self.client.chat(**self.request_params(query), stream=False)
+        
+        return response.text
+
+    async def _acall(self, query, **kwds: Any)->str:
+        """Generates a response to a query using the async Cohere client.
+
+        Args:
+        query: The query to generate a response to.
+        kwds: Additional keyword arguments to pass to the Cohere API.
+
+        Returns:
+        A string containing the generated response.
+        """
+        response = await self.aclient.chat(**self.request_params(query), stream=False)
         
         return response.text
+
+    def _stream(self, query, **kwds: Any)->Iterator[str]:
+        """Streams the response to a query using the Cohere API.
+
+        Args:
+        query: The query to generate a response to.
+        kwds: Additional keyword arguments to pass to the Cohere API.
+
+        Yields:
+        Text deltas of the generated response.
+        """
+        response = self.client.chat(**self.request_params(query), stream=True)
+        try:
+            for event in response:
+                if event.event_type == 'text-generation':
+                    yield event.text
+        finally:
+            response.response.close()
+
+    async def _astream(self, query, **kwds: Any)->AsyncIterator[str]:
+        """Streams the response to a query using the async Cohere client.
+
+        Args:
+        query: The query to generate a response to.
+        kwds: Additional keyword arguments to pass to the Cohere API.
+
+        Yields:
+        Text deltas of the generated response.
+        """
+        response = await self.aclient.chat(**self.request_params(query), stream=True)
+        try:
+            async for event in response:
+                if event.event_type == 'text-generation':
+                    yield event.text
+        finally:
+            response.response.close()
     
 if __name__ == "__main__":
     try:
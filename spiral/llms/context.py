@@ -0,0 +1,332 @@
+from pydantic import BaseModel, Field
+from typing import Any, Callable, List, Optional, Tuple, TYPE_CHECKING
+import logging
+import asyncio
+import math
+
+from spiral.llms.history import ChatHistory
+
+if TYPE_CHECKING:
+    from spiral.llms.base import LLM
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4-turbo-preview': 128000,
+    'gpt-4-vision-preview': 128000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'claude-3-opus-20240229': 200000,
+    'claude-3-sonnet-20240229': 200000,
+    'claude-3-haiku-20240307': 200000,
+    'mixtral-8x7b-32768': 32768,
+    'mistralai/Mixtral-8x7B-Instruct-v0.1': 32768,
+    'gemini-pro': 30720,
+    'gemini-pro-vision': 12288,
+    'command-nightly': 4096,
+}
+"""Context window sizes in tokens of known models. The history of other models is not trimmed unless max_tokens is set."""
+
+SUMMARY_PROMPT = """Summarize the following conversation between a user and an AI assistant.
+Keep every fact, decision, tool result and open task that could be needed to continue the conversation.
+If a previous summary is given, merge it into the new summary.
+Return only the summary."""
+
+
+def count_tokens(text: str) -> int:
+    """Estimates the number of tokens in a text, at about four characters per token"""
+    return (len(text) + 3) // 4
+
+
+def summarizer_llm(llm: 'LLM') -> 'LLM':
+    """Copy of an llm, without chat history, that is prompted to summarize"""
+    return llm.model_copy(update={
+        'chat_history': ChatHistory(),
+        'system_prompt': SUMMARY_PROMPT,
+        'context_window': None
+    })
+
+
+class LLMSummarizer:
+    """Summarizer for ContextWindow that uses an llm. See summarize_with()"""
+
+    def __init__(self, llm: 'LLM'):
+        self.llm = llm
+
+    def __call__(self, messages: list[dict], summary: str) -> str:
+        return str(summarizer_llm(self.llm)(summary_request(messages, summary)))
+
+    async def acall(self, messages: list[dict], summary: str) -> str:
+        """Async version of __call__(), used by requests made on an event loop"""
+        return await asummarize(self.llm, messages, summary)
+
+
+def summarize_with(llm: 'LLM') -> LLMSummarizer:
+    """Creates a summarizer for ContextWindow that uses an llm.
+
+    The llm is called without its chat history, so it can be the same
+    instance the conversation runs on. Async requests summarize with the
+    llm's async client.
+
+    Args:
+        llm (LLM): The llm to summarize with
+
+    Returns:
+        LLMSummarizer: Summarizes messages, merging in a previous summary
+    """
+    return LLMSummarizer(llm)
+
+
+async def asummarize(llm: 'LLM', messages: list[dict], summary: str = '') -> str:
+    """Summarizes messages with an llm without blocking the event loop.
+
+    Args:
+        llm (LLM): The llm to summarize with
+        messages (list[dict]): Chat history messages to summarize
+        summary (str, optional): Previous summary to merge in. Defaults to ''.
+
+    Returns:
+        str: The new summary
+    """
+    return str(await summarizer_llm(llm).acall(summary_request(messages, summary)))
+
+
+def summary_request(messages: list[dict], summary: str = '') -> dict:
+    """Builds the query asking an llm to summarize messages"""
+    lines = []
+    if summary:
+        lines.append(f"Previous summary: {summary}\n")
+    for message in messages:
+        content = message.get('message', '') if message.get('type') == 'text' else '[screenshot]'
+        lines.append(f"{message.get('role', 'User')}: {content}")
+    return {'role': 'User', 'type': 'text', 'message': '\n'.join(lines)}
+
+
+class ContextWindow(BaseModel):
+    """Keeps the chat history sent to an llm within the model's context window.
+
+    Token counts are estimated per message and cached on the chat history.
+    When the history does not fit, the policies are applied in this order
+    until it does:
+
+    - 'drop_images': replaces images, oldest first, with a short note.
+      The latest keep_images images are kept.
+    - 'summarize': replaces the oldest messages with a running summary
+      made by summarizer. The summary is stored on the chat history.
+    - 'sliding_window': leaves out the oldest messages.
+
+    The system prompt is not part of the chat history, so it is always sent
+    and counted against the budget. The first pinned_messages messages of
+    the history are never left out.
+
+    Models missing from MODEL_CONTEXT_WINDOWS are not trimmed, as their
+    window may be far larger than a guess. Set max_tokens to trim them.
+
+    Args:
+        max_tokens (int, optional): Context window size. Looked up from the model by default.
+        policies (list): Policies to apply, see above.
+    """
+
+    max_tokens: Optional[int] = Field(default=None)
+    """Context window size in tokens. Defaults to the size of the model, if it is known."""
+
+    policies: List[str] = Field(default=['drop_images', 'summarize', 'sliding_window'])
+    """Policies applied, in order, when the history does not fit"""
+
+    pinned_messages: int = Field(default=0)
+    """Number of messages at the start of the history that are always kept"""
+
+    keep_last: int = Field(default=2)
+    """Number of latest messages never summarized"""
+
+    keep_images: int = Field(default=1)
+    """Number of latest images kept by the 'drop_images' policy"""
+
+    image_tokens: int = Field(default=1000)
+    """Estimated tokens used by an image"""
+
+    message_overhead: int = Field(default=4)
+    """Tokens added per message for roles and formatting"""
+
+    tokenizer: Callable[[str], int] = Field(default=count_tokens, exclude=True)
+    """Counts the tokens in a text"""
+
+    summarizer: Optional[Callable[[list[dict], str], str]] = Field(default=None, exclude=True)
+    """Summarizes messages, merging in the previous summary. See summarize_with().
+    Summarizers with an async acall method are awaited on async requests."""
+
+    def window_size(self, llm: 'LLM') -> Optional[int]:
+        """Context window size of the llm's model, or None if it is not known"""
+        return self.max_tokens or MODEL_CONTEXT_WINDOWS.get(llm.model)
+
+    def message_tokens(self, message: dict) -> int:
+        """Estimated tokens of a chat history message"""
+        if message.get('type') == 'image':
+            return self.image_tokens + self.message_overhead
+        return self.tokenizer(str(message.get('message', ''))) + self.message_overhead
+
+    def token_counts(self, history: ChatHistory) -> list[int]:
+        """Token counts of all messages, cached on the history"""
+        return history.formatted(('tokens', id(self)), self.message_tokens)
+
+    def budget(self, llm: 'LLM', query: Optional[dict] = None) -> float:
+        """Tokens available for the chat history. Unlimited if the window size is not known."""
+        window_size = self.window_size(llm)
+        if window_size is None:
+            return math.inf
+        budget = window_size - llm.max_tokens - self.tokenizer(llm.system_prompt)
+        if query:
+            budget -= self.message_tokens(query)
+        return budget
+
+    def fit(self, llm: 'LLM', formatted: list, query: Optional[dict] = None, summarize: bool = True) -> list:
+        """Selects the formatted history messages to send.
+
+        Args:
+            llm (LLM): The llm the history belongs to
+            formatted (list): The llm's formatted chat history
+            query (dict, optional): The query sent with the history
+            summarize (bool, optional): Whether the summarizer may be called. On an event loop,
+                summaries are made beforehand by LLM.asummarize_history(). Defaults to True.
+
+        Returns:
+            list: The formatted messages that fit in the context window
+        """
+        if summarize:
+            span = self.summary_span(llm, query)
+            if span:
+                self.summarize(llm.chat_history, *span) # type: ignore
+        return self.trim(llm, formatted, query)
+
+    async def afit(self, llm: 'LLM', formatted: list, query: Optional[dict] = None) -> list:
+        """Async version of fit(). The summarizer is awaited, so it does not block the event loop."""
+        span = self.summary_span(llm, query)
+        if span:
+            await self.asummarize(llm.chat_history, *span) # type: ignore
+        return self.trim(llm, formatted, query)
+
+    def summary_span(self, llm: 'LLM', query: Optional[dict] = None) -> Optional[Tuple[int, int]]:
+        """The (start, end) range of messages to merge into the running summary so the history fits, if any"""
+        if 'summarize' not in self.policies or not self.summarizer:
+            return None
+        history: ChatHistory = llm.chat_history # type: ignore
+        budget = self.budget(llm, query)
+        counts, pinned, start, total, _ = self.measure(history, budget)
+        if total <= budget:
+            return None
+        available = budget - sum(counts[:pinned]) - self.tokenizer(history.summary) - 200
+        end = min(self.window_start(history, counts, start, available), len(history) - self.keep_last)
+        return (start, end) if end > start else None
+
+    def measure(self, history: ChatHistory, budget: float) -> Tuple[list[int], int, int, int, set[int]]:
+        """Measures the history against a budget, dropping images if it does not fit.
+
+        Returns:
+            tuple: The token counts of the messages, the number of pinned messages, the index
+                of the first message after the summary, the total tokens, and the dropped images
+        """
+        counts = self.token_counts(history)
+        pinned = min(self.pinned_messages, len(history))
+        start = max(history.summary_index, pinned) if history.summary else pinned
+        total = sum(counts[:pinned]) + sum(counts[start:]) + self.summary_tokens(history)
+
+        dropped_images: set[int] = set()
+        if total > budget and 'drop_images' in self.policies:
+            images = [index for index in range(start, len(history)) if history[index].get('type') == 'image']
+            for index in images[:max(len(images) - self.keep_images, 0)]:
+                if total <= budget:
+                    break
+                dropped_images.add(index)
+                total -= counts[index] - self.message_tokens(self.image_note(history[index]))
+            if dropped_images:
+                counts = list(counts)
+                for index in dropped_images:
+                    counts[index] = self.message_tokens(self.image_note(history[index]))
+        return counts, pinned, start, total, dropped_images
+
+    def trim(self, llm: 'LLM', formatted: list, query: Optional[dict] = None) -> list:
+        """Selects the formatted history messages that fit, without summarizing"""
+        history: ChatHistory = llm.chat_history # type: ignore
+        budget = self.budget(llm, query)
+        counts, pinned, start, total, dropped_images = self.measure(history, budget)
+        if total <= budget and not dropped_images:
+            if not history.summary:
+                return formatted
+            return self.select(llm, formatted, pinned, start, set())
+
+        summary_tokens = self.summary_tokens(history)
+        if total > budget and 'sliding_window' in self.policies:
+            start = self.window_start(history, counts, start, budget - sum(counts[:pinned]) - summary_tokens)
+            total = sum(counts[:pinned]) + sum(counts[start:]) + summary_tokens
+
+        if total > budget:
+            logger.warning(f"Chat history needs about {total} tokens, over the {budget} tokens available")
+
+        return self.select(llm, formatted, pinned, start, dropped_images)
+
+    def window_start(self, history: ChatHistory, counts: list[int], start: int, available: int) -> int:
+        """Index of the oldest message from which the rest of the history fits in available tokens.
+
+        The window always starts at a user message, as some apis require.
+        """
+        index = len(history)
+        used = 0
+        while index > start and used + counts[index - 1] <= available:
+            index -= 1
+            used += counts[index]
+        while index < len(history) and history[index].get('role', '').lower() != 'user':
+            index += 1
+        return index
+
+    def select(self, llm: 'LLM', formatted: list, pinned: int, start: int, dropped_images: set[int]) -> list:
+        """Builds the formatted messages for a selection of the history"""
+        history: ChatHistory = llm.chat_history # type: ignore
+        messages = list(formatted[:pinned])
+        if history.summary and start >= history.summary_index:
+            messages.append(llm.format_message({
+                'role': 'User', 'type': 'text',
+                'message': f"Summary of the earlier conversation: {history.summary}"
+            }))
+            messages.append(llm.format_message({'role': 'Assistant', 'type': 'text', 'message': 'Understood.'}))
+        for index in range(start, len(formatted)):
+            if index in dropped_images:
+                messages.append(llm.format_message(self.image_note(history[index])))
+            else:
+                messages.append(formatted[index])
+        return messages
+
+    def summarize(self, history: ChatHistory, start: int, end: int):
+        """Merges history[start:end] into the running summary of the history"""
+        summary = self.summarizer(history[start:end], history.summary) # type: ignore
+        history.set_summary(summary, end)
+
+    async def asummarize(self, history: ChatHistory, start: int, end: int):
+        """Async version of summarize(). Summarizers without an acall method run in a worker thread.
+
+        The summary is discarded if the history was edited or summarized
+        by another request meanwhile.
+        """
+        messages, summary, revision = history[start:end], history.summary, history.revision
+        acall = getattr(self.summarizer, 'acall', None)
+        if acall is not None:
+            new_summary = await acall(messages, summary)
+        else:
+            new_summary = await asyncio.to_thread(self.summarizer, messages, summary) # type: ignore
+        if history.revision == revision and history.summary == summary and history.summary_index <= start:
+            history.set_summary(new_summary, end)
+
+    def summary_tokens(self, history: ChatHistory) -> int:
+        """Tokens used by the summary messages"""
+        if not history.summary:
+            return 0
+        return self.tokenizer(history.summary) + 20 + 2 * self.message_overhead
+
+    @staticmethod
+    def image_note(message: dict) -> dict:
+        """Text message that replaces a dropped image"""
+        return {'role': message.get('role', 'User'), 'type': 'text', 'message': '[An earlier screenshot was removed]'}
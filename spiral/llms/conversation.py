@@ -0,0 +1,81 @@
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Any, Dict, List, Optional
+import uuid
+
+from spiral.llms.history import ChatHistory
+
+
+class Conversation(BaseModel):
+    """The state of one conversation with an llm.
+
+    A conversation owns its chat history, system prompt and generation
+    settings. Passing it to an llm call keeps the llm itself unchanged, so
+    one llm instance, and the api clients it pools, can serve many
+    conversations at once.
+
+    Settings left as None use the llm's own.
+
+    Example:
+        conversation = Conversation(system_prompt="You are a helpful assistant")
+        response = llm(query, conversation=conversation)
+        conversation.history.append(query)
+        conversation.history.append({'role': 'Assistant', 'type': 'text', 'message': response})
+
+    Args:
+        id (str): Unique ID of the conversation
+        history (ChatHistory): Messages of the conversation
+        system_prompt (str): System prompt of the conversation
+        stop_sequences (List[str]): Sequences where the model stops generating
+        model (str, optional): Model to use instead of the llm's
+        temperature (float, optional): Sampling temperature to use instead of the llm's
+        max_tokens (int, optional): Maximum tokens to generate instead of the llm's
+    """
+
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    """Unique ID of the conversation"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    history: ChatHistory = Field(default_factory=ChatHistory)
+    """Messages of the conversation, and the running summary of older ones"""
+
+    system_prompt: str = Field(default='')
+    """System prompt of the conversation. Empty uses the llm's."""
+
+    stop_sequences: List[str] = Field(default=[])
+    """Sequences where the model stops generating. Empty uses the llm's."""
+
+    model: Optional[str] = Field(default=None)
+    """Model to use instead of the llm's"""
+
+    temperature: Optional[float] = Field(default=None)
+    """Sampling temperature to use instead of the llm's"""
+
+    max_tokens: Optional[int] = Field(default=None)
+    """Maximum tokens to generate instead of the llm's"""
+
+    @field_validator('history', mode='before')
+    @classmethod
+    def validate_history(cls, value: list) -> ChatHistory:
+        """Makes history a ChatHistory so formatted messages can be cached. A ChatHistory is kept as is."""
+        return value if isinstance(value, ChatHistory) else ChatHistory(value)
+
+    def settings(self) -> dict:
+        """The llm fields this conversation sets"""
+        settings: Dict[str, Any] = {'chat_history': self.history}
+        if self.system_prompt:
+            settings['system_prompt'] = self.system_prompt
+        if self.stop_sequences:
+            settings['stop_sequences'] = self.stop_sequences
+        for name in ('model', 'temperature', 'max_tokens'):
+            if getattr(self, name) is not None:
+                settings[name] = getattr(self, name)
+        return settings
+
+    def fork(self) -> 'Conversation':
+        """A new conversation with the same settings and an empty history"""
+        return self.model_copy(update={
+            'id': uuid.uuid4().hex,
+            'history': ChatHistory(),
+            'stop_sequences': list(self.stop_sequences)
+        })
@@ -0,0 +1,54 @@
+from spiral.llms.base import LLM
+from typing import Any, Iterator, AsyncIterator
+import asyncio
+import json
+import time
+import re
+
+
+class Echo(LLM):
+    """An offline llm that answers every query with the query itself.
+
+    It needs no api key or network access, so agents and the server can be
+    tried out and tested locally. Answers are final answers in the agent
+    response format, and are streamed word by word.
+
+    Args:
+        delay: Seconds to wait before answering, to simulate a provider's latency.
+    """
+    model: str = 'echo'
+    """Model name, only used in cache keys"""
+
+    delay: float = 0.0
+    """Seconds to wait before answering"""
+
+    supports_system_prompt: bool = True
+    """Flag to indicate if system prompt should be supported"""
+
+    coalesce: bool = False
+    """Every request is answered locally, so there is nothing to share"""
+
+    def answer(self, query: Any) -> str:
+        """The response to a query: a final answer repeating the query's message"""
+        if isinstance(query, dict):
+            message = query.get('message', '') if query.get('type', 'text') == 'text' else f"[{query.get('type')}]"
+        else:
+            message = query
+        return json.dumps({'type': 'final_answer', 'result': message if isinstance(message, str) else json.dumps(message, default=str)})
+
+    def _call(self, query: Any, **kwds: Any) -> str:
+        time.sleep(self.delay)
+        return self.answer(query)
+
+    async def _acall(self, query: Any, **kwds: Any) -> str:
+        await asyncio.sleep(self.delay)
+        return self.answer(query)
+
+    def _stream(self, query: Any, **kwds: Any) -> Iterator[str]:
+        time.sleep(self.delay)
+        yield from re.findall(r'\s*\S+\s*', self.answer(query))
+
+    async def _astream(self, query: Any, **kwds: Any) -> AsyncIterator[str]:
+        await asyncio.sleep(self.delay)
+        for delta in re.findall(r'\s*\S+\s*', self.answer(query)):
+            yield delta
@@ -1,8 +1,10 @@
 from spiral.llms.base import LLM
-from typing import Any
-import google.generativeai as genai
+from spiral.utils import message_image_base64
+from typing import Any, Iterator, AsyncIterator
+import google.ai.generativelanguage as glm
 from dotenv import load_dotenv
 import logging
+import base64
 import sys
 import os
 
@@ -36,9 +38,6 @@ class Gemini(LLM):
     temperature: float = 0.0
     """What sampling temperature to use.""" 
     
-    chat_history: list[str] = []
-    """Chat history"""
-    
     api_key: str = os.getenv('GOOGLE_API_KEY', '')
     """GOOGLE API key""" 
     
@@ -48,25 +47,81 @@ class Gemini(LLM):
     is_multimodal: bool = True
     """Whether the model is multimodal."""
     
+    def create_client(self) -> glm.GenerativeServiceClient:
+        """Creates a Gemini client for this api key.
+
+        The client is bound to the api key directly instead of going
+        through the process wide genai.configure().
+        """
+        client_options = {'api_key': self.api_key}
+        if self.api_base:
+            client_options['api_endpoint'] = self.api_base
+        return glm.GenerativeServiceClient(client_options=client_options)
+    
+    def create_async_client(self) -> glm.GenerativeServiceAsyncClient:
+        """Creates an async Gemini client for this api key"""
+        client_options = {'api_key': self.api_key}
+        if self.api_base:
+            client_options['api_endpoint'] = self.api_base
+        return glm.GenerativeServiceAsyncClient(client_options=client_options)
+    
+    def format_message(self, message: dict) -> list:
+        """Formats a single chat history message as a list of Gemini content parts"""
+        if message['type'] == 'text':
+            return [glm.Part(text=message['message'])]
+        elif message['type'] == 'image':
+            image = glm.Blob(mime_type='image/jpeg', data=base64.b64decode(message_image_base64(message)))
+            return [glm.Part(inline_data=image), glm.Part(text='Above is the screenshot')]
+        return []
+    
     def format_query(self, message: dict[str, str]) -> list:
         """Formats a message for the Gemini API"""
-        formatted_message = [*self.chat_history, message]
-        
-        messages = []
+        parts = []
         if self.system_prompt:
-            messages.append(self.system_prompt)
+            parts.append(glm.Part(text=self.system_prompt))
         
-        for fm in formatted_message:
-            if fm['type'] == 'text': 
-                messages.append(fm['message'])
-            elif fm['type'] == 'image':
-                self.model = self.vision_model
-                messages.append(fm['image'])
-                messages.append('Above is the screenshot')
+        for message_parts in self.formatted_history(message):
+            parts.extend(message_parts)
+        parts.extend(self.format_message(message))
+
+        return parts
+
+    def generation_config(self) -> dict:
+        """Generation config sent with every request"""
+        config = {
+            "max_output_tokens": 2048,
+            "temperature": self.temperature,
+            "top_p": 1,
+            "top_k": 32
+        }
+        if self.stop_sequences:
+            config["stop_sequences"] = self.stop_sequences[:5]
+        return config
+
+    def request_params(self, query: dict) -> dict:
+        """Builds the generate content request for a query.
 
-        return messages
+        The request goes to the shared GenerativeServiceClient, so no
+        GenerativeModel, and no process wide genai.configure(), is needed.
+        Requests that include an image go to the vision model.
+        """
+        parts = self.format_query(query)
+        model = self.vision_model if any('inline_data' in part for part in parts) else self.model
+        return {
+            'model': f"models/{model}",
+            'contents': [glm.Content(role='user', parts=parts)],
+            'generation_config': glm.GenerationConfig(**self.generation_config())
+        }
 
-    def __call__(self, query, **kwds: Any)->str|None:
+    @staticmethod
+    def response_text(response: glm.GenerateContentResponse) -> str:
+        """Text of the first candidate of a response"""
+        if not response.candidates:
+            logger.warning(f"Gemini returned no response: {response.prompt_feedback}")
+            return ''
+        return ''.join(part.text for part in response.candidates[0].content.parts)
+
+    def _call(self, query, **kwds: Any)->str|None:
         """Generates a response to a query using the Gemini API.
 
         Args:
@@ -76,28 +131,69 @@ class Gemini(LLM):
         Returns:
         A string containing the generated response.
         """
-        genai.configure(api_key=self.api_key)
-
-        
-        general_config = {
-            "max_output_tokens": 2048,
-            "temperature": self.temperature,
-            "top_p": 1,
-            "top_k": 32
-        }
-        contents = self.format_query(query)
+        response = self.client.generate_content(
+            request=self.request_params(query),
+            timeout=self.request_timeout
+        )
         
-        client = genai.GenerativeModel(self.model)
+        return self.response_text(response)
+
+    async def _acall(self, query, **kwds: Any)->str|None:
+        """Generates a response to a query using the async Gemini client.
+
+        Args:
+        query: The query to generate a response to.
+        kwds: Additional keyword arguments to pass to the Gemini API.
+
+        Returns:
+        A string containing the generated response.
+        """
+        response = await self.aclient.generate_content(
+            request=self.request_params(query),
+            timeout=self.request_timeout
+        )
         
-        response = client.generate_content(
-            contents,
-            stream=True,
-            generation_config=general_config    # type: ignore
+        return self.response_text(response)
+
+    def _stream(self, query, **kwds: Any)->Iterator[str]:
+        """Streams the response to a query using the Gemini API.
+
+        Args:
+        query: The query to generate a response to.
+        kwds: Additional keyword arguments to pass to the Gemini API.
+
+        Yields:
+        Text deltas of the generated response.
+        """
+        response = self.client.stream_generate_content(
+            request=self.request_params(query),
+            timeout=self.request_timeout
         )
+        
+        for chunk in response:
+            text = self.response_text(chunk)
+            if text:
+                yield text
+
+    async def _astream(self, query, **kwds: Any)->AsyncIterator[str]:
+        """Streams the response to a query using the async Gemini client.
 
-        response.resolve()
+        Args:
+        query: The query to generate a response to.
+        kwds: Additional keyword arguments to pass to the Gemini API.
+
+        Yields:
+        Text deltas of the generated response.
+        """
+        response = await self.aclient.stream_generate_content(
+            request=self.request_params(query),
+            timeout=self.request_timeout
+        )
         
-        return response.text
+        async for chunk in response:
+            text = self.response_text(chunk)
+            if text:
+                yield text
     
 if __name__ == "__main__":
     try:
@@ -1,6 +1,7 @@
-from groq import Groq as GroqLLM
+from groq import Groq as GroqLLM, AsyncGroq
 from spiral.llms.base import LLM
-from typing import Any, Optional
+from spiral.llms.usage import record_usage
+from typing import Any, Optional, Iterator, AsyncIterator
 from dotenv import load_dotenv
 import logging
 import sys
@@ -29,9 +30,6 @@ class Groq(LLM):
     temperature: float = 0.1
     """What sampling temperature to use.""" 
     
-    chat_history: list[str] = []
-    """Chat history"""
-    
     api_key: str = os.getenv('GROQ_API_KEY', '')
     """Groq API key""" 
     
@@ -41,7 +39,56 @@ class Groq(LLM):
     system_prompt: str = ""
     """System prompt to prepend to queries"""
 
-    def __call__(self, query, **kwds: Any)->str|None:
+    def create_client(self) -> GroqLLM:
+        """Creates a pooled Groq client"""
+        return GroqLLM(
+            api_key=self.api_key,
+            base_url=self.api_base or None,
+            max_retries=0,
+            http_client=self.http_client()
+        )
+
+    def create_async_client(self) -> AsyncGroq:
+        """Creates a pooled async Groq client"""
+        return AsyncGroq(
+            api_key=self.api_key,
+            base_url=self.api_base or None,
+            max_retries=0,
+            http_client=self.async_http_client()
+        )
+
+    def format_message(self, message: dict) -> dict:
+        """Formats a single chat history message for the Groq API"""
+        if message['type'] == 'text':
+            content = message['message']
+        else:
+            content = 'This is the result of the latest screenshot'
+        return {"role": message['role'].lower(), "content": content}
+
+    def format_query(self, message: dict | str) -> list:
+        """Formats a message and the cached chat history for the Groq API"""
+        if isinstance(message, str):
+            message = {'role': 'User', 'type': 'text', 'message': message}
+        
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        messages.extend(self.formatted_history(message))
+        messages.append(self.format_message(message))
+        
+        return messages
+
+    def request_params(self, query) -> dict:
+        """Builds the chat completion parameters for a query"""
+        return {
+            'model': self.model,
+            'messages': self.format_query(query),
+            'temperature': self.temperature,
+            'top_p': 1,
+            'stop': self.stop_sequences[:4] or None,
+        }
+
+    def _call(self, query, **kwds: Any)->str|None:
         """Generates a response to a query using the Groq API.
 
         Args:
@@ -52,18 +99,68 @@ class Groq(LLM):
         A string containing the generated response.
         """
 
-        client = GroqLLM(api_key=self.api_key)
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "user", "content": query}
-            ],
-            temperature=self.temperature,
-            top_p=1,
-            stop=None,
-        )
+        response = self.client.chat.completions.create(**self.request_params(query))
+
+        if response.usage:
+            record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
             
         return response.choices[0].message.content
+
+    async def _acall(self, query, **kwds: Any)->str|None:
+        """Generates a response to a query using the async Groq client.
+
+        Args:
+        query: The query to generate a response to.
+        kwds: Additional keyword arguments to pass to the Groq API.
+
+        Returns:
+        A string containing the generated response.
+        """
+
+        response = await self.aclient.chat.completions.create(**self.request_params(query))
+
+        if response.usage:
+            record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+            
+        return response.choices[0].message.content
+
+    def _stream(self, query, **kwds: Any)->Iterator[str]:
+        """Streams the response to a query using the Groq API.
+
+        Args:
+        query: The query to generate a response to.
+        kwds: Additional keyword arguments to pass to the Groq API.
+
+        Yields:
+        Text deltas of the generated response.
+        """
+
+        response = self.client.chat.completions.create(**self.request_params(query), stream=True)
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            response.close()
+
+    async def _astream(self, query, **kwds: Any)->AsyncIterator[str]:
+        """Streams the response to a query using the async Groq client.
+
+        Args:
+        query: The query to generate a response to.
+        kwds: Additional keyword arguments to pass to the Groq API.
+
+        Yields:
+        Text deltas of the generated response.
+        """
+
+        response = await self.aclient.chat.completions.create(**self.request_params(query), stream=True)
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
     
 if __name__ == "__main__":
     try:
@@ -0,0 +1,123 @@
+from typing import Any, Callable, Hashable
+import threading
+import copy
+
+
+class ChatHistory(list):
+    """Chat history that caches messages formatted for each platform.
+
+    Messages are usually only appended, so each platform formats a message
+    once and keeps the result. Any other edit to the history (insert,
+    assignment, deletion, ...) drops the cached messages.
+
+    Cached lists are never changed once returned. New messages are
+    formatted into a new list that replaces the cached one, so threads
+    sharing a history, like batch requests, never see a partly built or
+    duplicated list.
+
+    Example:
+        history = ChatHistory()
+        history.append({'role': 'User', 'type': 'text', 'message': 'Hi'})
+        messages = history.formatted('OpenAI', format_message)
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.revision = 0
+        """Incremented whenever the history is edited other than by appending"""
+
+        self.summary = ''
+        """Running summary of the messages before summary_index"""
+
+        self.summary_index = 0
+        """Index of the first message not covered by the summary"""
+
+        self._formatted: dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+
+    def formatted(self, key: Hashable, formatter: Callable[[dict], Any]) -> list:
+        """Returns all messages formatted with formatter, formatting only new ones.
+
+        Args:
+            key (Hashable): Identifies the formatter, usually the platform name
+            formatter (Callable[[dict], Any]): Formats a single message
+
+        Returns:
+            list: The formatted messages. Do not modify it.
+        """
+        revision = self.revision
+        cache = self._formatted.get(key)
+        size = len(cache) if cache is not None else 0
+        if size == len(self):
+            return cache if cache is not None else []
+        # Formatting runs outside the lock, so a slow formatter does not hold up other platforms
+        messages = [*(cache or ()), *(formatter(message) for message in self[size:])]
+        with self._lock:
+            current = self._formatted.get(key)
+            if self.revision == revision and (current is None or len(current) < len(messages)):
+                self._formatted[key] = messages
+        return messages
+
+    def set_summary(self, summary: str, index: int):
+        """Sets the running summary of the messages before index"""
+        self.summary = summary
+        self.summary_index = index
+
+    def edited(self):
+        """Marks the history as edited, invalidating formatted messages and the summary"""
+        with self._lock:
+            self.revision += 1
+            self._formatted = {}
+        self.summary = ''
+        self.summary_index = 0
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.edited()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.edited()
+
+    def __imul__(self, value):
+        result = super().__imul__(value)
+        self.edited()
+        return result
+
+    def insert(self, index, value):
+        super().insert(index, value)
+        self.edited()
+
+    def pop(self, index=-1):
+        value = super().pop(index)
+        self.edited()
+        return value
+
+    def remove(self, value):
+        super().remove(value)
+        self.edited()
+
+    def clear(self):
+        super().clear()
+        self.edited()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.edited()
+
+    def reverse(self):
+        super().reverse()
+        self.edited()
+
+    def __copy__(self):
+        history = self.__class__(self)
+        history.set_summary(self.summary, self.summary_index)
+        return history
+
+    def __deepcopy__(self, memo):
+        history = self.__class__(copy.deepcopy(list(self), memo))
+        history.set_summary(self.summary, self.summary_index)
+        return history
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),), {'summary': self.summary, 'summary_index': self.summary_index})
@@ -1,7 +1,8 @@
-from openai import OpenAI as OpenAILLM
+from openai import OpenAI as OpenAILLM, AsyncOpenAI
 from spiral.llms.base import LLM
-from spiral.utils import image_to_base64
-from typing import Any, Optional
+from spiral.llms.usage import record_usage
+from spiral.utils import message_image_base64
+from typing import Any, Optional, Iterator, AsyncIterator
 from dotenv import load_dotenv
 import logging
 import sys
@@ -44,60 +45,103 @@ class OpenAI(LLM):
     max_tokens: int = 4000
     """The maximum number of tokens to generate in the completion.""" 
     
-    chat_history: list[str] = []
-    """Chat history"""
-    
     supports_system_prompt: bool = True
     """Flag to indicate if system prompt should be supported"""
     
     system_prompt: str = ""
     """System prompt to prepend to queries"""
     
-    def format_query(self, message: dict[str, str]) -> list:
-        """Formats a message for the Claude API.
+    def create_client(self) -> OpenAILLM:
+        """Creates a pooled OpenAI client"""
+        return OpenAILLM(
+            api_key=self.api_key,
+            base_url=self.api_base or None,
+            max_retries=0,
+            http_client=self.http_client()
+        )
+    
+    def create_async_client(self) -> AsyncOpenAI:
+        """Creates a pooled async OpenAI client"""
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.api_base or None,
+            max_retries=0,
+            http_client=self.async_http_client()
+        )
+    
+    def format_message(self, message: dict) -> dict:
+        """Formats a single chat history message for the OpenAI API.
 
         Args:
-            message (dict[str, str]): The message to be formatted for the Claude API.
+            message (dict): The message to be formatted.
 
         Returns:
-            list: A list of formatted messages for the Claude API.
+            dict: The formatted message.
         """
         
-        formatted_message = [*self.chat_history, message]
+        if message['type'] == 'text':
+            return {
+                "role": message['role'].lower(),
+                "content": [
+                    {
+                        "type": "text",
+                        "text": message['message']
+                    }
+                ]
+            }
         
-        messages = []
+        base64_image = message_image_base64(message)
+        return {
+            "role": message['role'].lower(),
+            "content": [
+                {
+                    "type": "text",
+                    "text": "This is the result of the latest screenshot"
+                },
+                {
+                    "type": "image_url",
+                    "image_url": f"data:image/jpeg;base64,{base64_image}"
+                }
+            ]
+        }
+    
+    def format_query(self, message: dict[str, str]) -> list:
+        """Formats a message for the OpenAI API.
+
+        Only the query is formatted here, the chat history is formatted
+        once per message and cached.
+
+        Args:
+            message (dict[str, str]): The message to be formatted for the OpenAI API.
+
+        Returns:
+            list: A list of formatted messages for the OpenAI API.
+        """
         
-        for fm in formatted_message:
-            if fm['type'] == 'text':
-                messages.append({
-                    "role": fm['role'].lower(),
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": fm['message']
-                        }
-                    ]
-                })
-            else:
-                base64_image = image_to_base64(fm['image'])
-                self.model = self.vision_model
-                messages.append({
-                    "role": fm['role'].lower(),
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "This is the result of the latest screenshot"
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": f"data:image/jpeg;base64,{base64_image}"
-                        }
-                    ]
-                })
-            
-        return messages
+        return [*self.formatted_history(message), self.format_message(message)]
 
-    def __call__(self, query: dict, **kwds: dict)->Optional[str]:
+    def request_params(self, query: dict) -> dict:
+        """Builds the chat completion parameters for a query.
+
+        Requests whose messages include an image go to the vision model.
+        """
+        formatted_messages = self.format_query(query)
+        has_images = any(
+            isinstance(message['content'], list) and any(part.get('type') == 'image_url' for part in message['content'])
+            for message in formatted_messages
+        )
+        return {
+            'model': self.vision_model if has_images else self.model,
+            'messages': [
+                {"role": "system", "content": self.system_prompt},
+                *formatted_messages
+            ],
+            'temperature': self.temperature,
+            'max_tokens': self.max_tokens,
+            'stop': self.stop_sequences[:4] or None
+        }
+
+    def _call(self, query: dict, **kwds: dict)->Optional[str]:
         """Generates a response to a query using the OpenAI API.
 
         Args:
@@ -108,16 +152,65 @@ class OpenAI(LLM):
             A string containing the generated response.
         """
 
-        client = OpenAILLM(api_key=self.api_key)
-        formatted_messages = self.format_query(query)
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                *formatted_messages
-            ],
-            temperature=self.temperature,
-            max_tokens=self.max_tokens
-        )
+        response = self.client.chat.completions.create(**self.request_params(query))
+
+        if response.usage:
+            record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
             
         return response.choices[0].message.content
+
+    async def _acall(self, query: dict, **kwds: dict)->Optional[str]:
+        """Generates a response to a query using the async OpenAI client.
+
+        Args:
+            query (dict): The query to generate a response to.
+            kwds (dict): Additional keyword arguments to pass to the OpenAI API.
+
+        Returns:
+            A string containing the generated response.
+        """
+
+        response = await self.aclient.chat.completions.create(**self.request_params(query))
+
+        if response.usage:
+            record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+            
+        return response.choices[0].message.content
+
+    def _stream(self, query: dict, **kwds: dict)->Iterator[str]:
+        """Streams the response to a query using the OpenAI API.
+
+        Args:
+            query (dict): The query to generate a response to.
+            kwds (dict): Additional keyword arguments to pass to the OpenAI API.
+
+        Yields:
+            str: Text deltas of the generated response.
+        """
+
+        response = self.client.chat.completions.create(**self.request_params(query), stream=True)
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            response.close()
+
+    async def _astream(self, query: dict, **kwds: dict)->AsyncIterator[str]:
+        """Streams the response to a query using the async OpenAI client.
+
+        Args:
+            query (dict): The query to generate a response to.
+            kwds (dict): Additional keyword arguments to pass to the OpenAI API.
+
+        Yields:
+            str: Text deltas of the generated response.
+        """
+
+        response = await self.aclient.chat.completions.create(**self.request_params(query), stream=True)
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
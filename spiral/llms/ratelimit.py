@@ -0,0 +1,294 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional
+from email.utils import parsedate_to_datetime
+from collections import deque
+import threading
+import logging
+import asyncio
+import random
+import time
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+"""Http status codes of errors that are worth retrying"""
+
+RETRYABLE_ERRORS = {
+    'APIConnectionError', 'APITimeoutError', 'TransportError',
+    'ServiceUnavailable', 'ResourceExhausted', 'DeadlineExceeded', 'InternalServerError'
+}
+"""Names of sdk exception classes that are worth retrying, whatever their status code"""
+
+
+class RateLimit(BaseModel):
+    """Rate limits of a provider's (platform, model) quota.
+
+    Limits are shared by every LLM instance in the process with the same
+    platform and model, so many agents together stay within the quota.
+
+    Args:
+        requests_per_minute (int, optional): Maximum requests started per minute
+        tokens_per_minute (int, optional): Maximum tokens per minute, estimated from the query and max_tokens
+        max_concurrency (int, optional): Maximum requests in flight at once
+    """
+
+    requests_per_minute: Optional[int] = Field(default=None)
+    """Maximum requests started per minute"""
+
+    tokens_per_minute: Optional[int] = Field(default=None)
+    """Maximum tokens per minute, estimated from the query and max_tokens"""
+
+    max_concurrency: Optional[int] = Field(default=None)
+    """Maximum requests in flight at once"""
+
+
+class RetryPolicy(BaseModel):
+    """Retries of rate limited and transient errors, with exponential backoff and jitter.
+
+    A Retry-After header sent with the error takes precedence over the
+    backoff, and also pauses every other request to the same quota.
+    """
+
+    max_retries: int = Field(default=4)
+    """Maximum number of retries of a request. 0 disables retries."""
+
+    initial_delay: float = Field(default=1.0)
+    """Seconds to wait before the first retry"""
+
+    max_delay: float = Field(default=60.0)
+    """Maximum seconds to wait before a retry"""
+
+    multiplier: float = Field(default=2.0)
+    """Factor the delay grows by with each retry"""
+
+    jitter: bool = Field(default=True)
+    """Randomize delays, so clients that failed together do not retry together"""
+
+    def delay(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """Seconds to wait before a retry.
+
+        Args:
+            attempt (int): Number of the retry, starting at 0
+            error (BaseException, optional): The error being retried
+
+        Returns:
+            float: The delay
+        """
+        retry_after = get_retry_after(error) if error else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        delay = min(self.initial_delay * self.multiplier ** attempt, self.max_delay)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """Http status code of an sdk error, if it has one"""
+    for attribute in ('status_code', 'http_status', 'code'):
+        code = getattr(error, attribute, None)
+        if isinstance(code, int):
+            return code
+    code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return code if isinstance(code, int) else None
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """Seconds to wait before retrying, from the Retry-After headers of an sdk error"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or getattr(error, 'headers', None)
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after-ms')
+        if value is not None:
+            return float(value) / 1000
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an error is a rate limit or transient error that is worth retrying"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__):
+        return True
+    return get_status_code(error) in RETRYABLE_STATUS_CODES
+
+
+class TokenBucket:
+    """Token bucket that hands out capacity per minute.
+
+    Callers reserve capacity and get back how long to wait for it. The
+    bucket may go into debt, so reservations are served in the order they
+    were made, whether the caller waits in a thread or in an event loop.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        """Maximum capacity, reached after a minute of no use"""
+
+        self.rate = per_minute / 60
+        """Capacity added per second"""
+
+        self.available = self.capacity
+        """Capacity available now. Negative while reservations are waiting."""
+
+        self.updated = time.monotonic()
+        """When available was last refilled"""
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Reserves capacity and returns the seconds to wait until it is available"""
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+        self.available -= min(amount, self.capacity)
+        return 0.0 if self.available >= 0 else -self.available / self.rate
+
+
+class RateLimiter:
+    """Rate limiter of a (platform, model) quota, shared across threads and event loops.
+
+    Requests wait for request and token capacity, then for a free
+    concurrency slot. Slots are handed to waiters in FIFO order. When a
+    request is rate limited, pause() holds back every request to the
+    quota until the provider accepts requests again.
+    """
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(limit.requests_per_minute) if limit.requests_per_minute else None
+        self._tokens = TokenBucket(limit.tokens_per_minute) if limit.tokens_per_minute else None
+        self._paused_until = 0.0
+        self._active = 0
+        self._waiters: deque = deque()
+
+    def update(self, limit: RateLimit):
+        """Applies new limits, keeping the current state when they did not change"""
+        if limit == self.limit:
+            return
+        with self._lock:
+            self.limit = limit
+            self._requests = TokenBucket(limit.requests_per_minute) if limit.requests_per_minute else None
+            self._tokens = TokenBucket(limit.tokens_per_minute) if limit.tokens_per_minute else None
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Reserves capacity for a request and returns the seconds to wait before sending it"""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(self._paused_until - now, 0.0)
+            if self._requests:
+                delay = max(delay, self._requests.reserve(1, now))
+            if self._tokens and tokens:
+                delay = max(delay, self._tokens.reserve(tokens, now))
+            return delay
+
+    def pause(self, seconds: float):
+        """Holds back all requests to the quota for some seconds"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens: int = 0):
+        """Waits, blocking the thread, until a request can be sent"""
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+        event = None
+        with self._lock:
+            if self._has_free_slot():
+                self._active += 1
+            else:
+                event = threading.Event()
+                self._waiters.append(event)
+        if event:
+            event.wait()
+
+    async def aacquire(self, tokens: int = 0):
+        """Waits, without blocking the event loop, until a request can be sent"""
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+        future = None
+        with self._lock:
+            if self._has_free_slot():
+                self._active += 1
+            else:
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+        if future:
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    if future.done() and not future.cancelled():
+                        # The slot was handed over just before the cancellation
+                        self._release()
+                    elif (loop, future) in self._waiters:
+                        self._waiters.remove((loop, future))
+                raise
+
+    def release(self):
+        """Frees the concurrency slot of a finished request"""
+        with self._lock:
+            self._release()
+
+    def _has_free_slot(self) -> bool:
+        return not self.limit.max_concurrency or (self._active < self.limit.max_concurrency and not self._waiters)
+
+    def _release(self):
+        """Hands the slot to the next waiter, or frees it. Called with the lock held."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+                return
+            loop, future = waiter
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._hand_over, future)
+                return
+        self._active -= 1
+
+    def _hand_over(self, future: asyncio.Future):
+        """Gives a slot to an async waiter, or passes it on if it was cancelled"""
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+_limiters: Dict[tuple, RateLimiter] = {}
+"""Rate limiters shared by all LLM instances, keyed by (platform, model)"""
+
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(key: tuple, limit: RateLimit) -> RateLimiter:
+    """Returns the process wide rate limiter of a quota, creating it on first use.
+
+    Args:
+        key (tuple): Identifies the quota, usually (platform, model)
+        limit (RateLimit): The limits of the quota
+
+    Returns:
+        RateLimiter: The shared rate limiter
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(limit)
+    limiter.update(limit)
+    return limiter
@@ -0,0 +1,348 @@
+from pydantic import Field, PrivateAttr
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import threading
+import logging
+import asyncio
+import bisect
+import time
+
+from spiral.llms.base import LLM
+from spiral.llms.ratelimit import RetryPolicy
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+
+class LatencyHistogram:
+    """Histogram of request latencies with logarithmic buckets.
+
+    Counts are halved once max_samples is reached, so percentiles follow
+    recent latencies when a provider gets faster or slower.
+    """
+
+    def __init__(self, min_latency: float = 0.01, growth: float = 1.15, buckets: int = 80, max_samples: int = 1000):
+        self.bounds = [min_latency * growth ** index for index in range(buckets)]
+        """Upper bounds of the buckets in seconds. The last bucket has no upper bound."""
+
+        self.counts = [0.0] * (buckets + 1)
+        """Number of samples in each bucket"""
+
+        self.count = 0.0
+        """Number of samples, after decay"""
+
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        """Adds a latency sample"""
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.count += 1
+            if self.count >= self.max_samples:
+                self.counts = [count / 2 for count in self.counts]
+                self.count /= 2
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Latency below which a fraction p of the samples fall, or None without samples"""
+        with self._lock:
+            if not self.count:
+                return None
+            target = p * self.count
+            seen = 0.0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= target and count:
+                    return self.bounds[min(index, len(self.bounds) - 1)]
+            return self.bounds[-1]
+
+
+class Router(LLM):
+    """Routes requests over several llms to cut tail latency and survive provider errors.
+
+    The llms share the router's chat history, system prompt and stop
+    sequences, and each formats the history for its own api.
+
+    Modes:
+    - 'hedged': sends the request to the first llm. If it has not answered
+      within the hedge_percentile latency of that llm, the request is also
+      sent to the next one. The first answer wins and the other requests
+      are cancelled. Failed requests move on to the next llm right away.
+    - 'fallback': tries the llms in order, moving on when one fails.
+
+    Streams are hedged on the time to the first text delta.
+
+    Example:
+        llm = Router(llms=[Groq(), OpenAI(), Claude()], mode='hedged')
+        response = llm(query)
+
+    Args:
+        llms (List[LLM]): The llms, in order of preference
+        mode (str): 'hedged' or 'fallback'
+    """
+
+    llms: List[LLM] = Field(default=[])
+    """The llms to route over, in order of preference"""
+
+    mode: str = Field(default='hedged')
+    """'hedged' or 'fallback'"""
+
+    hedge_percentile: float = Field(default=0.95)
+    """Latency percentile of an llm after which the request is hedged"""
+
+    hedge_delay: float = Field(default=2.0)
+    """Seconds after which requests are hedged while an llm has too few latency samples"""
+
+    min_samples: int = Field(default=20)
+    """Latency samples of an llm needed before hedge_percentile is used"""
+
+    max_hedges: int = Field(default=1)
+    """Maximum number of extra requests sent because of slow answers"""
+
+    retry: Optional[RetryPolicy] = Field(default=None)
+    """The router does not retry. Only the last llm retries its own requests, the others fail over at once."""
+
+    _histograms: Dict[tuple, LatencyHistogram] = PrivateAttr(default_factory=dict)
+
+    def backend(self, index: int) -> LLM:
+        """The llm at index, sharing the router's conversation state.
+
+        Every llm but the last has its retries turned off, as backing off
+        before moving on to the next llm would add seconds to the request.
+        """
+        update = {
+            'chat_history': self.chat_history,
+            'system_prompt': self.system_prompt or self.llms[index].system_prompt,
+            'stop_sequences': self.stop_sequences or self.llms[index].stop_sequences
+        }
+        if index < len(self.llms) - 1:
+            update['retry'] = None
+        return self.llms[index].model_copy(update=update)
+
+    def histogram(self, index: int, kind: str) -> LatencyHistogram:
+        """Latency histogram of the llm at index, for 'call' or 'stream' (time to first delta)"""
+        key = (index, kind)
+        if key not in self._histograms:
+            self._histograms[key] = LatencyHistogram()
+        return self._histograms[key]
+
+    def hedge_after(self, index: int, kind: str) -> Optional[float]:
+        """Seconds to wait for the llm at index before hedging, or None to not hedge"""
+        if self.mode != 'hedged':
+            return None
+        histogram = self.histogram(index, kind)
+        if histogram.count < self.min_samples:
+            return self.hedge_delay
+        return histogram.percentile(self.hedge_percentile)
+
+    def _check_llms(self):
+        if not self.llms:
+            raise ValueError("Router has no llms to route to")
+        if self.mode not in ('hedged', 'fallback'):
+            raise ValueError(f"Unknown Router mode: {self.mode}")
+
+    def _timed_call(self, index: int, query: Any, **kwds: Any) -> Any:
+        start = time.perf_counter()
+        result = self.backend(index)(query, **kwds)
+        self.histogram(index, 'call').record(time.perf_counter() - start)
+        return result
+
+    async def _timed_acall(self, index: int, query: Any, **kwds: Any) -> Any:
+        start = time.perf_counter()
+        result = await self.backend(index).acall(query, **kwds)
+        self.histogram(index, 'call').record(time.perf_counter() - start)
+        return result
+
+    def _call(self, query: Any, **kwds: Any) -> Any:
+        """Sends the request to the llms, hedging slow answers and falling back on errors.
+
+        Threads can not be cancelled, so the answers of losing requests
+        are discarded when they arrive.
+        """
+        self._check_llms()
+        executor = ThreadPoolExecutor(max_workers=len(self.llms), thread_name_prefix='spiral-router')
+        try:
+            pending: Dict[Future, int] = {executor.submit(self._timed_call, 0, query, **kwds): 0}
+            next_index, hedges, error = 1, 0, None
+            while pending:
+                last = max(pending.values())
+                timeout = self.hedge_after(last, 'call') if next_index < len(self.llms) and hedges < self.max_hedges else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"Hedging request to {self.llms[next_index].platform}")
+                    pending[executor.submit(self._timed_call, next_index, query, **kwds)] = next_index
+                    next_index += 1
+                    hedges += 1
+                    continue
+                for future in done:
+                    index = pending.pop(future)
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+                    logger.warning(f"{self.llms[index].platform} failed: {error}")
+                if not pending and next_index < len(self.llms):
+                    pending[executor.submit(self._timed_call, next_index, query, **kwds)] = next_index
+                    next_index += 1
+            raise error # type: ignore
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _acall(self, query: Any, **kwds: Any) -> Any:
+        """Async version of _call(). Losing requests are cancelled."""
+        self._check_llms()
+        pending: Dict[asyncio.Task, int] = {asyncio.create_task(self._timed_acall(0, query, **kwds)): 0}
+        next_index, hedges, error = 1, 0, None
+        try:
+            while pending:
+                last = max(pending.values())
+                timeout = self.hedge_after(last, 'call') if next_index < len(self.llms) and hedges < self.max_hedges else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"Hedging request to {self.llms[next_index].platform}")
+                    pending[asyncio.create_task(self._timed_acall(next_index, query, **kwds))] = next_index
+                    next_index += 1
+                    hedges += 1
+                    continue
+                for task in done:
+                    index = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    logger.warning(f"{self.llms[index].platform} failed: {error}")
+                if not pending and next_index < len(self.llms):
+                    pending[asyncio.create_task(self._timed_acall(next_index, query, **kwds))] = next_index
+                    next_index += 1
+            raise error # type: ignore
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _stream(self, query: Any, **kwds: Any) -> Iterator[str]:
+        """Streams from the first llm to send a text delta, hedging and falling back like _call()"""
+        self._check_llms()
+        executor = ThreadPoolExecutor(max_workers=len(self.llms), thread_name_prefix='spiral-router')
+        streams: Dict[Future, tuple] = {}
+
+        def first_delta(index: int) -> tuple:
+            start = time.perf_counter()
+            stream = self.backend(index).stream(query, **kwds)
+            try:
+                delta = next(stream)
+            except StopIteration:
+                delta = ''
+            self.histogram(index, 'stream').record(time.perf_counter() - start)
+            return stream, delta
+
+        def start(index: int):
+            streams[executor.submit(first_delta, index)] = index
+
+        def close_loser(future: Future):
+            if not future.cancelled() and future.exception() is None:
+                future.result()[0].close()
+
+        winner = None
+        try:
+            start(0)
+            next_index, hedges, error = 1, 0, None
+            while streams and winner is None:
+                last = max(streams.values())
+                timeout = self.hedge_after(last, 'stream') if next_index < len(self.llms) and hedges < self.max_hedges else None
+                done, _ = wait(streams, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"Hedging stream to {self.llms[next_index].platform}")
+                    start(next_index)
+                    next_index += 1
+                    hedges += 1
+                    continue
+                for future in done:
+                    index = streams.pop(future)
+                    if future.exception() is None and winner is None:
+                        winner = future.result()
+                    elif future.exception() is None:
+                        future.result()[0].close()
+                    else:
+                        error = future.exception()
+                        logger.warning(f"{self.llms[index].platform} failed: {error}")
+                if winner is None and not streams and next_index < len(self.llms):
+                    start(next_index)
+                    next_index += 1
+            if winner is None:
+                raise error # type: ignore
+        finally:
+            for future in streams:
+                future.add_done_callback(close_loser)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        stream, delta = winner
+        try:
+            if delta:
+                yield delta
+            yield from stream
+        finally:
+            stream.close()
+
+    async def _astream(self, query: Any, **kwds: Any) -> AsyncIterator[str]:
+        """Async version of _stream(). Losing streams are cancelled and closed."""
+        self._check_llms()
+        streams: Dict[asyncio.Task, tuple] = {}
+
+        async def first_delta(index: int, stream: AsyncIterator[str]) -> str:
+            start = time.perf_counter()
+            try:
+                delta = await anext(stream)
+            except StopAsyncIteration:
+                delta = ''
+            self.histogram(index, 'stream').record(time.perf_counter() - start)
+            return delta
+
+        def start(index: int):
+            stream = self.backend(index).astream(query, **kwds)
+            streams[asyncio.create_task(first_delta(index, stream))] = (index, stream)
+
+        winner = None
+        try:
+            start(0)
+            next_index, hedges, error = 1, 0, None
+            while streams and winner is None:
+                last = max(index for index, _ in streams.values())
+                timeout = self.hedge_after(last, 'stream') if next_index < len(self.llms) and hedges < self.max_hedges else None
+                done, _ = await asyncio.wait(streams, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"Hedging stream to {self.llms[next_index].platform}")
+                    start(next_index)
+                    next_index += 1
+                    hedges += 1
+                    continue
+                for task in done:
+                    index, stream = streams.pop(task)
+                    if task.exception() is None and winner is None:
+                        winner = (stream, task.result())
+                    elif task.exception() is None:
+                        await stream.aclose() # type: ignore
+                    else:
+                        error = task.exception()
+                        logger.warning(f"{self.llms[index].platform} failed: {error}")
+                if winner is None and not streams and next_index < len(self.llms):
+                    start(next_index)
+                    next_index += 1
+            if winner is None:
+                raise error # type: ignore
+        finally:
+            for task, (_, stream) in streams.items():
+                task.cancel()
+            for task, (_, stream) in streams.items():
+                await asyncio.gather(task, return_exceptions=True)
+                await stream.aclose() # type: ignore
+
+        stream, delta = winner
+        try:
+            if delta:
+                yield delta
+            async for delta in stream:
+                yield delta
+        finally:
+            await stream.aclose() # type: ignore
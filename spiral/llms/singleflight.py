@@ -0,0 +1,179 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+from concurrent.futures import Future, CancelledError
+from contextlib import aclosing
+import threading
+import asyncio
+import weakref
+
+
+class AsyncFlight:
+    """An in-flight async call and the number of callers waiting for it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.abandoned = False
+        """Set when every caller left and the task was cancelled"""
+
+
+class AsyncStreamFlight:
+    """An async stream in flight, the items it produced so far and the queues of its readers"""
+
+    END = object()
+    """Put in the readers' queues when the stream ends"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.items: List[Any] = []
+        self.queues: Set[asyncio.Queue] = set()
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.abandoned = False
+        """Set when every reader left and the task was cancelled"""
+
+    async def produce(self, stream: Callable[[], AsyncIterator[Any]]):
+        try:
+            async with aclosing(stream()) as items: # type: ignore
+                async for item in items:
+                    self.items.append(item)
+                    for queue in self.queues:
+                        queue.put_nowait(item)
+        except BaseException as e:
+            self.error = e
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self.done = True
+            for queue in self.queues:
+                queue.put_nowait(self.END)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single call.
+
+    The first caller of a key runs the call. Callers that arrive while it
+    is in flight wait for it and get the same result or exception. Sync
+    and async calls are coalesced separately, async calls per event loop.
+
+    A cancelled async caller only stops waiting. The shared call is
+    cancelled once no caller waits for it anymore. If the thread running a
+    sync call is interrupted, the callers waiting for it run the call
+    themselves.
+
+    Async streams are coalesced with astream(). Every caller gets all the
+    items of the one stream, the items produced before it joined at once
+    and the rest as they are produced.
+
+    Example:
+        flights = SingleFlight()
+        response = flights.do(key, lambda: llm(query))
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._async_calls: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._async_streams: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def do(self, key: str, call: Callable[[], Any]) -> Any:
+        """Runs call, or waits for the call in flight with the same key.
+
+        Args:
+            key (str): Identifies calls that give the same result
+            call (Callable[[], Any]): The call
+
+        Returns:
+            Any: The result of the call
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            try:
+                return future.result()
+            except CancelledError:
+                return self.do(key, call)
+
+        try:
+            result = call()
+        except Exception as e:
+            self._finish(key, future)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            self._finish(key, future)
+            future.cancel()
+            raise
+        self._finish(key, future)
+        future.set_result(result)
+        return result
+
+    async def ado(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of do()"""
+        loop = asyncio.get_running_loop()
+        calls: Dict[str, AsyncFlight] = self._async_calls.setdefault(loop, {})
+
+        flight = calls.get(key)
+        if flight is None or flight.abandoned:
+            flight = calls[key] = AsyncFlight(loop.create_task(call()))
+            flight.task.add_done_callback(lambda task, flight=flight: self._afinish(calls, key, flight))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                flight.abandoned = True
+                flight.task.cancel()
+
+    async def astream(self, key: str, stream: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Reads stream, or the stream in flight with the same key.
+
+        Args:
+            key (str): Identifies streams that give the same items
+            stream (Callable[[], AsyncIterator[Any]]): Starts the stream
+
+        Yields:
+            Any: The items of the stream
+        """
+        loop = asyncio.get_running_loop()
+        streams: Dict[str, AsyncStreamFlight] = self._async_streams.setdefault(loop, {})
+
+        flight = streams.get(key)
+        if flight is None or flight.abandoned:
+            flight = streams[key] = AsyncStreamFlight()
+            flight.task = loop.create_task(flight.produce(stream))
+            flight.task.add_done_callback(lambda task, flight=flight: self._afinish(streams, key, flight))
+
+        queue: asyncio.Queue = asyncio.Queue()
+        backlog = list(flight.items)
+        flight.queues.add(queue)
+        try:
+            for item in backlog:
+                yield item
+            while not flight.done or not queue.empty():
+                item = await queue.get()
+                if item is AsyncStreamFlight.END:
+                    break
+                yield item
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.queues.discard(queue)
+            if not flight.queues and not flight.done:
+                flight.abandoned = True
+                flight.task.cancel() # type: ignore
+
+    def _finish(self, key: str, future: Future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    @staticmethod
+    def _afinish(calls: Dict[str, Any], key: str, flight: Any):
+        if calls.get(key) is flight:
+            del calls[key]
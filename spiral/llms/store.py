@@ -0,0 +1,418 @@
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+from pathlib import Path
+from PIL import Image
+import threading
+import tempfile
+import hashlib
+import logging
+import sqlite3
+import base64
+import copy
+import json
+import time
+import os
+import io
+
+from spiral.config import SESSIONS_FILE, IMAGES_DIR
+from spiral.llms.history import ChatHistory
+from spiral.llms.conversation import Conversation
+from spiral.utils import image_cache
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+
+class StoredHistory(ChatHistory):
+    """Chat history that writes every message to a SessionStore as it is added.
+
+    Image messages are kept as the path of a content-addressed image file
+    instead of a PIL Image. Messages covered by the summary can be dropped
+    from memory with release(), so long sessions use about as much memory
+    as their unsummarized messages.
+
+    Editing the history other than by appending rewrites the messages in
+    memory in the store and drops the stored summary. Messages that were
+    dropped from memory stay stored before them.
+
+    Use SessionStore.create() or SessionStore.open() to get one.
+    """
+
+    def __init__(self, store: 'SessionStore', session_id: str, messages: Iterable[dict] = (), ids: Iterable[int] = ()):
+        super().__init__(messages)
+        self.store = store
+        self.session_id = session_id
+        self._ids = list(ids)
+        """Row ids of the messages in the store"""
+
+    def append(self, message: dict):
+        message_id, stored = self.store.add_message(self.session_id, message)
+        super().append(stored)
+        self._ids.append(message_id)
+
+    def extend(self, messages: Iterable[dict]):
+        for message in messages:
+            self.append(message)
+
+    def __iadd__(self, messages: Iterable[dict]):
+        self.extend(messages)
+        return self
+
+    def set_summary(self, summary: str, index: int):
+        super().set_summary(summary, index)
+        summary_before = self._ids[index - 1] + 1 if index else 0
+        self.store.set_summary(self.session_id, summary, summary_before)
+
+    def edited(self):
+        super().edited()
+        self._ids, messages = self.store.replace_messages(self.session_id, self._ids, list(self))
+        list.__setitem__(self, slice(None), messages)
+
+    def release(self, keep_first: int = 0):
+        """Drops the messages covered by the summary from memory. They stay in the store.
+
+        Indexes of the remaining messages shift down, so this must not be
+        called while the history is being read, e.g. during a request.
+
+        Args:
+            keep_first (int, optional): Number of messages at the start to keep, such as
+                the context window's pinned messages. Defaults to 0.
+        """
+        start, end = min(keep_first, self.summary_index), self.summary_index
+        if end <= start:
+            return
+        list.__delitem__(self, slice(start, end))
+        del self._ids[start:end]
+        with self._lock:
+            # Formatted lists may be in use, so they are replaced rather than changed
+            self._formatted = {key: formatted[:start] + formatted[end:] for key, formatted in self._formatted.items()}
+            self.revision += 1
+        self.summary_index = start
+
+    def detached(self) -> ChatHistory:
+        """In-memory copy of the loaded messages and summary, not written to the store"""
+        history = ChatHistory(self)
+        history.set_summary(self.summary, self.summary_index)
+        return history
+
+    def __copy__(self):
+        return self.detached()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.detached(), memo)
+
+    def __reduce__(self):
+        return self.detached().__reduce__()
+
+
+class SessionStore(BaseModel):
+    """Durable store of conversations, in a SQLite database in WAL mode.
+
+    Each message is written as a row when it is added to the history, so
+    a conversation can be resumed after the process exits or crashes
+    without sending any request again. Images are written once to
+    content-addressed files under images_path, and messages refer to them
+    by path.
+
+    Resuming loads only the messages not covered by the conversation's
+    summary, in pages. Older messages can be read with messages().
+
+    Several processes can write to the same store. Each conversation
+    should be written to by one process at a time.
+
+    Example:
+        store = SessionStore()
+        agent.conversation = store.create(agent=agent.name)
+        ...
+        agent.conversation = store.open(conversation_id)
+
+    Args:
+        path (str, optional): SQLite database file. Defaults to SESSIONS_FILE.
+        images_path (str, optional): Directory of the image files. Defaults to IMAGES_DIR.
+        page_size (int): Number of rows read at a time
+    """
+
+    path: Optional[str] = Field(default=None)
+    """SQLite database file. Defaults to SESSIONS_FILE in SPIRAL_WORKDIR."""
+
+    images_path: Optional[str] = Field(default=None)
+    """Directory of the content-addressed image files. Defaults to IMAGES_DIR in SPIRAL_WORKDIR."""
+
+    page_size: int = Field(default=500)
+    """Number of rows read from the database at a time"""
+
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+    _connection: Optional[sqlite3.Connection] = PrivateAttr(default=None)
+
+    def __deepcopy__(self, memo: Optional[dict] = None) -> 'SessionStore':
+        # The store is shared, copies of a conversation keep using it
+        return self
+
+    def create(self, conversation: Optional[Conversation] = None, agent: str = '') -> Conversation:
+        """Stores a new conversation and returns it with a history that writes to the store.
+
+        Args:
+            conversation (Conversation, optional): The conversation to store, with its messages
+                and settings. Defaults to a new conversation.
+            agent (str, optional): Name of the agent having the conversation
+
+        Returns:
+            Conversation: The stored conversation
+        """
+        conversation = conversation or Conversation()
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT INTO sessions (id, agent, settings, summary, summary_before, created, updated) VALUES (?, ?, ?, '', 0, ?, ?)",
+                    (conversation.id, agent, self._settings(conversation), now, now)
+                )
+        history = StoredHistory(self, conversation.id)
+        history.extend(conversation.history)
+        if conversation.history.summary: # type: ignore
+            history.set_summary(conversation.history.summary, conversation.history.summary_index) # type: ignore
+        return conversation.model_copy(update={'history': history})
+
+    def open(self, session_id: str, keep_first: int = 0) -> Conversation:
+        """Resumes a stored conversation.
+
+        Only the messages not covered by the summary are loaded, and the
+        first keep_first messages.
+
+        Args:
+            session_id (str): ID of the conversation
+            keep_first (int, optional): Number of messages at the start to load, such as
+                the context window's pinned messages. Defaults to 0.
+
+        Returns:
+            Conversation: The conversation, with a history that writes to the store
+
+        Raises:
+            KeyError: There is no conversation with this ID
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT settings, summary, summary_before FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"Session {session_id} not found")
+        settings, summary, summary_before = row
+
+        head = list(self._rows(session_id, 0, limit=keep_first, before=summary_before)) if keep_first else []
+        tail = list(self._rows(session_id, summary_before))
+        history = StoredHistory(self, session_id, [message for _, message in head + tail], [id for id, _ in head + tail])
+        history.summary = summary
+        history.summary_index = len(head) if summary else 0
+        return Conversation(id=session_id, history=history, **json.loads(settings))
+
+    def open_or_create(self, session_id: str, agent: str = '', keep_first: int = 0) -> Conversation:
+        """Resumes a stored conversation, or stores a new one with this ID"""
+        try:
+            return self.open(session_id, keep_first)
+        except KeyError:
+            pass
+        try:
+            return self.create(Conversation(id=session_id), agent)
+        except sqlite3.IntegrityError:
+            # Another process created it first
+            return self.open(session_id, keep_first)
+
+    def save(self, conversation: Conversation):
+        """Stores the settings of a conversation, such as its system prompt"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "UPDATE sessions SET settings = ?, updated = ? WHERE id = ?",
+                    (self._settings(conversation), time.time(), conversation.id)
+                )
+
+    def sessions(self, agent: Optional[str] = None) -> List[dict]:
+        """Stored conversations, most recently updated first
+
+        Args:
+            agent (str, optional): Only list the conversations of this agent
+        """
+        query = "SELECT s.id, s.agent, s.created, s.updated, (SELECT COUNT(*) FROM messages m WHERE m.session_id = s.id) FROM sessions s"
+        params: tuple = ()
+        if agent is not None:
+            query += " WHERE s.agent = ?"
+            params = (agent,)
+        with self._lock:
+            rows = self._connect().execute(query + " ORDER BY s.updated DESC", params).fetchall()
+        return [
+            {'id': id, 'agent': agent, 'created': created, 'updated': updated, 'messages': count}
+            for id, agent, created, updated, count in rows
+        ]
+
+    def messages(self, session_id: str) -> Iterator[dict]:
+        """All stored messages of a conversation, read lazily in pages"""
+        for _, message in self._rows(session_id, 0):
+            yield message
+
+    def delete(self, session_id: str):
+        """Removes a conversation and its messages. Image files are kept, other messages may share them."""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def close(self):
+        """Closes the database connection"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def add_message(self, session_id: str, message: dict) -> Tuple[int, dict]:
+        """Appends a message to a conversation.
+
+        Returns:
+            tuple: The row id of the message, and the message as stored, with images replaced by files
+        """
+        stored = self.store_images(message)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                cursor = connection.execute(
+                    "INSERT INTO messages (session_id, message, created) VALUES (?, ?, ?)",
+                    (session_id, json.dumps(stored, default=str), now)
+                )
+                connection.execute("UPDATE sessions SET updated = ? WHERE id = ?", (now, session_id))
+        return cursor.lastrowid, stored # type: ignore
+
+    def set_summary(self, session_id: str, summary: str, summary_before: int):
+        """Stores the running summary of the messages with row ids below summary_before"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "UPDATE sessions SET summary = ?, summary_before = ?, updated = ? WHERE id = ?",
+                    (summary, summary_before, time.time(), session_id)
+                )
+
+    def replace_messages(self, session_id: str, ids: List[int], messages: List[dict]) -> Tuple[List[int], List[dict]]:
+        """Replaces messages of a conversation, appending the new ones, and drops its summary.
+
+        Args:
+            session_id (str): ID of the conversation
+            ids (List[int]): Row ids of the messages to remove
+            messages (List[dict]): Messages to append
+
+        Returns:
+            tuple: The row ids of the messages, and the messages as stored
+        """
+        stored = [self.store_images(message) for message in messages]
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "DELETE FROM messages WHERE session_id = ? AND id = ?", [(session_id, id) for id in ids]
+                )
+                connection.execute(
+                    "UPDATE sessions SET summary = '', summary_before = 0, updated = ? WHERE id = ?", (now, session_id)
+                )
+                ids = [
+                    connection.execute(
+                        "INSERT INTO messages (session_id, message, created) VALUES (?, ?, ?)",
+                        (session_id, json.dumps(message, default=str), now)
+                    ).lastrowid
+                    for message in stored
+                ]
+        return ids, stored # type: ignore
+
+    def store_images(self, message: dict) -> dict:
+        """Writes the image of an image message to a content-addressed file.
+
+        Returns:
+            dict: The message with the image and its encoding replaced by the file's path and content hash
+        """
+        if not isinstance(message, dict) or message.get('type') != 'image':
+            return message
+        if message.get('image') is not None:
+            digest = image_cache.digest(message['image'])
+            path = self.image_path(digest)
+            if not path.exists():
+                image: Image.Image = message['image']
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                buffer = io.BytesIO()
+                image.save(buffer, format='JPEG')
+                self._write_file(path, buffer.getvalue())
+        elif message.get('data'):
+            data = base64.b64decode(message['data'])
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            path = self.image_path(digest)
+            if not path.exists():
+                self._write_file(path, data)
+        else:
+            return message
+        stored = {key: value for key, value in message.items() if key not in ('image', 'data')}
+        stored.update({'path': str(path), 'digest': digest})
+        return stored
+
+    def image_path(self, digest: str) -> Path:
+        """Path of the image file with a content hash"""
+        return Path(self.images_path or IMAGES_DIR) / digest[:2] / f"{digest}.jpg"
+
+    @staticmethod
+    def _write_file(path: Path, data: bytes):
+        """Writes a file atomically, so concurrent writers of the same image do not clash"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file, temporary = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(file, 'wb') as output:
+                output.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    @staticmethod
+    def _settings(conversation: Conversation) -> str:
+        return json.dumps(conversation.model_dump(exclude={'id', 'history'}))
+
+    def _rows(self, session_id: str, start: int, limit: Optional[int] = None, before: Optional[int] = None) -> Iterator[Tuple[int, dict]]:
+        """Messages of a conversation with row ids from start, read in pages"""
+        returned = 0
+        while limit is None or returned < limit:
+            size = self.page_size if limit is None else min(self.page_size, limit - returned)
+            with self._lock:
+                rows = self._connect().execute(
+                    "SELECT id, message FROM messages WHERE session_id = ? AND id >= ? AND id < ? ORDER BY id LIMIT ?",
+                    (session_id, start, before if before is not None else 2 ** 63 - 1, size)
+                ).fetchall()
+            for id, message in rows:
+                yield id, json.loads(message)
+            returned += len(rows)
+            if len(rows) < size:
+                return
+            start = rows[-1][0] + 1
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens the database on first use. Called with the lock held."""
+        if self._connection is None:
+            connection = sqlite3.connect(self.path or str(SESSIONS_FILE), check_same_thread=False, timeout=30.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, agent TEXT NOT NULL, settings TEXT NOT NULL, summary TEXT NOT NULL, "
+                "summary_before INTEGER NOT NULL, created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, message TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+            connection.commit()
+            self._connection = connection
+        return self._connection
@@ -1,13 +1,16 @@
 import os
 import sys
-import together 
+from openai import OpenAI as OpenAILLM, AsyncOpenAI
 from spiral.llms.base import LLM
+from spiral.llms.usage import record_usage
 from dotenv import load_dotenv
 from pydantic import Extra, Field, root_validator
-from typing import Any, Dict, List, Mapping, Optional 
+from typing import Any, Dict, List, Mapping, Optional, Iterator, AsyncIterator
 
 load_dotenv()
 
+TOGETHER_API_BASE = "https://api.together.xyz/v1"
+
 B_INST, E_INST = "[INST]", "[/INST]"
 B_SYS, E_SYS = "<<SYS>>\n", "\n<</SYS>>\n\n"
 DEFAULT_SYSTEM_PROMPT = """
@@ -75,23 +78,111 @@ class Together(LLM):
     def _llm_type(self) -> str:
         """Return type of LLM."""
         return "together"
+    
+    def create_client(self) -> OpenAILLM:
+        """Creates a pooled client for Together's OpenAI compatible api"""
+        return OpenAILLM(
+            api_key=self.api_key,
+            base_url=self.api_base or TOGETHER_API_BASE,
+            max_retries=0,
+            http_client=self.http_client()
+        )
+    
+    def create_async_client(self) -> AsyncOpenAI:
+        """Creates a pooled async client for Together's OpenAI compatible api"""
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.api_base or TOGETHER_API_BASE,
+            max_retries=0,
+            http_client=self.async_http_client()
+        )
+    
+    def format_message(self, message: dict) -> str:
+        """Formats a single chat history message as an instruct prompt segment"""
+        content = message['message'] if message['type'] == 'text' else 'This is the result of the latest screenshot'
+        if message['role'].lower() == 'assistant':
+            return f" {content}</s>"
+        return f"{B_INST} {content} {E_INST}"
+    
+    def format_query(self, prompt: dict | str) -> str:
+        """Formats a prompt and the cached chat history as a single instruct prompt"""
+        system_prompt = self.system_prompt or DEFAULT_SYSTEM_PROMPT
+        if isinstance(prompt, str):
+            return get_prompt(prompt, system_prompt)
+        
+        return ''.join([
+            B_INST + B_SYS + system_prompt + E_SYS + E_INST,
+            *self.formatted_history(prompt),
+            self.format_message(prompt)
+        ])
+    
+    def request_params(self, prompt: dict | str) -> dict:
+        """Builds the completion parameters for a prompt"""
+        return {
+            'prompt': self.format_query(prompt),
+            'model': self.model,
+            'max_tokens': self.max_tokens,
+            'temperature': self.temperature,
+            'stop': self.stop_sequences[:4] or None,
+        }
 
-    def __call__(
+    def _call(
         self,
         prompt: str,
         **kkwargs: Any,
     ) -> str:
         """Call to Together endpoint."""
         
-        together.api_key = self.api_key
-        output = together.Complete.create(
-            get_prompt(prompt),
-            model=self.model,
-            max_tokens=self.max_tokens,
-            temperature=self.temperature,
-        )
+        output = self.client.completions.create(**self.request_params(prompt))
+
+        if output.usage:
+            record_usage(output.usage.prompt_tokens, output.usage.completion_tokens)
+        
+        return output.choices[0].text
+
+    async def _acall(
+        self,
+        prompt: str,
+        **kkwargs: Any,
+    ) -> str:
+        """Async call to Together endpoint."""
+        
+        output = await self.aclient.completions.create(**self.request_params(prompt))
+
+        if output.usage:
+            record_usage(output.usage.prompt_tokens, output.usage.completion_tokens)
+        
+        return output.choices[0].text
+
+    def _stream(
+        self,
+        prompt: str,
+        **kkwargs: Any,
+    ) -> Iterator[str]:
+        """Streaming call to Together endpoint."""
+        
+        output = self.client.completions.create(**self.request_params(prompt), stream=True)
+        try:
+            for chunk in output:
+                if chunk.choices and chunk.choices[0].text:
+                    yield chunk.choices[0].text
+        finally:
+            output.close()
+
+    async def _astream(
+        self,
+        prompt: str,
+        **kkwargs: Any,
+    ) -> AsyncIterator[str]:
+        """Async streaming call to Together endpoint."""
         
-        return output['output']['choices'][0]['text']   # type: ignore
+        output = await self.aclient.completions.create(**self.request_params(prompt), stream=True)
+        try:
+            async for chunk in output:
+                if chunk.choices and chunk.choices[0].text:
+                    yield chunk.choices[0].text
+        finally:
+            await output.close()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,64 @@
+from pydantic import BaseModel, Field
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class Usage(BaseModel):
+    """Token usage of one or more llm requests"""
+
+    input_tokens: int = Field(default=0)
+    """Tokens sent to the llm"""
+
+    output_tokens: int = Field(default=0)
+    """Tokens generated by the llm"""
+
+    requests: int = Field(default=0)
+    """Number of requests the provider reported usage for"""
+
+    estimated: bool = Field(default=False)
+    """Whether some of the counts were estimated because the provider did not report them"""
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, other: 'Usage'):
+        """Adds the counts of another usage to this one"""
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+        self.requests += other.requests
+        self.estimated = self.estimated or other.estimated
+
+
+_usage: ContextVar[Optional[Usage]] = ContextVar('spiral_usage', default=None)
+
+
+@contextmanager
+def track_usage() -> Iterator[Usage]:
+    """Collects the usage that llm requests made in this context report.
+
+    Worker threads started with asyncio.to_thread and tasks created in the
+    context share the same Usage.
+
+    Example:
+        with track_usage() as usage:
+            llm(query)
+        print(usage.total_tokens)
+    """
+    usage = Usage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def record_usage(input_tokens: Optional[int], output_tokens: Optional[int]):
+    """Adds the usage a provider reported for a request to the tracked usage, if any"""
+    usage = _usage.get()
+    if usage is None:
+        return
+    usage.input_tokens += input_tokens or 0
+    usage.output_tokens += output_tokens or 0
+    usage.requests += 1
@@ -0,0 +1,359 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+from aiohttp import web, WSCloseCode, WSMsgType
+import weakref
+import logging
+import asyncio
+import json
+import time
+
+from .agents.base import Agent
+from .llms.conversation import Conversation
+from .agents.exceptions import AgentError, DeadlineExceeded, LLMError
+from .llms.store import SessionStore
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+
+def dumps(value: Any) -> str:
+    """JSON encodes a response, turning values like images into strings"""
+    return json.dumps(value, default=str)
+
+
+def error_response(error: type[web.HTTPException], message: str, **headers: str) -> web.HTTPException:
+    """An HTTP error with a JSON body"""
+    return error(text=dumps({'error': message}), content_type='application/json', headers=headers)
+
+
+def error_status(error: AgentError) -> int:
+    """HTTP status of a failed agent run"""
+    if isinstance(error, DeadlineExceeded):
+        return 504
+    if isinstance(error, LLMError):
+        return 502
+    return 500
+
+
+class Session:
+    """A session hosted by the server, with its own copy of the agent and its conversation"""
+
+    def __init__(self, agent: Agent):
+        self.id = agent.conversation.id
+        self.agent = agent
+        self.lock = asyncio.Lock()
+        """Held while a query runs, so the queries of a session run one at a time"""
+
+        self.pending = 0
+        """Number of queries running or waiting in this session"""
+
+        self.last_used = time.monotonic()
+
+    def info(self) -> dict:
+        return {
+            'id': self.id,
+            'agent': self.agent.name,
+            'messages': len(self.agent.conversation.history),
+            'pending': self.pending
+        }
+
+
+class AgentServer:
+    """HTTP and WebSocket server hosting many concurrent conversations with an agent.
+
+    Each session gets a copy of the agent with its own conversation. The
+    queries of a session run one at a time, and at most max_concurrency
+    queries run across all sessions. Up to max_queue more may wait for
+    their turn, and up to max_session_queue per session. Queries over
+    these bounds are refused with 429 Too Many Requests.
+
+    With a store, sessions are persisted as they go. A session that is
+    not in memory, e.g. after a restart, is resumed from the store.
+
+    On shutdown the server stops accepting queries and waits up to
+    drain_timeout seconds for the running ones to finish.
+
+    Routes:
+        GET    /health                    Status and load of the server
+        POST   /sessions                  Creates a session
+        GET    /sessions/{id}             Describes a session
+        DELETE /sessions/{id}             Ends a session
+        POST   /sessions/{id}/messages    Runs a query: {"query": ..., "stream": false, "max_steps": ..., "timeout": ...}
+                                          Streams server-sent events when stream is true
+        GET    /sessions/{id}/ws          WebSocket that runs each query it receives and streams its events
+
+    Example:
+        AgentServer(AIAssistant(llm=Echo())).run(port=8080)
+
+    Args:
+        agent (Agent): The agent copied into every session
+        max_sessions (int): Maximum number of open sessions
+        max_concurrency (int): Maximum queries running at once
+        max_queue (int): Maximum queries waiting for a free slot
+        max_session_queue (int): Maximum queries running or waiting per session
+        session_ttl (float): Seconds after which an idle session may be closed
+        drain_timeout (float): Seconds to wait for running queries on shutdown
+        store (SessionStore, optional): Store persisting the sessions
+    """
+
+    def __init__(
+        self,
+        agent: Agent,
+        max_sessions: int = 1000,
+        max_concurrency: int = 16,
+        max_queue: int = 64,
+        max_session_queue: int = 4,
+        session_ttl: float = 3600.0,
+        drain_timeout: float = 30.0,
+        store: Optional[SessionStore] = None
+    ):
+        self.agent = agent
+        self.max_sessions = max_sessions
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_session_queue = max_session_queue
+        self.session_ttl = session_ttl
+        self.drain_timeout = drain_timeout
+        self.store = store
+
+        self.sessions: Dict[str, Session] = {}
+        self.pending = 0
+        """Number of queries running or waiting across all sessions"""
+
+        self.running = 0
+        self.draining = False
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._websockets: weakref.WeakSet = weakref.WeakSet()
+
+    def create_app(self) -> web.Application:
+        """Creates the aiohttp application serving the agent"""
+        app = web.Application()
+        app.add_routes([
+            web.get('/health', self.health),
+            web.post('/sessions', self.create_session),
+            web.get('/sessions/{id}', self.get_session),
+            web.delete('/sessions/{id}', self.delete_session),
+            web.post('/sessions/{id}/messages', self.post_message),
+            web.get('/sessions/{id}/ws', self.websocket),
+        ])
+        app.on_startup.append(self._startup)
+        app.on_shutdown.append(self._shutdown)
+        return app
+
+    def run(self, host: str = '127.0.0.1', port: int = 8080):
+        """Serves the agent until interrupted, then drains running queries"""
+        web.run_app(self.create_app(), host=host, port=port, shutdown_timeout=self.drain_timeout)
+
+    def new_agent(self, conversation: Optional[Conversation] = None) -> Agent:
+        """A copy of the agent for a session, with a new conversation or the one given.
+
+        The llm, its api clients, the tools and the caches are shared with
+        the other sessions.
+        """
+        update: Dict[str, Any] = {
+            'conversation': conversation or self.agent.conversation.fork(),
+            'sub_agents': list(self.agent.sub_agents)
+        }
+        if self.agent.compactor is not None:
+            update['compactor'] = self.agent.compactor.model_copy()
+        return self.agent.model_copy(update=update)
+
+    def get(self, request: web.Request) -> Session:
+        session_id = request.match_info['id']
+        session = self.sessions.get(session_id)
+        if session is None and self.store is not None:
+            if len(self.sessions) >= self.max_sessions:
+                self.evict_idle_sessions()
+            if len(self.sessions) >= self.max_sessions:
+                raise error_response(web.HTTPTooManyRequests, 'Too many sessions', **{'Retry-After': '60'})
+            try:
+                pinned = self.agent.llm.context_window.pinned_messages if self.agent.llm.context_window else 0
+                session = Session(self.new_agent(self.store.open(session_id, keep_first=pinned)))
+                self.sessions[session_id] = session
+            except KeyError:
+                pass
+        if session is None:
+            raise error_response(web.HTTPNotFound, 'Session not found')
+        session.last_used = time.monotonic()
+        return session
+
+    def evict_idle_sessions(self):
+        """Closes the sessions that have been idle for longer than session_ttl. Stored sessions can be resumed."""
+        expired = time.monotonic() - self.session_ttl
+        for session in list(self.sessions.values()):
+            if not session.pending and session.last_used < expired:
+                self.close_session(session)
+
+    def close_session(self, session: Session):
+        """Removes a session and frees what its tools keep for it"""
+        del self.sessions[session.id]
+        for tool in session.agent.tools:
+            tool.end_session(session.id)
+
+    @asynccontextmanager
+    async def admit(self, session: Session) -> AsyncIterator[None]:
+        """Waits for the session's turn and a free slot, or refuses the query if the queues are full"""
+        if self.draining:
+            raise error_response(web.HTTPServiceUnavailable, 'Server is shutting down')
+        if self.pending >= self.max_concurrency + self.max_queue or session.pending >= self.max_session_queue:
+            raise error_response(web.HTTPTooManyRequests, 'Too many queries, try again later', **{'Retry-After': '1'})
+
+        self.pending += 1
+        session.pending += 1
+        self._idle.clear() # type: ignore
+        try:
+            async with session.lock, self._slots: # type: ignore
+                self.running += 1
+                try:
+                    yield
+                finally:
+                    self.running -= 1
+                    session.agent.compact_history()
+        finally:
+            self.pending -= 1
+            session.pending -= 1
+            session.last_used = time.monotonic()
+            if not self.pending:
+                self._idle.set() # type: ignore
+
+    async def events(self, session: Session, query: Any, options: dict) -> AsyncIterator[dict]:
+        """Runs a query, yielding answer deltas and tool calls as they happen and then the result or error"""
+        events: asyncio.Queue = asyncio.Queue()
+        run = asyncio.create_task(session.agent.arun(
+            query,
+            on_answer=lambda text: events.put_nowait({'type': 'delta', 'text': text}),
+            on_tool_call=lambda name, arguments: events.put_nowait({'type': 'tool_call', 'tool': name, 'arguments': arguments}),
+            **options
+        ))
+        run.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while (event := await events.get()) is not None:
+                yield event
+            try:
+                yield {'type': 'result', **run.result().model_dump()}
+            except AgentError as e:
+                yield {'type': 'error', 'status': error_status(e), 'error': str(e), 'kind': type(e).__name__}
+            except Exception as e:
+                # The response has started, so the error can only be reported as an event
+                logger.exception(f"Query in session {session.id} failed")
+                yield {'type': 'error', 'status': 500, 'error': str(e), 'kind': type(e).__name__}
+        finally:
+            # The client went away, stop the run
+            run.cancel()
+
+    @staticmethod
+    def run_options(body: dict) -> dict:
+        options = {key: body[key] for key in ('max_steps', 'timeout') if body.get(key) is not None}
+        if not all(isinstance(value, (int, float)) for value in options.values()):
+            raise error_response(web.HTTPBadRequest, 'max_steps and timeout must be numbers')
+        return options
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'status': 'draining' if self.draining else 'ok',
+            'sessions': len(self.sessions),
+            'running': self.running,
+            'queued': self.pending - self.running
+        })
+
+    async def create_session(self, request: web.Request) -> web.Response:
+        if self.draining:
+            raise error_response(web.HTTPServiceUnavailable, 'Server is shutting down')
+        if len(self.sessions) >= self.max_sessions:
+            self.evict_idle_sessions()
+        if len(self.sessions) >= self.max_sessions:
+            raise error_response(web.HTTPTooManyRequests, 'Too many sessions', **{'Retry-After': '60'})
+        conversation = self.agent.conversation.fork()
+        if self.store is not None:
+            conversation = self.store.create(conversation, agent=self.agent.name)
+        session = Session(self.new_agent(conversation))
+        self.sessions[session.id] = session
+        return web.json_response(session.info(), status=201)
+
+    async def get_session(self, request: web.Request) -> web.Response:
+        return web.json_response(self.get(request).info())
+
+    async def delete_session(self, request: web.Request) -> web.Response:
+        session = self.get(request)
+        self.close_session(session)
+        if self.store is not None:
+            self.store.delete(session.id)
+        return web.Response(status=204)
+
+    async def post_message(self, request: web.Request) -> web.StreamResponse:
+        session = self.get(request)
+        try:
+            body = await request.json()
+        except ValueError:
+            raise error_response(web.HTTPBadRequest, 'Body must be a JSON object')
+        if not isinstance(body, dict) or not body.get('query'):
+            raise error_response(web.HTTPBadRequest, 'Missing query')
+        options = self.run_options(body)
+
+        async with self.admit(session):
+            if not body.get('stream'):
+                try:
+                    result = await session.agent.arun(body['query'], **options)
+                except AgentError as e:
+                    return web.Response(
+                        status=error_status(e), content_type='application/json',
+                        text=dumps({'error': str(e), 'kind': type(e).__name__})
+                    )
+                return web.Response(text=dumps(result.model_dump()), content_type='application/json')
+
+            response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+            await response.prepare(request)
+            async for event in self.events(session, body['query'], options):
+                await response.write(f"event: {event['type']}\ndata: {dumps(event)}\n\n".encode())
+            await response.write_eof()
+            return response
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        session = self.get(request)
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self._websockets.add(ws)
+
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            try:
+                body = json.loads(message.data)
+                if not isinstance(body, dict) or not body.get('query'):
+                    raise ValueError('Missing query')
+                options = self.run_options(body)
+            except (ValueError, web.HTTPException) as e:
+                await ws.send_str(dumps({'type': 'error', 'status': 400, 'error': getattr(e, 'text', None) or str(e)}))
+                continue
+
+            # Messages are handled one at a time, so a client sending faster
+            # than its queries run is slowed down by the socket's buffers
+            try:
+                async with self.admit(session):
+                    async for event in self.events(session, body['query'], options):
+                        await ws.send_str(dumps(event))
+            except web.HTTPException as e:
+                await ws.send_str(dumps({'type': 'error', 'status': e.status, 'error': e.reason}))
+        return ws
+
+    async def _startup(self, app: web.Application):
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def _shutdown(self, app: web.Application):
+        """Refuses new queries and waits for the running ones before connections are closed"""
+        self.draining = True
+        if self.pending:
+            logger.warning(f"Waiting for {self.pending} queries to finish")
+            try:
+                await asyncio.wait_for(self._idle.wait(), self.drain_timeout) # type: ignore
+            except asyncio.TimeoutError:
+                logger.warning(f"{self.pending} queries did not finish in time")
+        for ws in list(self._websockets):
+            await ws.close(code=WSCloseCode.GOING_AWAY, message=b'Server shutdown')
@@ -1,10 +1,29 @@
 from ..tools.base import Tool
 from ..tools.tool import tool
-from ..tools.misc import (
-    Calculator, YoutubePlayer,
-    WorldNews, FSBrowser,
-    InternetBrowser, take_screenshot
-)
-
-from ..tools.python import PythonREPL
-from ..tools.serpapi import SearchTool
\ No newline at end of file
+import importlib
+
+TOOLS = {
+    'Calculator': 'spiral.tools.misc',
+    'YoutubePlayer': 'spiral.tools.misc',
+    'WorldNews': 'spiral.tools.misc',
+    'FSBrowser': 'spiral.tools.misc',
+    'InternetBrowser': 'spiral.tools.misc',
+    'take_screenshot': 'spiral.tools.misc',
+    'PythonREPL': 'spiral.tools.python',
+    'SearchTool': 'spiral.tools.serpapi',
+}
+"""Built-in tools and the modules defining them. Modules are imported on first use."""
+
+__all__ = ['Tool', 'tool', *TOOLS]
+
+
+def __getattr__(name: str):
+    if name not in TOOLS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(TOOLS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *TOOLS])
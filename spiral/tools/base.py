@@ -1,5 +1,10 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Any, Optional
+from contextvars import ContextVar
+from ..tools.cache import ToolCache, Fetch, AsyncFetch
+
+current_session: ContextVar[str] = ContextVar('current_session', default='')
+"""ID of the conversation a tool runs for. Set while an agent answers a query."""
 
 class Tool(BaseModel):
     """
@@ -15,6 +20,18 @@ class Tool(BaseModel):
     description: str
     """Description of what the tool does and how to use it"""
     
+    cache: Optional[ToolCache] = Field(default=None, exclude=True)
+    """Caches results of calls with the same arguments. None disables caching."""
+    
+    cache_ttl: float = Field(default=300.0)
+    """Seconds a cached result is returned as is"""
+    
+    cache_stale_ttl: float = Field(default=3600.0)
+    """Seconds after cache_ttl a cached result is returned while it is refreshed in the background"""
+    
+    cache_ignore_case: bool = Field(default=False)
+    """Whether calls with string arguments differing only in case share cached results, e.g. search queries"""
+    
     class Config:
         arbitrary_types_allowed = True
     
@@ -24,4 +41,24 @@ class Tool(BaseModel):
     
     async def arun(self, *args, **kwargs):
         """Asynchronous implementation"""
+        pass
+    
+    def cached(self, fetch: Fetch, *args: Any, **kwargs: Any) -> Any:
+        """The cached result of a call with these arguments, or the result of fetch
+
+        Args:
+            fetch (Fetch): Gets the result. Receives the cached entry to make a conditional request.
+        """
+        if self.cache is None:
+            return fetch(None).value
+        return self.cache.call(self.name, args, kwargs, fetch, self.cache_ttl, self.cache_stale_ttl, self.cache_ignore_case)
+    
+    async def acached(self, fetch: AsyncFetch, *args: Any, **kwargs: Any) -> Any:
+        """Async version of cached()"""
+        if self.cache is None:
+            return (await fetch(None)).value
+        return await self.cache.acall(self.name, args, kwargs, fetch, self.cache_ttl, self.cache_stale_ttl, self.cache_ignore_case)
+    
+    def end_session(self, session: str):
+        """Frees what the tool keeps for a conversation that ended"""
         pass
\ No newline at end of file
@@ -0,0 +1,380 @@
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from collections import OrderedDict
+import functools
+import threading
+import logging
+import sqlite3
+import asyncio
+import hashlib
+import json
+import time
+
+from ..config import CACHE_FILE
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+
+class CacheEntry(BaseModel):
+    """A tool result, and what is needed to revalidate it with its upstream"""
+
+    value: Any
+    """The tool result"""
+
+    etag: Optional[str] = Field(default=None)
+    """ETag header of the upstream response"""
+
+    last_modified: Optional[str] = Field(default=None)
+    """Last-Modified header of the upstream response"""
+
+    store: bool = Field(default=True)
+    """Whether the result is cached. Set False for errors."""
+
+    fresh_until: float = Field(default=0.0)
+    """Time until which the result is returned as is"""
+
+    stale_until: float = Field(default=0.0)
+    """Time until which the result is returned while it is refreshed in the background"""
+
+    def fresh(self, now: float) -> bool:
+        return now < self.fresh_until
+
+    def usable(self, now: float) -> bool:
+        return now < self.stale_until
+
+    def validators(self) -> Dict[str, str]:
+        """Headers of a conditional request for this result"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+Fetch = Callable[[Optional[CacheEntry]], CacheEntry]
+"""Gets a tool result. Receives the cached entry, if any, to make a conditional request, and returns it if it is unchanged."""
+
+AsyncFetch = Callable[[Optional[CacheEntry]], Awaitable[CacheEntry]]
+
+
+def normalize(value: Any, ignore_case: bool = False) -> Any:
+    """Arguments that mean the same call, like queries differing in spacing, normalize the same.
+
+    Case is kept unless ignore_case is set, as ids, urls and paths are case sensitive.
+    """
+    if isinstance(value, str):
+        value = ' '.join(value.split())
+        return value.lower() if ignore_case else value
+    if isinstance(value, (list, tuple)):
+        return [normalize(item, ignore_case) for item in value]
+    if isinstance(value, dict):
+        return {str(key): normalize(item, ignore_case) for key, item in value.items() if item is not None}
+    return value
+
+
+def cache_key(tool: str, args: tuple, kwargs: dict, ignore_case: bool = False) -> str:
+    """Stable hash of a tool call"""
+    encoded = json.dumps([tool, normalize(args, ignore_case), normalize(kwargs, ignore_case)], sort_keys=True, default=repr)
+    return hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest()
+
+
+class ToolCache(BaseModel):
+    """Cache of tool results with an in-memory LRU tier and a persistent SQLite tier.
+
+    Results are keyed by the tool name and its normalized arguments, see normalize(). A
+    result is returned as is for its tool's ttl. For stale_ttl seconds
+    more it is still returned, while it is refreshed in the background.
+    After that a call waits for a new result.
+
+    Tools that call an upstream supporting ETag or Last-Modified get the
+    expired entry when fetching, so they can make a conditional request
+    and keep the cached result when it is unchanged.
+
+    Example:
+        search = SearchTool(cache=ToolCache(), cache_ttl=600)
+
+    Args:
+        max_entries (int): Maximum results kept in memory
+        persistent (bool): Whether results are also stored on disk
+        path (str, optional): SQLite database file. Defaults to CACHE_FILE.
+        max_disk_entries (int): Maximum results kept on disk
+        max_age (float): Seconds an expired result is kept for conditional requests
+    """
+
+    max_entries: int = Field(default=1024)
+    """Maximum results kept in memory"""
+
+    persistent: bool = Field(default=True)
+    """Whether results are also stored on disk, and shared between processes"""
+
+    path: Optional[str] = Field(default=None)
+    """SQLite database file of the disk tier. Defaults to CACHE_FILE in SPIRAL_WORKDIR."""
+
+    max_disk_entries: int = Field(default=10_000)
+    """Maximum results kept on disk"""
+
+    max_age: float = Field(default=24 * 3600)
+    """Seconds an expired result is kept, so it can be revalidated instead of fetched again"""
+
+    _memory: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _connection: Optional[sqlite3.Connection] = PrivateAttr(default=None)
+    _writes: int = PrivateAttr(default=0)
+    _refreshing: set = PrivateAttr(default_factory=set)
+    _tasks: set = PrivateAttr(default_factory=set)
+    _stats: dict = PrivateAttr(default_factory=lambda: {
+        'hits': 0, 'stale_hits': 0, 'misses': 0, 'revalidated': 0, 'refreshes': 0
+    })
+
+    def __deepcopy__(self, memo: Optional[dict] = None) -> 'ToolCache':
+        # The cache is shared, copies of a tool keep using it
+        return self
+
+    @property
+    def stats(self) -> dict:
+        """Hit, miss and refresh counters"""
+        with self._lock:
+            return dict(self._stats, memory_entries=len(self._memory))
+
+    def call(
+        self, tool: str, args: tuple, kwargs: dict, fetch: Fetch, ttl: float, stale_ttl: float = 0, ignore_case: bool = False
+    ) -> Any:
+        """Returns the cached result of a tool call, or fetches it.
+
+        Args:
+            tool (str): Name of the tool
+            args (tuple): Arguments of the call
+            kwargs (dict): Keyword arguments of the call
+            fetch (Fetch): Gets the result
+            ttl (float): Seconds the result is fresh
+            stale_ttl (float, optional): Seconds after ttl the result is returned while it is refreshed
+            ignore_case (bool, optional): Whether string arguments differing only in case share the result
+        """
+        key = cache_key(tool, args, kwargs, ignore_case)
+        entry, cached = self.lookup(key)
+        if cached:
+            if not entry.fresh(time.time()):
+                self._start_refresh(key, lambda: self._refresh(key, entry, fetch, ttl, stale_ttl, claimed=True))
+            return entry.value
+        return self._refresh(key, entry, fetch, ttl, stale_ttl).value
+
+    async def acall(
+        self, tool: str, args: tuple, kwargs: dict, fetch: AsyncFetch, ttl: float, stale_ttl: float = 0, ignore_case: bool = False
+    ) -> Any:
+        """Async version of call(). The disk tier is used in a worker thread."""
+        key = cache_key(tool, args, kwargs, ignore_case)
+        entry, cached = self._lookup_memory(key)
+        if entry is None and self.persistent:
+            entry, cached = await asyncio.to_thread(self.lookup, key)
+        else:
+            self._count(entry, cached)
+        if cached:
+            if not entry.fresh(time.time()) and self._claim_refresh(key): # type: ignore
+                task = asyncio.create_task(self._arefresh(key, entry, fetch, ttl, stale_ttl, claimed=True))
+                self._tasks.add(task)
+                task.add_done_callback(self._refresh_done)
+            return entry.value # type: ignore
+        return (await self._arefresh(key, entry, fetch, ttl, stale_ttl)).value
+
+    def lookup(self, key: str) -> Tuple[Optional[CacheEntry], bool]:
+        """The entry of a key, even an expired one, and whether it can be returned"""
+        entry, cached = self._lookup_memory(key)
+        if entry is None:
+            entry = self._disk_get(key)
+            if entry is not None:
+                with self._lock:
+                    self._memory_set(key, entry)
+            cached = entry is not None and entry.usable(time.time())
+        self._count(entry, cached)
+        return entry, cached
+
+    def set(self, key: str, entry: CacheEntry):
+        """Caches an entry"""
+        with self._lock:
+            self._memory_set(key, entry)
+        if self.persistent:
+            self._disk_set(key, entry)
+
+    def clear(self):
+        """Removes all cached results from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            connection = self._disk()
+            if connection:
+                with connection:
+                    connection.execute("DELETE FROM tool_results")
+
+    def close(self):
+        """Closes the disk tier's database connection"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _lookup_memory(self, key: str) -> Tuple[Optional[CacheEntry], bool]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None, False
+            self._memory.move_to_end(key)
+            return entry, entry.usable(time.time())
+
+    def _count(self, entry: Optional[CacheEntry], cached: bool):
+        with self._lock:
+            if not cached:
+                self._stats['misses'] += 1
+            elif entry.fresh(time.time()): # type: ignore
+                self._stats['hits'] += 1
+            else:
+                self._stats['stale_hits'] += 1
+
+    def _stamp(self, key: str, previous: Optional[CacheEntry], entry: CacheEntry, ttl: float, stale_ttl: float) -> CacheEntry:
+        """Stores a fetched entry with new expiry times"""
+        if not entry.store:
+            return entry
+        now = time.time()
+        with self._lock:
+            if entry is previous:
+                self._stats['revalidated'] += 1
+        entry = entry.model_copy(update={'fresh_until': now + ttl, 'stale_until': now + ttl + stale_ttl})
+        self.set(key, entry)
+        return entry
+
+    def _refresh(self, key: str, previous: Optional[CacheEntry], fetch: Fetch, ttl: float, stale_ttl: float, claimed: bool = False) -> CacheEntry:
+        """Fetches and stores an entry. claimed is True for background refreshes started with _claim_refresh()."""
+        try:
+            return self._stamp(key, previous, fetch(previous), ttl, stale_ttl)
+        finally:
+            # A miss must not release the claim of a background refresh running for the key
+            if claimed:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+    async def _arefresh(self, key: str, previous: Optional[CacheEntry], fetch: AsyncFetch, ttl: float, stale_ttl: float, claimed: bool = False) -> CacheEntry:
+        """Async version of _refresh()"""
+        try:
+            entry = await fetch(previous)
+            if self.persistent and entry.store:
+                return await asyncio.to_thread(self._stamp, key, previous, entry, ttl, stale_ttl)
+            return self._stamp(key, previous, entry, ttl, stale_ttl)
+        finally:
+            if claimed:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+    def _claim_refresh(self, key: str) -> bool:
+        """Whether to start a refresh of a stale entry, False if one is already running"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self._stats['refreshes'] += 1
+            return True
+
+    def _refresh_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Refreshing a cached tool result failed: {task.exception()}")
+
+    def _start_refresh(self, key: str, refresh: Callable[[], Any]):
+        """Runs a refresh of a stale entry in a thread, unless one is already running"""
+        if not self._claim_refresh(key):
+            return
+
+        def run():
+            try:
+                refresh()
+            except Exception as e:
+                logger.warning(f"Refreshing a cached tool result failed: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _memory_set(self, key: str, entry: CacheEntry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        """Opens the database on first use. Called with the lock held."""
+        if not self.persistent:
+            return None
+        if self._connection is None:
+            try:
+                connection = sqlite3.connect(self.path or str(CACHE_FILE), check_same_thread=False, timeout=5.0)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS tool_results ("
+                    "key TEXT PRIMARY KEY, entry TEXT NOT NULL, stale_until REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS tool_results_accessed ON tool_results (accessed)")
+                connection.commit()
+                self._connection = connection
+            except sqlite3.Error as e:
+                logger.warning(f"Tool cache disk tier disabled: {e}")
+                self.persistent = False
+                return None
+        return self._connection
+
+    def _disk_get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            connection = self._disk()
+            if connection is None:
+                return None
+            try:
+                row = connection.execute("SELECT entry FROM tool_results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                with connection:
+                    connection.execute("UPDATE tool_results SET accessed = ? WHERE key = ?", (time.time(), key))
+                return CacheEntry.model_validate_json(row[0])
+            except (sqlite3.Error, ValueError) as e:
+                logger.warning(f"Tool cache read failed: {e}")
+                return None
+
+    def _disk_set(self, key: str, entry: CacheEntry):
+        try:
+            encoded = entry.model_dump_json()
+        except ValueError as e:
+            # Results that can not be stored as json are only kept in memory
+            logger.debug(f"Tool result not stored on disk: {e}")
+            return
+        with self._lock:
+            connection = self._disk()
+            if connection is None:
+                return
+            now = time.time()
+            try:
+                with connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO tool_results (key, entry, stale_until, accessed) VALUES (?, ?, ?, ?)",
+                        (key, encoded, entry.stale_until, now)
+                    )
+                    self._writes += 1
+                    if self._writes % 100 == 0:
+                        self._trim(connection, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Tool cache write failed: {e}")
+
+    def _trim(self, connection: sqlite3.Connection, now: float):
+        """Removes results expired for longer than max_age and the least recently used ones over max_disk_entries"""
+        connection.execute("DELETE FROM tool_results WHERE stale_until <= ?", (now - self.max_age,))
+        count = connection.execute("SELECT COUNT(*) FROM tool_results").fetchone()[0]
+        if count > self.max_disk_entries:
+            connection.execute(
+                "DELETE FROM tool_results WHERE key IN (SELECT key FROM tool_results ORDER BY accessed LIMIT ?)",
+                (count - self.max_disk_entries,)
+            )
+
+
+@functools.lru_cache(maxsize=None)
+def shared_tool_cache() -> ToolCache:
+    """The cache network tools use by default"""
+    return ToolCache()
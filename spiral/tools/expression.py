@@ -0,0 +1,345 @@
+from typing import Any, Callable, Dict, FrozenSet, Mapping, Optional, Sequence
+import statistics
+import functools
+import math
+import ast
+
+MAX_EXPRESSION_LENGTH = 2000
+"""Longest expression that is parsed"""
+
+MAX_INTEGER_BITS = 100000
+"""Largest integer a power can return, in bits, so an expression like 9**9**9 can not stall the process"""
+
+MAX_FACTORIAL = 1000
+"""Largest argument of factorial"""
+
+OPERATORS = (
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE
+)
+"""Operators expressions can use"""
+
+NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.Call, ast.Name, ast.Load,
+    ast.Constant, ast.Tuple, ast.List, ast.IfExp, *OPERATORS
+)
+"""Syntax expressions can use. Anything else, like attributes, subscripts and lambdas, is rejected."""
+
+
+STATISTICS = ('mean', 'median', 'mode', 'stdev', 'variance', 'pstdev', 'pvariance', 'fmean', 'geometric_mean')
+"""Functions of the statistics module expressions can call. They take a list of values."""
+
+
+def power(base: Any, exponent: Any) -> Any:
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and base.bit_length() * exponent > MAX_INTEGER_BITS:
+        raise ValueError(f"Result of {base} ** {exponent} is too large")
+    return base ** exponent
+
+
+def factorial(value: Any) -> int:
+    if value > MAX_FACTORIAL:
+        raise ValueError(f"factorial({value}) is too large")
+    return math.factorial(int(value) if isinstance(value, float) and value.is_integer() else value)
+
+
+FUNCTIONS: Dict[str, Callable] = {
+    **{name: getattr(math, name) for name in (
+        'sqrt', 'exp', 'log', 'log10', 'log2', 'log1p', 'sin', 'cos', 'tan', 'asin', 'acos', 'atan',
+        'atan2', 'sinh', 'cosh', 'tanh', 'floor', 'ceil', 'trunc', 'fabs', 'gcd', 'hypot',
+        'degrees', 'radians', 'isclose'
+    )},
+    **{name: getattr(statistics, name) for name in STATISTICS},
+    'abs': abs,
+    'round': round,
+    'min': min,
+    'max': max,
+    'sum': sum,
+    'pow': power,
+    'factorial': factorial
+}
+"""Functions expressions can call"""
+
+CONSTANTS: Dict[str, Any] = {
+    'pi': math.pi,
+    'e': math.e,
+    'tau': math.tau,
+    'inf': math.inf,
+    'nan': math.nan
+}
+"""Names expressions can use without defining them"""
+
+NUMPY_FUNCTIONS: Dict[str, str] = {
+    'sqrt': 'sqrt', 'exp': 'exp', 'log10': 'log10', 'log2': 'log2', 'log1p': 'log1p',
+    'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'asin': 'arcsin', 'acos': 'arccos', 'atan': 'arctan',
+    'atan2': 'arctan2', 'sinh': 'sinh', 'cosh': 'cosh', 'tanh': 'tanh', 'floor': 'floor', 'ceil': 'ceil',
+    'trunc': 'trunc', 'fabs': 'fabs', 'abs': 'abs', 'round': 'round',
+    'degrees': 'degrees', 'radians': 'radians', 'pow': 'power'
+}
+"""numpy functions used element by element for FUNCTIONS in batch evaluation"""
+
+VARIADIC_FUNCTIONS: Dict[str, str] = {'min': 'minimum', 'max': 'maximum', 'hypot': 'hypot'}
+"""FUNCTIONS taking any number of values, and the numpy function combining two of them in batch evaluation"""
+
+REDUCTIONS: Dict[str, str] = {
+    'mean': 'mean', 'fmean': 'mean', 'median': 'median', 'pstdev': 'std', 'pvariance': 'var'
+}
+"""FUNCTIONS taking a list of values, and the numpy function reducing them in batch evaluation.
+Other statistics functions are applied to each row."""
+
+
+class Expression:
+    """A validated math expression, compiled once and evaluated many times.
+
+    Use compile_expression to create one, so expressions are cached.
+
+    Example:
+        expression = compile_expression('sqrt(x**2 + y**2)')
+        expression(x=3, y=4)
+        expression.batch({'x': [3, 5], 'y': [4, 12]})
+    """
+
+    def __init__(self, text: str):
+        if len(text) > MAX_EXPRESSION_LENGTH:
+            raise ValueError(f"Expression is longer than {MAX_EXPRESSION_LENGTH} characters")
+        try:
+            tree = ast.parse(text.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Invalid expression: {e.msg}") from None
+
+        names = set()
+        # Lists are only allowed as function arguments, like mean([a, b]), so [0] * 10**9 can not exhaust memory
+        arguments = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, NODES):
+                raise ValueError(f"{type(node).__name__} is not allowed in expressions")
+            if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+                raise ValueError(f"Constant {node.value!r} is not allowed in expressions")
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+                    raise ValueError(f"Function {ast.unparse(node.func)} is not allowed in expressions")
+                if node.keywords:
+                    raise ValueError("Keyword arguments are not allowed in expressions")
+                arguments.update(id(argument) for argument in node.args)
+            elif isinstance(node, (ast.List, ast.Tuple)) and id(node) not in arguments:
+                raise ValueError("Lists are only allowed as function arguments, like mean([a, b])")
+            elif isinstance(node, ast.Name) and node.id not in FUNCTIONS:
+                if node.id.startswith('_'):
+                    raise ValueError(f"Name {node.id} is not allowed in expressions")
+                names.add(node.id)
+
+        self.text = text
+        self.variables: FrozenSet[str] = frozenset(names - CONSTANTS.keys())
+        """Names the expression needs values for"""
+
+        # ** is evaluated by pow, which refuses exponents that would stall the process
+        tree = ast.fix_missing_locations(PowerToCall().visit(tree))
+        self.code = compile(tree, '<expression>', 'eval')
+        # Arrays have no single truth value, so batches evaluate conditions element by element
+        tree = ast.fix_missing_locations(ElementwiseLogic().visit(tree))
+        self.batch_code = compile(tree, '<expression>', 'eval')
+
+    def __call__(self, **variables: Any) -> Any:
+        """Evaluates the expression with values for its variables"""
+        return eval(self.code, {'__builtins__': {}}, self.namespace(FUNCTIONS, variables))
+
+    def batch(self, variables: Mapping[str, Sequence[Any]]) -> Any:
+        """Evaluates the expression for every row of variables at once, with numpy.
+
+        Args:
+            variables (Mapping[str, Sequence]): Values of each variable, one per row. Variables
+                given as a single number have that value in every row.
+
+        Returns:
+            numpy.ndarray: The value for each row
+        """
+        import numpy as np
+
+        functions = batch_functions()
+        values = {name: np.asarray(value, dtype=float) for name, value in variables.items()}
+        with np.errstate(all='ignore'):
+            return np.asarray(eval(self.batch_code, {'__builtins__': {}}, self.namespace(functions, values)))
+
+    def namespace(self, functions: Dict[str, Callable], variables: Mapping[str, Any]) -> Dict[str, Any]:
+        missing = self.variables - variables.keys()
+        if missing:
+            raise ValueError(f"Missing values for {', '.join(sorted(missing))}")
+        return {**CONSTANTS, **functions, **variables}
+
+    def __repr__(self) -> str:
+        return f"Expression({self.text!r})"
+
+
+class PowerToCall(ast.NodeTransformer):
+    """Rewrites a ** b as pow(a, b)"""
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Pow):
+            return ast.Call(func=ast.Name(id='pow', ctx=ast.Load()), args=[node.left, node.right], keywords=[])
+        return node
+
+
+def call(name: str, *args: ast.expr) -> ast.Call:
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=list(args), keywords=[])
+
+
+class ElementwiseLogic(ast.NodeTransformer):
+    """Rewrites the syntax that tests the truth of a value into numpy functions working element by element.
+
+    a if c else b becomes where(c, a, b), and/or/not become logical_and,
+    logical_or and logical_not, and a < b < c becomes (a < b) & (b < c).
+    """
+
+    def visit_IfExp(self, node: ast.IfExp) -> ast.AST:
+        self.generic_visit(node)
+        return call('_where', node.test, node.body, node.orelse)
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> ast.AST:
+        self.generic_visit(node)
+        name = '_and' if isinstance(node.op, ast.And) else '_or'
+        return functools.reduce(lambda left, right: call(name, left, right), node.values)
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> ast.AST:
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return call('_not', node.operand)
+        return node
+
+    def visit_Compare(self, node: ast.Compare) -> ast.AST:
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        operands = [node.left, *node.comparators]
+        comparisons = [
+            ast.Compare(left=operands[index], ops=[op], comparators=[operands[index + 1]])
+            for index, op in enumerate(node.ops)
+        ]
+        return functools.reduce(lambda left, right: call('_and', left, right), comparisons)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_expression(text: str) -> Expression:
+    """Parses, validates and compiles an expression, or returns the cached one
+
+    Raises:
+        ValueError: The expression is invalid, or uses syntax or functions that are not allowed
+    """
+    return Expression(text)
+
+
+def rows(values: Any, name: str) -> Any:
+    """Stacks the values of a list argument, so column i holds the values of row i of the batch"""
+    import numpy as np
+
+    if not isinstance(values, (list, tuple)):
+        raise TypeError(f"{name}() takes a list of values, like {name}([a, b])")
+    if not values:
+        raise ValueError(f"{name}() of an empty list")
+    return np.stack(np.broadcast_arrays(*values))
+
+
+def positional(function: Callable, name: str, most: int) -> Callable:
+    """Rejects extra arguments, which numpy functions would otherwise take as out and write to"""
+
+    def call_function(*args: Any) -> Any:
+        if len(args) > most:
+            raise TypeError(f"{name}() takes at most {most} arguments ({len(args)} given)")
+        return function(*args)
+    return call_function
+
+
+def variadic(combine: Callable, name: str, initial: Any = None) -> Callable:
+    """Batch version of a function of any number of values, combining them two at a time.
+
+    Without an initial value, like min and max, one argument is a list of the values.
+    """
+
+    def combined(*args: Any) -> Any:
+        if initial is not None:
+            return functools.reduce(combine, args, initial)
+        values = args
+        if len(args) == 1:
+            if not isinstance(args[0], (list, tuple)):
+                raise TypeError(f"{name}() of one value takes a list of values, like {name}([a, b])")
+            values = args[0]
+        if not values:
+            raise ValueError(f"{name}() of no values")
+        return functools.reduce(combine, values)
+    return combined
+
+
+def reduction(function: Callable, name: str) -> Callable:
+    """Batch version of a function of a list of values, reducing each row separately"""
+
+    def reduce_rows(values: Any) -> Any:
+        return function(rows(values, name), axis=0)
+    return reduce_rows
+
+
+@functools.lru_cache(maxsize=None)
+def batch_functions() -> Dict[str, Callable]:
+    """FUNCTIONS working on numpy arrays, giving each row the value the function gives for that row alone"""
+    import numpy as np
+
+    def integers(value: Any) -> Any:
+        value = np.asarray(value)
+        if not np.all(np.mod(value, 1) == 0):
+            raise TypeError("gcd() takes integers")
+        return value.astype(np.int64)
+
+    def batch_sum(values: Any, start: Any = 0) -> Any:
+        if isinstance(values, (list, tuple)) and not values:
+            return start
+        return np.sum(rows(values, 'sum'), axis=0) + start
+
+    functions: Dict[str, Callable] = {
+        name: np.vectorize(function, otypes=[float]) for name, function in FUNCTIONS.items()
+    }
+    for name in STATISTICS:
+        functions[name] = reduction(
+            lambda stacked, axis, function=FUNCTIONS[name]: np.apply_along_axis(function, axis, stacked), name
+        )
+    for name, numpy_name in NUMPY_FUNCTIONS.items():
+        function = getattr(np, numpy_name)
+        functions[name] = positional(function, name, getattr(function, 'nin', 2))
+    for name, numpy_name in VARIADIC_FUNCTIONS.items():
+        functions[name] = variadic(getattr(np, numpy_name), name, 0.0 if name == 'hypot' else None)
+    for name, numpy_name in REDUCTIONS.items():
+        functions[name] = reduction(getattr(np, numpy_name), name)
+    # Sample statistics, like the statistics module's
+    functions['stdev'] = reduction(functools.partial(np.std, ddof=1), 'stdev')
+    functions['variance'] = reduction(functools.partial(np.var, ddof=1), 'variance')
+    functions['sum'] = batch_sum
+    functions['gcd'] = variadic(lambda a, b: np.gcd(integers(a), integers(b)), 'gcd', 0)
+    functions['log'] = positional(lambda value, *base: np.log(value) / np.log(base[0]) if base else np.log(value), 'log', 2)
+    # math.isclose tolerances, numpy's default ones are much looser
+    functions['isclose'] = positional(functools.partial(np.isclose, rtol=1e-9, atol=0.0), 'isclose', 2)
+    # Used by ElementwiseLogic. Expressions can not name them, as names starting with _ are rejected.
+    functions.update({'_where': np.where, '_and': np.logical_and, '_or': np.logical_or, '_not': np.logical_not})
+    return functions
+
+
+def evaluate(expression: str, variables: Optional[Mapping[str, Any]] = None) -> Any:
+    """Evaluates a math expression safely.
+
+    Only numbers, arithmetic, comparisons, conditionals, and/or/not and
+    the functions in FUNCTIONS are allowed. A variable given as a list of values evaluates the
+    expression for each of them with numpy, and returns a list.
+
+    Example:
+        evaluate('25**(1/2)')                       # 5.0
+        evaluate('x * 1.2', {'x': [10, 20, 30]})    # [12.0, 24.0, 36.0]
+
+    Args:
+        expression (str): The expression
+        variables (Mapping[str, Any], optional): Values of the names used in the expression
+
+    Raises:
+        ValueError: The expression is invalid, not allowed, or misses values
+    """
+    compiled = compile_expression(expression)
+    variables = variables or {}
+    if any(isinstance(value, (list, tuple)) or hasattr(value, '__array__') for value in variables.values()):
+        return compiled.batch(variables).tolist()
+    return compiled(**variables)
@@ -5,14 +5,11 @@ from typing import Union, Optional, Any, Tuple, Dict, List
 from webbrowser import open_new_tab
 from ..tools.base import Tool
 from ..tools.tool import tool
+from ..tools.expression import evaluate
+from ..tools.cache import ToolCache, CacheEntry, shared_tool_cache
 from pydantic import Field
-from serpapi import google_search
 from pathlib import Path
-from PIL import Image
-import pyautogui
-import requests
 import logging 
-import aiohttp
 import base64
 import sys
 import os
@@ -33,21 +30,28 @@ class Calculator(Tool):
     description: str =  """
         Useful for getting the result of a math expression.
         The input to this tool should be a valid mathematical expression that could be executed by a simple calculator.
-        The code will be executed in a python environment so the input should be in a format it can be executed.
+        Numbers, arithmetic, comparisons, "a if condition else b", and/or/not, pi, e and math and statistics functions
+        like sqrt, log, sin, round, mean and stdev can be used.
+        To evaluate the same expression for many values, use variables in the
+        expression and give a list of values for each of them.
         Always present the answer from this tool to the user in a sentence.
         
         Example:
         User: what is the square root of 25?
-        arguments: 25**(1/2)
+        arguments: ["25**(1/2)"]
         
-        :param math_express: The math expression to evaluate
+        User: what is 15% vat on 120, 80 and 45?
+        arguments: ["price * 0.15", {"price": [120, 80, 45]}]
+        
+        :param math_expression: The math expression to evaluate
+        :param variables (optional): Values of the variables in the expression
         """
     
-    def run(self, math_expression):
-        return eval(math_expression)
+    def run(self, math_expression: str, variables: Optional[Dict[str, Any]] = None):
+        return evaluate(math_expression, variables)
     
-    async def arun(self, math_expression):
-        return await eval(math_expression)
+    async def arun(self, math_expression: str, variables: Optional[Dict[str, Any]] = None):
+        return self.run(math_expression, variables)
 
 class YoutubePlayer(Tool):
     name: str =  "Youtube Player"
@@ -57,24 +61,50 @@ class YoutubePlayer(Tool):
     :param topic (optional): The topic to search for
     """
     
+    search_url: str = "https://www.youtube.com/results"
+    """YouTube search page"""
+    
+    cache: Optional[ToolCache] = Field(default_factory=shared_tool_cache, exclude=True)
+    """Caches the video found for a topic. None disables caching."""
+    
+    cache_ttl: float = 24 * 3600.0
+    """Seconds the video found for a topic is reused"""
+    
+    cache_ignore_case: bool = True
+    """Topics differing only in case share the video found"""
+    
     def run(self, topic: str):
         """Play a YouTube Video"""
+        url = self.find_video(topic)
+        open_new_tab(url)
+        return url
+    
+    def find_video(self, topic: str) -> str:
+        """Url of the first video found for a topic. Results are cached, see Tool.cache."""
+        
+        def fetch(previous: Optional[CacheEntry]) -> CacheEntry:
+            import requests
 
-        url = f"https://www.youtube.com/results?q={topic}"
-        count = 0
-        cont = requests.get(url)
-        data = cont.content
-        data = str(data)
-        lst = data.split('"')
-        for i in lst:
-            count += 1
-            if i == "WEB_PAGE_TYPE_WATCH":
-                break
-        if lst[count - 5] == "/results":
-            raise Exception("No Video Found for this Topic!")
-
-        open_new_tab(f"https://www.youtube.com{lst[count - 5]}")
-        return f"https://www.youtube.com{lst[count - 5]}"
+            cont = requests.get(self.search_url, params={'q': topic}, headers=previous.validators() if previous else {}, timeout=30)
+            if cont.status_code == 304 and previous:
+                return previous
+            count = 0
+            data = cont.content
+            data = str(data)
+            lst = data.split('"')
+            for i in lst:
+                count += 1
+                if i == "WEB_PAGE_TYPE_WATCH":
+                    break
+            if count < 5 or lst[count - 5] == "/results":
+                raise Exception("No Video Found for this Topic!")
+            return CacheEntry(
+                value=f"https://www.youtube.com{lst[count - 5]}",
+                etag=cont.headers.get('ETag'),
+                last_modified=cont.headers.get('Last-Modified')
+            )
+        
+        return self.cached(fetch, topic)
     
     async def arun(self, url: str):
         raise NotImplementedError(NotImplementedErrorMessage)
@@ -119,40 +149,63 @@ class WorldNews(Tool):
     :param category (optional): Category selected from categories
     :param country (optional): Country to search news from
     """
+    news_url: str = "https://newsapi.org/v2/top-headlines"
+    """NewsAPI top headlines endpoint"""
+    
+    cache: Optional[ToolCache] = Field(default_factory=shared_tool_cache, exclude=True)
+    """Caches headlines. None disables caching."""
+    
+    cache_ttl: float = 300.0
+    """Seconds cached headlines are returned as is"""
+    
     def run(self, topic: Optional[str] = None, category: Optional[str] = None, country: Optional[str] = None):
-        try:
-            url = "https://newsapi.org/v2/top-headlines"
-            params={
-                "apiKey": os.getenv('NEWSAPI_API_KEY'),
-                "language": "en",
-                "sources": "bbc-news,the-verge,google-news",
-                "pageSize": 5
-            }
-            
-            if topic:
-                params["q"] = topic
-            
-            if any([category, country]) and category != 'general' and country not in ('world',''):
-                del params['sources']
-            
-                if category:
-                    params["category"] = category
-            
-                if country:
-                    params["country"] = country
-            
-            response = requests.get(
-                url,
-                params=params
-            )
-            
-            results = response.json()
-            articles = results['articles']
-            headlines = [line['title'] for line in articles]
-            
-            return headlines
-        except Exception as e:
-            return f"Error: {str(e)}"
+        """Fetch headlines. Results are cached, see Tool.cache."""
+        
+        def fetch(previous: Optional[CacheEntry]) -> CacheEntry:
+            import requests
+
+            try:
+                params={
+                    "apiKey": os.getenv('NEWSAPI_API_KEY'),
+                    "language": "en",
+                    "sources": "bbc-news,the-verge,google-news",
+                    "pageSize": 5
+                }
+                
+                if topic:
+                    params["q"] = topic
+                
+                if any([category, country]) and category != 'general' and country not in ('world',''):
+                    del params['sources']
+                
+                    if category:
+                        params["category"] = category
+                
+                    if country:
+                        params["country"] = country
+                
+                response = requests.get(
+                    self.news_url,
+                    params=params,
+                    headers=previous.validators() if previous else {},
+                    timeout=30
+                )
+                if response.status_code == 304 and previous:
+                    return previous
+                
+                results = response.json()
+                articles = results['articles']
+                headlines = [line['title'] for line in articles]
+                
+                return CacheEntry(
+                    value=headlines,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified')
+                )
+            except Exception as e:
+                return CacheEntry(value=f"Error: {str(e)}", store=False)
+        
+        return self.cached(fetch, topic=topic, category=category, country=country)
     
     def arun(self, url: str):
         raise NotImplementedError(NotImplementedErrorMessage)
@@ -260,129 +313,6 @@ class FSBrowser(Tool):
             return path.unlink()
         return shutil.rmtree(path)
     
-class SearchTool(Tool):
-    """Wrapper around SerpAPI.
-
-    To use, you should have the ``google-search-results`` python package installed,
-    and the environment variable ``SERPAPI_API_KEY`` set with your API key, or pass
-    `serpapi_api_key` as a named parameter to the constructor.
-
-    Example:
-        .. code-block:: python
-
-            from langchain.utilities import SerpAPIWrapper
-            serpapi = SerpAPIWrapper()
-    """
-    
-    name: str = "Current Search"
-    description: str = "Use this tool to search for current information"
-
-    search_engine: Any = google_search #: :meta private:
-    params: dict = Field(
-        default={
-            "engine": "google",
-            "google_domain": "google.com",
-            "gl": "us",
-            "hl": "en",
-        }
-    )
-    serpapi_api_key: Optional[str] = os.getenv('SERPAPI_API_KEY')
-    aiosession: Optional[aiohttp.ClientSession] = None
-
-    async def arun(self, query: str, **kwargs: Any) -> Union[str, List]:
-        """Run query through SerpAPI and parse result async."""
-        return self._process_response(await self.aresults(query))
-
-    def run(self, query: str, **kwargs: Any) -> Union[str,List]:
-        """Run query through SerpAPI and parse result."""
-        return self._process_response(self.results(query))
-
-    def results(self, query: str) -> dict:
-        """Run query through SerpAPI and return the raw result."""
-        params = self.get_params(query)
-        search = self.search_engine(params)
-        res = search.get_dict()
-        return res
-
-    async def aresults(self, query: str) -> dict:
-        """Use aiohttp to run query through SerpAPI and return the results async."""
-
-        def construct_url_and_params() -> Tuple[str, Dict[str, str]]:
-            params = self.get_params(query)
-            params["source"] = "python"
-            if self.serpapi_api_key:
-                params["serp_api_key"] = self.serpapi_api_key
-            params["output"] = "json"
-            url = "https://serpapi.com/search"
-            return url, params
-
-        url, params = construct_url_and_params()
-        if not self.aiosession:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    res = await response.json()
-        else:
-            async with self.aiosession.get(url, params=params) as response:
-                res = await response.json()
-
-        return res
-
-    def get_params(self, query: str) -> Dict[str, str]:
-        """Get parameters for SerpAPI."""
-        _params = {
-            "api_key": self.serpapi_api_key,
-            "q": query,
-        }
-        params = {**self.params, **_params}
-        return params
-
-    @staticmethod
-    def _process_response(res: dict) -> Union[str,List]:
-        """Process response from SerpAPI."""
-        
-        toret: Union[str, List] = ""
-        if "error" in res.keys():
-            raise ValueError(f"Got error from SerpAPI: {res['error']}")
-        if "answer_box" in res.keys() and type(res["answer_box"]) == list:
-            res["answer_box"] = res["answer_box"][0]
-        if "answer_box" in res.keys() and "answer" in res["answer_box"].keys():
-            toret = res["answer_box"]["answer"]
-        elif "answer_box" in res.keys() and "snippet" in res["answer_box"].keys():
-            toret = res["answer_box"]["snippet"]
-        elif (
-            "answer_box" in res.keys()
-            and "snippet_highlighted_words" in res["answer_box"].keys()
-        ):
-            toret = res["answer_box"]["snippet_highlighted_words"][0]
-        elif (
-            "sports_results" in res.keys()
-            and "game_spotlight" in res["sports_results"].keys()
-        ):
-            toret = res["sports_results"]["game_spotlight"]
-        elif (
-            "shopping_results" in res.keys()
-            and "title" in res["shopping_results"][0].keys()
-        ):
-            toret = res["shopping_results"][:3]
-        elif (
-            "knowledge_graph" in res.keys()
-            and "description" in res["knowledge_graph"].keys()
-        ):
-            toret = res["knowledge_graph"]["description"]
-        elif "snippet" in res["organic_results"][0].keys():
-            toret = res["organic_results"][0]["snippet"]
-        elif "link" in res["organic_results"][0].keys():
-            toret = res["organic_results"][0]["link"]
-        elif (
-            "images_results" in res.keys()
-            and "thumbnail" in res["images_results"][0].keys()
-        ):
-            thumbnails = [item["thumbnail"] for item in res["images_results"][:10]]
-            toret = thumbnails
-        else:
-            toret = "No good search result found"
-        return toret
-
 @tool
 def take_screenshot():
     """Use this tool to take a screenshot of the screen.
@@ -393,6 +323,9 @@ def take_screenshot():
         "function": "Take Screenshot",
         "arguments": []
     }"""
+    # pyautogui connects to the display when imported, so only do it when needed
+    import pyautogui
+
     screenshot = pyautogui.screenshot()
     
     # Resize the image by 50% while maintaining the aspect ratio
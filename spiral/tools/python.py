@@ -1,11 +1,10 @@
-from pydantic import Field
-from typing import Dict, Optional
-from ..tools.base import Tool
-from io import StringIO
-import multiprocessing
+from pydantic import Field, PrivateAttr
+from typing import Any, Dict, List, Optional
+from ..tools.base import Tool, current_session
+from ..tools.repl import REPLPool, ExecutionResult
 import functools
+import threading
 import logging
-import sys
 
 NotImplementedErrorMessage = 'this tool does not suport async'
 
@@ -24,61 +23,88 @@ def warn_once() -> None:
 
 
 class PythonREPL(Tool):
-    """Simulates a standalone Python REPL."""
+    """Simulates a standalone Python REPL.
+
+    Code runs in warm worker processes, one per conversation, so variables
+    and imports persist between calls. Use imports to preload modules in
+    the workers before they are needed.
+
+    Workers are forked on Linux while the process has no other threads, and
+    spawned otherwise, e.g. when Agent.run() has started its event loop thread.
+    Spawned workers import the main script again, so a script using this
+    tool must keep its top-level code under if __name__ == '__main__':.
+    """
 
     globals: Optional[Dict] = Field(default_factory=dict, alias="_globals")
     locals: Optional[Dict] = Field(default_factory=dict, alias="_locals")
     
     name: str = "Python REPL"
     description: str = """Use this tool to execute python code.
+    Variables and imports are kept between calls.
     
     :param code: the valid python code to execute
     """
+    
+    imports: List[str] = Field(default=[])
+    """Modules imported when a worker starts, like 'numpy as np'"""
+    
+    timeout: Optional[float] = Field(default=60.0)
+    """Seconds a call can run before it is interrupted. None never interrupts."""
+    
+    warm_workers: int = Field(default=1)
+    """Number of spare workers kept ready for new conversations"""
+    
+    max_workers: int = Field(default=32)
+    """Maximum number of conversation workers. The least recently used is stopped."""
+    
+    max_output: int = Field(default=8192)
+    """Bytes of output returned per call. The middle of longer output is cut, to keep it out of the prompt."""
+    
+    cpu_limit: Optional[float] = Field(default=None)
+    """CPU seconds a call can use"""
+    
+    memory_limit: Optional[int] = Field(default=None)
+    """Bytes of memory a worker can use"""
+    
+    _pool: Optional[REPLPool] = PrivateAttr(default=None)
+    _pool_lock: Any = PrivateAttr(default_factory=threading.Lock)
 
-    @classmethod
-    def worker(
-        cls,
-        command: str,
-        globals: Optional[Dict],
-        locals: Optional[Dict],
-        queue: multiprocessing.Queue,
-    ) -> None:
-        old_stdout = sys.stdout
-        sys.stdout = mystdout = StringIO()
-        try:
-            exec(command, globals, locals)
-            sys.stdout = old_stdout
-            queue.put(mystdout.getvalue())
-        except Exception as e:
-            sys.stdout = old_stdout
-            queue.put(repr(e))
+    @property
+    def pool(self) -> REPLPool:
+        """The worker pool, started on first use"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = REPLPool(
+                    imports=self.imports,
+                    namespace={**(self.globals or {}), **(self.locals or {})},
+                    warm_workers=self.warm_workers,
+                    max_workers=self.max_workers,
+                    max_output=self.max_output,
+                    cpu_limit=self.cpu_limit,
+                    memory_limit=self.memory_limit
+                )
+            return self._pool
 
-    def run(self, command: str, timeout: Optional[int] = None) -> str:
-        """Run command with own globals/locals and returns anything printed.
-        Timeout after the specified number of seconds."""
+    def run(self, command: str, timeout: Optional[float] = None) -> str:
+        """Run command in the conversation's worker and returns anything printed.
+        Timeout after the specified number of seconds, defaults to self.timeout."""
+        return str(self.execute(command, timeout))
+    
+    def execute(self, command: str, timeout: Optional[float] = None) -> ExecutionResult:
+        """Run command in the conversation's worker.
+
+        Returns:
+            ExecutionResult: The output, status, error and resource use of the command
+        """
 
         # Warn against dangers of PythonREPL
         warn_once()
 
-        queue: multiprocessing.Queue = multiprocessing.Queue()
-
-        # Only use multiprocessing if we are enforcing a timeout
-        if timeout is not None:
-            # create a Process
-            p = multiprocessing.Process(
-                target=self.worker, args=(command, self.globals, self.locals, queue)
-            )
-
-            # start it
-            p.start()
-
-            # wait for the process to finish or kill it after timeout seconds
-            p.join(timeout)
-
-            if p.is_alive():
-                p.terminate()
-                return "Execution timed out"
-        else:
-            self.worker(command, self.globals, self.locals, queue)
-        # get the result from the worker function
-        return queue.get()
+        # Calls outside of an agent share one worker
+        session = current_session.get() or 'default'
+        return self.pool.execute(session, command, timeout if timeout is not None else self.timeout)
+    
+    def end_session(self, session: str):
+        """Stops the conversation's worker"""
+        if self._pool is not None:
+            self._pool.release(session)
@@ -0,0 +1,438 @@
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from multiprocessing.connection import Connection
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import multiprocessing
+import threading
+import logging
+import signal
+import math
+import time
+import sys
+import io
+import os
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where limits other than timeout are not enforced
+    resource = None # type: ignore
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+    datefmt='%d-%b-%y %H:%M:%S',
+    level=logging.WARNING
+)
+logger = logging.getLogger('spiral.log')
+
+MAIN_GUARD_MESSAGE = (
+    "Python REPL workers are started with the spawn start method, which imports the main script again. "
+    "Put the script's top-level code that uses PythonREPL or Agent.run under if __name__ == '__main__':"
+)
+
+
+class ExecutionResult(BaseModel):
+    """The result of running code in a REPL worker"""
+
+    output: str = Field(default='')
+    """What the code printed. Output over the byte budget is cut from the middle."""
+
+    status: str = Field(default='ok')
+    """'ok', 'error', 'timeout' (interrupted, variables kept) or 'killed' (worker replaced, variables lost)"""
+
+    error: str = Field(default='')
+    """The exception the code raised, or why the worker was killed"""
+
+    elapsed: float = Field(default=0.0)
+    """Seconds the code ran"""
+
+    cpu_time: float = Field(default=0.0)
+    """CPU seconds the code used"""
+
+    peak_rss: int = Field(default=0)
+    """Peak resident memory of the worker process in bytes"""
+
+    truncated_bytes: int = Field(default=0)
+    """Bytes of output cut from the middle"""
+
+    def __str__(self) -> str:
+        text = self.output
+        if self.status == 'timeout':
+            return f"{text}Execution timed out"
+        if self.status == 'killed':
+            return f"{text}{self.error}. Variables defined before were lost."
+        if self.error:
+            return f"{text}{self.error}" if text else self.error
+        return text
+
+
+class ResourceLimitExceeded(Exception):
+    """The code used more CPU time than it was allowed"""
+
+
+class CappedOutput(io.TextIOBase):
+    """stdout of the worker. Streams the first head bytes to the parent and keeps only the last tail bytes."""
+
+    def __init__(self, send: Callable[[bytes], None], head: int, tail: int):
+        self.send = send
+        self.head = head
+        self.tail = bytearray()
+        self.tail_size = tail
+        self.truncated = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        data = text.encode('utf-8', 'replace')
+        if self.head > 0:
+            chunk, data = data[:self.head], data[self.head:]
+            self.head -= len(chunk)
+            self.send(chunk)
+        if data:
+            self.tail += data
+            if len(self.tail) > self.tail_size:
+                extra = len(self.tail) - self.tail_size
+                self.truncated += extra
+                del self.tail[:extra]
+        return len(text)
+
+
+def serve(connection: Connection, imports: List[str], namespace: Dict[str, Any], memory_limit: Optional[int] = None):
+    """Runs in the worker process: executes commands in one namespace until the connection closes"""
+    state = {'running': False, 'sending': False, 'interrupted': False}
+
+    def interrupt(signum, frame):
+        # Only code being executed is interrupted, not the worker's own loop or a message being sent
+        if state['running'] and not state['sending']:
+            raise KeyboardInterrupt
+        if state['running']:
+            state['interrupted'] = True
+
+    def cpu_exceeded(signum, frame):
+        if state['running'] and not state['sending']:
+            raise ResourceLimitExceeded("CPU time limit exceeded")
+
+    def send_output(chunk: bytes):
+        state['sending'] = True
+        try:
+            connection.send(('output', chunk))
+        finally:
+            state['sending'] = False
+        if state['interrupted']:
+            state['interrupted'] = False
+            raise KeyboardInterrupt
+
+    signal.signal(signal.SIGINT, interrupt)
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, cpu_exceeded)
+    failed = []
+    for module in imports:
+        statement = module if module.startswith(('import ', 'from ')) else f"import {module}"
+        try:
+            exec(statement, namespace)
+        except Exception as e:
+            failed.append(f"{statement}: {e!r}")
+    if memory_limit and resource is not None:
+        # Allocations over the limit raise MemoryError instead of taking memory from the host
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    connection.send(('ready', '\n'.join(failed)))
+
+    while True:
+        try:
+            command, max_output, cpu_limit = connection.recv()
+        except EOFError:
+            break
+        output = CappedOutput(send_output, max_output - max_output // 2, max_output // 2)
+        old_stdout, old_stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = output
+        status, error = 'ok', ''
+        started, cpu_started = time.perf_counter(), time.process_time()
+        if cpu_limit and resource is not None:
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            soft = math.ceil(cpu_started + cpu_limit)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+        try:
+            state['running'] = True
+            exec(command, namespace)
+        except KeyboardInterrupt:
+            status = 'interrupted'
+        except BaseException as e:
+            status, error = 'error', repr(e)
+        finally:
+            state['running'] = state['interrupted'] = False
+            sys.stdout, sys.stderr = old_stdout, old_stderr
+            if cpu_limit and resource is not None:
+                resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        connection.send(('done', {
+            'status': status,
+            'error': error,
+            'tail': bytes(output.tail),
+            'truncated_bytes': output.truncated,
+            'elapsed': time.perf_counter() - started,
+            'cpu_time': time.process_time() - cpu_started,
+            'peak_rss': peak_rss()
+        }))
+
+
+def peak_rss() -> int:
+    """Peak resident memory of this process in bytes, or 0 where it is not known"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class REPLWorker:
+    """A long-lived python process with its own namespace.
+
+    Args:
+        context: multiprocessing context used to start the process
+        imports (List[str]): Modules imported when the process starts
+        namespace (dict): Variables the namespace starts with
+        memory_limit (int, optional): Bytes of memory the process can use
+    """
+
+    def __init__(self, context: Any, imports: List[str], namespace: Dict[str, Any], memory_limit: Optional[int] = None):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=serve, args=(child, imports, namespace, memory_limit), daemon=True)
+        self.process.start()
+        child.close()
+        self.ready = False
+        self.lock = threading.Lock()
+        """Held while the worker executes a command"""
+
+        self.users = 0
+        """Number of callers using the worker or waiting for it. Changed with the pool's lock held."""
+
+    def execute(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+        grace: float = 1.0,
+        max_output: int = 8192,
+        cpu_limit: Optional[float] = None
+    ) -> ExecutionResult:
+        """Executes a command.
+
+        A command running longer than timeout seconds is interrupted, which
+        keeps the namespace. A command that is not interrupted within grace
+        seconds more gets the worker killed, and the result has status 'killed'.
+
+        Args:
+            command (str): Python code to execute
+            timeout (float, optional): Seconds the command can run
+            grace (float): Seconds the command gets to stop after it is interrupted
+            max_output (int): Bytes of output to keep. The middle of longer output is cut.
+            cpu_limit (float, optional): CPU seconds the command can use
+        """
+        head = bytearray()
+        started = time.perf_counter()
+        try:
+            if not self.ready:
+                _, failed = self.connection.recv()
+                if failed:
+                    logger.warning(f"Python REPL could not import:\n{failed}")
+                self.ready = True
+            started = time.perf_counter()
+            deadline = None if timeout is None else started + timeout
+            interrupted = False
+            self.connection.send((command, max_output, cpu_limit))
+            while True:
+                if not self.connection.poll(None if deadline is None else max(deadline - time.perf_counter(), 0)):
+                    if interrupted:
+                        self.close()
+                        return self.result(head, status='killed', error="Execution timed out", elapsed=time.perf_counter() - started)
+                    os.kill(self.process.pid, signal.SIGINT) # type: ignore
+                    interrupted, deadline = True, time.perf_counter() + grace
+                    continue
+                kind, message = self.connection.recv()
+                if kind == 'output':
+                    head += message
+                    continue
+                if message['status'] == 'interrupted':
+                    message['status'] = 'timeout' if interrupted else 'error'
+                    message['error'] = '' if interrupted else repr(KeyboardInterrupt())
+                return self.result(head, **message)
+        except (EOFError, OSError):
+            starting = not self.ready
+            self.close()
+            if starting and self.process.exitcode == 1:
+                raise RuntimeError(f"Python REPL worker exited while starting. {MAIN_GUARD_MESSAGE}") from None
+            return self.result(
+                head, status='killed', elapsed=time.perf_counter() - started,
+                error=f"Python process exited with code {self.process.exitcode}"
+            )
+
+    @staticmethod
+    def result(head: bytearray, tail: bytes = b'', truncated_bytes: int = 0, **fields: Any) -> ExecutionResult:
+        output = head.decode('utf-8', 'ignore')
+        if truncated_bytes:
+            output += f"\n... [{truncated_bytes} bytes truncated] ...\n"
+        output += tail.decode('utf-8', 'ignore')
+        return ExecutionResult(output=output, truncated_bytes=truncated_bytes, **fields)
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def close(self):
+        """Stops the worker process"""
+        self.connection.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(1)
+
+
+class REPLPool(BaseModel):
+    """Warm python processes for PythonREPL, one per session.
+
+    Each session gets its own long-lived worker process, so variables and
+    imports persist between commands, and a command costs a message to the
+    worker instead of starting a process. Spare workers are started ahead
+    of time with the configured imports done. Workers that crash or hang
+    are replaced; their sessions start over with a fresh namespace.
+
+    Args:
+        imports (List[str]): Modules imported when a worker starts, like 'numpy as np'
+        namespace (dict): Variables each worker's namespace starts with. Must be picklable.
+        warm_workers (int): Number of spare workers kept ready
+        max_workers (int): Maximum number of session workers. The least recently used is stopped.
+        interrupt_grace (float): Seconds a command gets to stop after a timeout before its worker is killed
+        max_output (int): Bytes of output kept per command. The middle of longer output is cut.
+        cpu_limit (float, optional): CPU seconds a command can use
+        memory_limit (int, optional): Bytes of memory a worker can use
+        start_method (str, optional): multiprocessing start method of the workers. Defaults to fork
+            on Linux when the process has no other threads, and to spawn otherwise.
+
+    With spawn, the workers import the main script again, so scripts must keep
+    their top-level code under if __name__ == '__main__':.
+    """
+
+    imports: List[str] = Field(default=[])
+    """Modules imported when a worker starts, like 'numpy as np'"""
+
+    namespace: Dict[str, Any] = Field(default={})
+    """Variables each worker's namespace starts with"""
+
+    warm_workers: int = Field(default=1)
+    """Number of spare workers kept ready"""
+
+    max_workers: int = Field(default=32)
+    """Maximum number of session workers"""
+
+    interrupt_grace: float = Field(default=1.0)
+    """Seconds a command gets to stop after a timeout before its worker is killed"""
+
+    max_output: int = Field(default=8192)
+    """Bytes of output kept per command. Output is streamed from the worker, so longer output costs no memory."""
+
+    cpu_limit: Optional[float] = Field(default=None)
+    """CPU seconds a command can use. Enforced with RLIMIT_CPU on POSIX."""
+
+    memory_limit: Optional[int] = Field(default=None)
+    """Bytes of memory a worker can use, including the preloaded imports. Enforced with RLIMIT_AS on POSIX."""
+
+    start_method: Optional[str] = Field(default=None)
+    """multiprocessing start method. None forks when that is safe, i.e. on Linux with no other threads running.
+    Otherwise it spawns, which does not copy the threads and locks of the agent process."""
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _idle: deque = PrivateAttr(default_factory=deque)
+    _sessions: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+
+    def execute(self, session: str, command: str, timeout: Optional[float] = None) -> ExecutionResult:
+        """Executes a command in the session's worker.
+
+        Commands of one session run one at a time, in order. A worker that
+        crashed or hung is replaced on the session's next command.
+        """
+        with self.worker(session) as worker, worker.lock:
+            result = worker.execute(command, timeout, self.interrupt_grace, self.max_output, self.cpu_limit)
+        if result.status == 'killed':
+            with self._lock:
+                if self._sessions.get(session) is worker:
+                    del self._sessions[session]
+        return result
+
+    @contextmanager
+    def worker(self, session: str) -> Iterator[REPLWorker]:
+        """The session's worker, taking a spare one for a new session.
+
+        While in use, the worker is not stopped to make room for other sessions.
+        """
+        worker = self._acquire(session)
+        try:
+            yield worker
+        finally:
+            with self._lock:
+                worker.users -= 1
+
+    def _acquire(self, session: str) -> REPLWorker:
+        stopped = []
+        with self._lock:
+            worker = self._sessions.get(session)
+            if worker is not None and not worker.alive():
+                stopped.append(worker)
+                worker = None
+            while self._idle and not worker:
+                worker = self._idle.popleft()
+                if not worker.alive():
+                    stopped.append(worker)
+                    worker = None
+            worker = worker or self._start()
+            self._sessions[session] = worker
+            self._sessions.move_to_end(session)
+            worker.users += 1
+            # Stop the least recently used workers nobody is using
+            for name, old in list(self._sessions.items()):
+                if len(self._sessions) <= self.max_workers:
+                    break
+                if not old.users:
+                    del self._sessions[name]
+                    stopped.append(old)
+            self._fill()
+        # Closing waits for the process to exit, so it is done outside the lock
+        for old in stopped:
+            old.close()
+        return worker
+
+    def warm_up(self):
+        """Starts the spare workers now instead of on the first command"""
+        with self._lock:
+            self._fill()
+
+    def release(self, session: str):
+        """Stops the session's worker"""
+        with self._lock:
+            worker = self._sessions.pop(session, None)
+        if worker is not None:
+            worker.close()
+
+    def close(self):
+        """Stops all workers"""
+        with self._lock:
+            workers = [*self._sessions.values(), *self._idle]
+            self._sessions.clear()
+            self._idle.clear()
+        for worker in workers:
+            worker.close()
+
+    def _fill(self):
+        """Starts spare workers up to warm_workers. Called with the lock held."""
+        while len(self._idle) < self.warm_workers:
+            self._idle.append(self._start())
+
+    def _start(self) -> REPLWorker:
+        if getattr(multiprocessing.current_process(), '_inheriting', False):
+            # A spawned worker is importing a main script without the if __name__ == '__main__': guard,
+            # the same check multiprocessing makes, with a message saying what to change
+            raise RuntimeError(MAIN_GUARD_MESSAGE)
+        return REPLWorker(multiprocessing.get_context(self.method()), self.imports, self.namespace, self.memory_limit)
+
+    def method(self) -> str:
+        """The start method of new workers"""
+        if self.start_method is not None:
+            return self.start_method
+        return 'fork' if sys.platform.startswith('linux') and threading.active_count() == 1 else 'spawn'
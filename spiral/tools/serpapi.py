@@ -1,9 +1,13 @@
 from typing import Union, Optional, Any, Tuple, Dict, List
-from serpapi.google_search import GoogleSearch
 from ..tools.base import Tool
+from ..tools.cache import ToolCache, CacheEntry, shared_tool_cache
+from ..utils.loop import run_coroutine, loop_running
 from pydantic import Field
 import logging 
 import aiohttp
+import asyncio
+import weakref
+import atexit
 import json
 import os
 
@@ -16,18 +20,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger('spiral.log')
 
+_sessions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+"""aiohttp sessions shared by all SearchTool instances, keyed by event loop"""
+
+
 class SearchTool(Tool):
     """Wrapper around SerpAPI.
 
-    To use, you should have the ``google-search-results`` python package installed,
-    and the environment variable ``SERPAPI_API_KEY`` set with your API key, or pass
-    `serpapi_api_key` as a named parameter to the constructor.
+    To use, you should have the environment variable ``SERPAPI_API_KEY`` set
+    with your API key, or pass `serpapi_api_key` as a named parameter to the
+    constructor.
+    
+    Requests go through one keep-alive aiohttp session per event loop,
+    shared by all instances. Sync calls run in a shared background loop,
+    so they reuse its connections too.
     """
     
     name: str = "Current Search"
-    description: str = "Use this tool to search for current information"
+    description: str = """Use this tool to search for current information.
+    To research a topic, pass several queries at once, they are searched concurrently.
+    
+    :param query: the search query. Pass more queries as more arguments
+    """
 
-    search_engine: Any = GoogleSearch #: :meta private:
     params: dict = Field(
         default={
             "engine": "google",
@@ -37,22 +52,105 @@ class SearchTool(Tool):
         }
     )
     serpapi_api_key: Optional[str] = os.getenv('SERPAPI_API_KEY')
+    serpapi_url: str = "https://serpapi.com/search"
+    """SerpAPI search endpoint"""
+    
     aiosession: Optional[aiohttp.ClientSession] = None
+    """Session to use instead of the shared one"""
+    
+    timeout: float = 30.0
+    """Seconds a search can take"""
+    
+    max_connections: int = 20
+    """Maximum number of connections of the shared session. Set by the instance that creates it."""
+
+    cache: Optional[ToolCache] = Field(default_factory=shared_tool_cache, exclude=True)
+    """Caches results of searches. None disables caching."""
+    
+    cache_ttl: float = 600.0
+    """Seconds a cached search result is returned as is"""
+    
+    cache_ignore_case: bool = True
+    """Searches are case insensitive, so queries differing only in case share cached results"""
+
+    async def arun(self, query: Union[str, List[str]], *queries: str, **kwargs: Any) -> Union[str, List]:
+        """Run query through SerpAPI and parse result async. Several queries are merged with arun_many.
+        Results are cached, see Tool.cache."""
+        
+        async def fetch(previous: Optional[CacheEntry]) -> CacheEntry:
+            # SerpAPI does not support conditional requests
+            if isinstance(query, list) or queries:
+                results, failed = await self._amerged_results([*(query if isinstance(query, list) else [query]), *queries])
+                # Do not keep results missing the failed queries, e.g. [] during an outage
+                return CacheEntry(value=results, store=not failed)
+            response = await self.aresults(query)
+            return CacheEntry(value=self._process_response(response), store='error' not in response)
+        
+        return await self.acached(fetch, query, *queries)
 
-    async def arun(self, query: str, **kwargs: Any) -> Union[str, List]:
-        """Run query through SerpAPI and parse result async."""
-        return self._process_response(await self.aresults(query))
+    def run(self, query: Union[str, List[str]], *queries: str, **kwargs: Any) -> Union[str,List]:
+        """Run query through SerpAPI and parse result. Several queries are merged with run_many."""
+        return run_coroutine(self.arun(query, *queries, **kwargs))
 
-    def run(self, query: str, **kwargs: Any) -> Union[str,List]:
-        """Run query through SerpAPI and parse result."""
-        return self._process_response(self.results(query))
+    async def arun_many(self, queries: List[str], max_results: int = 10) -> List[dict]:
+        """Run several queries through SerpAPI concurrently and merge their organic results.
+
+        Results are de-duplicated by url and ordered by their best position
+        in any of the queries. Queries that fail are logged and skipped.
+
+        Args:
+            queries (List[str]): Search queries
+            max_results (int, optional): Maximum number of results. Defaults to 10.
+
+        Returns:
+            List[dict]: title, link, snippet and the queries that found each result
+        """
+        results, _ = await self._amerged_results(queries, max_results)
+        return results
+
+    async def _amerged_results(self, queries: List[str], max_results: int = 10) -> Tuple[List[dict], List[str]]:
+        """arun_many(), also returning the queries that failed"""
+        queries = list(dict.fromkeys(queries))
+        responses = await asyncio.gather(*[self.aresults(query) for query in queries], return_exceptions=True)
+        
+        merged: Dict[str, dict] = {}
+        failed: List[str] = []
+        for query, response in zip(queries, responses):
+            if isinstance(response, BaseException) or 'error' in response:
+                error = response if isinstance(response, BaseException) else response['error']
+                logger.warning(f"Search for {query!r} failed: {error}")
+                failed.append(query)
+                continue
+            for position, item in enumerate(response.get('organic_results', [])):
+                link = item.get('link')
+                if not link:
+                    continue
+                result = merged.get(link)
+                if result is None:
+                    merged[link] = {
+                        'title': item.get('title', ''),
+                        'link': link,
+                        'snippet': item.get('snippet', ''),
+                        'position': position,
+                        'queries': [query]
+                    }
+                else:
+                    result['position'] = min(result['position'], position)
+                    result['queries'].append(query)
+        
+        # Results found by more queries come first among equally ranked ones
+        results = sorted(merged.values(), key=lambda result: (result['position'], -len(result['queries'])))
+        for result in results:
+            del result['position']
+        return results[:max_results], failed
+
+    def run_many(self, queries: List[str], max_results: int = 10) -> List[dict]:
+        """Run several queries through SerpAPI concurrently and merge their organic results."""
+        return run_coroutine(self.arun_many(queries, max_results))
 
     def results(self, query: str) -> dict:
         """Run query through SerpAPI and return the raw result."""
-        params = self.get_params(query)
-        search = self.search_engine(params)
-        res = search.get_dict()
-        return res
+        return run_coroutine(self.aresults(query))
 
     async def aresults(self, query: str) -> dict:
         """Use aiohttp to run query through SerpAPI and return the results async."""
@@ -63,19 +161,33 @@ class SearchTool(Tool):
             if self.serpapi_api_key:
                 params["serp_api_key"] = self.serpapi_api_key
             params["output"] = "json"
-            url = "https://serpapi.com/search"
-            return url, params
+            return self.serpapi_url, {key: value for key, value in params.items() if value is not None}
 
         url, params = construct_url_and_params()
-        if not self.aiosession:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    res = await response.json()
-        else:
-            async with self.aiosession.get(url, params=params) as response:
-                res = await response.json()
+        async with self.session.get(url, params=params) as response:
+            return await response.json(content_type=None)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The injected aiosession, or the keep-alive session shared within the running event loop"""
+        if self.aiosession:
+            return self.aiosession
+        loop = asyncio.get_running_loop()
+        session = _sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            _sessions[loop] = session
+        return session
 
-        return res
+    @staticmethod
+    async def aclose_sessions():
+        """Close the shared session of the running event loop"""
+        session = _sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
 
     def get_params(self, query: str) -> Dict[str, str]:
         """Get parameters for SerpAPI."""
@@ -132,3 +244,14 @@ class SearchTool(Tool):
         else:
             toret = "No good search result found"
         return toret
+
+
+def close_sessions():
+    """Close the shared session of the background loop used by sync calls"""
+    if loop_running():
+        try:
+            run_coroutine(SearchTool.aclose_sessions(), timeout=5)
+        except Exception as e:
+            logger.warning(str(e))
+
+atexit.register(close_sessions)
@@ -1,12 +1,166 @@
+from collections import OrderedDict
+from typing import Optional
 from PIL import Image
+import threading
+import hashlib
+import asyncio
+import weakref
 import base64
 import io
 
-def image_to_base64(image: Image.Image) -> str:
-    """Converts a PIL Image to base64"""
+
+def encode_image(image: Image.Image) -> str:
+    """JPEG encodes a PIL Image and returns it as base64"""
 
     screenshot_bytes = io.BytesIO()
     image.save(screenshot_bytes, format='JPEG')
 
     # Convert the BytesIO object to base64
-    return base64.b64encode(screenshot_bytes.getvalue()).decode('utf-8')
\ No newline at end of file
+    return base64.b64encode(screenshot_bytes.getvalue()).decode('utf-8')
+
+
+class EncodedImageCache:
+    """LRU cache of base64 encoded images, bounded by the size of the encodings.
+
+    Images are keyed by a hash of their content. The hash of an image
+    object is remembered for as long as the object lives, so an image seen
+    before is neither hashed nor encoded again. Images must not be modified
+    in place after they have been encoded.
+
+    Args:
+        max_bytes (int): Maximum total size of the cached encodings
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._encodings: OrderedDict[str, str] = OrderedDict()
+        self._digests: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def digest(self, image: Image.Image) -> str:
+        """Returns the content hash of an image"""
+        image_id = id(image)
+        digest = self._digests.get(image_id)
+        if digest is None:
+            hasher = hashlib.blake2b(digest_size=16)
+            hasher.update(f"{image.mode}:{image.size}".encode())
+            hasher.update(image.tobytes())
+            digest = hasher.hexdigest()
+            self._digests[image_id] = digest
+            weakref.finalize(image, self._digests.pop, image_id, None)
+        return digest
+
+    def get(self, image: Image.Image) -> str:
+        """Returns the base64 encoding of an image, encoding it only if it is not cached"""
+        key = self.digest(image)
+        with self._lock:
+            encoded = self._encodings.get(key)
+            if encoded is not None:
+                self._encodings.move_to_end(key)
+                return encoded
+
+        encoded = encode_image(image)
+        self.put(key, encoded)
+        return encoded
+
+    def get_file(self, path: str, key: Optional[str] = None) -> str:
+        """Returns the base64 encoding of an encoded image file, reading it only if it is not cached
+
+        Args:
+            path (str): The image file
+            key (str, optional): Content hash of the image. Defaults to the path.
+        """
+        key = key or path
+        with self._lock:
+            encoded = self._encodings.get(key)
+            if encoded is not None:
+                self._encodings.move_to_end(key)
+                return encoded
+
+        with open(path, 'rb') as file:
+            encoded = base64.b64encode(file.read()).decode('utf-8')
+        self.put(key, encoded)
+        return encoded
+
+    def put(self, key: str, encoded: str):
+        """Adds an encoding to the cache, evicting the least recently used ones over the budget"""
+        with self._lock:
+            if key in self._encodings:
+                self._encodings.move_to_end(key)
+                return
+            self._encodings[key] = encoded
+            self.size += len(encoded)
+            while self.size > self.max_bytes and len(self._encodings) > 1:
+                _, evicted = self._encodings.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        """Removes all cached encodings"""
+        with self._lock:
+            self._encodings.clear()
+            self.size = 0
+
+
+image_cache = EncodedImageCache()
+"""Process wide cache of encoded images"""
+
+
+def image_to_base64(image: Image.Image) -> str:
+    """Converts a PIL Image to base64. Encodings are cached in image_cache"""
+
+    return image_cache.get(image)
+
+
+def message_image_base64(message: dict) -> str:
+    """Returns the base64 encoded image of a chat history image message.
+
+    Messages can carry the encoded image under 'data', or the path of an
+    encoded image file under 'path', in which case the image is not encoded
+    again.
+    """
+    if message.get('data'):
+        return message['data']
+    if message.get('image') is None and message.get('path'):
+        return image_cache.get_file(message['path'], message.get('digest'))
+    return image_to_base64(message['image'])
+
+
+def message_image(message: dict) -> Image.Image:
+    """Returns the PIL Image of a chat history image message"""
+    if message.get('image') is not None:
+        return message['image']
+    if message.get('path'):
+        return Image.open(message['path'])
+    return Image.open(io.BytesIO(base64.b64decode(message['data'])))
+
+async def ainput(prompt: str = '') -> str:
+    """Reads a line from stdin without blocking the event loop.
+
+    input() runs on a daemon thread so a pending read never keeps the
+    process alive on exit.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(result):
+        if not future.done():
+            future.set_result(result)
+
+    def set_exception(exception):
+        if not future.done():
+            future.set_exception(exception)
+
+    def read():
+        try:
+            callback, value = set_result, input(prompt)
+        except (Exception, KeyboardInterrupt) as e:
+            callback, value = set_exception, e
+        try:
+            loop.call_soon_threadsafe(callback, value)
+        except RuntimeError:
+            # The event loop was closed while waiting for input
+            pass
+
+    threading.Thread(target=read, daemon=True).start()
+    return await future
@@ -0,0 +1,41 @@
+from typing import Any, Awaitable, Optional
+import threading
+import asyncio
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+"""Event loop running in a background thread, shared by sync callers of async code"""
+
+_loop_lock = threading.Lock()
+
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    """The shared background event loop, started on first use.
+
+    Sync code that runs coroutines here reuses the connection pools the
+    loop holds, instead of starting a new loop (and new connections) for
+    every call like asyncio.run does.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='spiral-loop', daemon=True).start()
+        return _loop
+
+
+def run_coroutine(coroutine: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """Runs a coroutine in the background loop and waits for its result. Must not be called from that loop.
+
+    The coroutine is cancelled if waiting is interrupted, e.g. by Ctrl+C or the timeout.
+    """
+    future = asyncio.run_coroutine_threadsafe(coroutine, background_loop()) # type: ignore
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def loop_running() -> bool:
+    """Whether the background loop has been started"""
+    return _loop is not None and _loop.is_running()
@@ -0,0 +1,206 @@
+import re
+
+TYPE_PATTERN = re.compile(r'"type"\s*:\s*"((?:[^"\\]|\\.)*)"')
+RESULT_PATTERN = re.compile(r'"result"\s*:\s*"')
+
+ESCAPES = {
+    '"': '"', '\\': '\\', '/': '/',
+    'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'
+}
+
+
+class JSONObjectScanner:
+    """Finds where the first top level json object in a text stream ends.
+
+    Braces inside strings are ignored, so the object is complete exactly
+    when its closing brace arrives.
+    """
+
+    def __init__(self):
+        self.start = -1
+        """Index of the opening brace"""
+
+        self.end = -1
+        """Index just past the closing brace"""
+
+        self._index = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def complete(self) -> bool:
+        """Whether the object has been closed"""
+        return self.end != -1
+
+    def scan(self, text: str) -> bool:
+        """Scans the text received so far, continuing from the last call.
+
+        Args:
+            text (str): All text received so far
+
+        Returns:
+            bool: Whether the object is complete
+        """
+        index = self._index
+        length = len(text)
+
+        while index < length and not self.complete:
+            char = text[index]
+            if self.start == -1:
+                if char == '{':
+                    self.start = index
+                    self._depth = 1
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = index + 1
+            index += 1
+
+        self._index = index
+        return self.complete
+
+
+def find_json_object(content: str) -> tuple[int, int] | None:
+    """Returns the (start, end) slice of the first complete json object in content"""
+    scanner = JSONObjectScanner()
+    if scanner.scan(content):
+        return scanner.start, scanner.end
+    return None
+
+
+class AnswerStream:
+    """Incrementally extracts the answer from a streamed llm response.
+
+    Responses are json objects like {"type": "final_answer", "result": "..."}.
+    Text deltas are fed in as they arrive and the decoded part of the
+    result string that became available is returned, so it can be shown
+    before the response is complete.
+
+    The stream is complete as soon as the response object is closed, so
+    anything the model generates after it can be dropped.
+
+    Example:
+        answer = AnswerStream()
+        for delta in llm.stream(query):
+            print(answer.feed(delta), end='')
+            if answer.complete:
+                break
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        """Raw response received so far"""
+
+        self.scanner = JSONObjectScanner()
+        """Detects the end of the response object"""
+
+        self.type = None
+        """Type of the response, once it has been streamed"""
+
+        self.done = False
+        """Whether the complete result string has been decoded"""
+
+        self._position = None
+
+    def feed(self, delta: str) -> str:
+        """Adds a text delta to the response.
+
+        Args:
+            delta (str): The text delta
+
+        Returns:
+            str: Newly decoded text of the final answer, if any.
+        """
+        self.buffer += delta
+        self.scanner.scan(self.buffer)
+
+        if self.type is None:
+            match = TYPE_PATTERN.search(self.buffer)
+            if match:
+                self.type = match.group(1).replace('\\', '')
+
+        if self.type != 'final_answer' or self.done:
+            return ''
+
+        if self._position is None:
+            match = RESULT_PATTERN.search(self.buffer)
+            if not match:
+                return ''
+            self._position = match.end()
+
+        return self._decode()
+
+    @property
+    def complete(self) -> bool:
+        """Whether the response object is syntactically complete"""
+        return self.scanner.complete
+
+    @property
+    def response(self) -> str:
+        """The response up to the end of the response object, without trailing tokens"""
+        if self.complete:
+            return self.buffer[:self.scanner.end]
+        return self.buffer
+
+    def _decode(self) -> str:
+        """Decodes the result string from the last position, stopping at incomplete escapes"""
+        buffer = self.buffer
+        index = self._position
+        decoded = []
+
+        while index < len(buffer):
+            char = buffer[index]
+            if char == '"':
+                self.done = True
+                index += 1
+                break
+            if char != '\\':
+                decoded.append(char)
+                index += 1
+                continue
+
+            if index + 1 >= len(buffer):
+                break
+            escape = buffer[index + 1]
+            if escape != 'u':
+                decoded.append(ESCAPES.get(escape, escape))
+                index += 2
+                continue
+
+            if index + 6 > len(buffer):
+                break
+            try:
+                code = int(buffer[index + 2:index + 6], 16)
+            except ValueError:
+                decoded.append(buffer[index:index + 6])
+                index += 6
+                continue
+            if 0xD800 <= code < 0xDC00:
+                # High surrogate, combine with the low surrogate that follows
+                if index + 12 > len(buffer):
+                    break
+                try:
+                    low = int(buffer[index + 8:index + 12], 16)
+                except ValueError:
+                    low = 0
+                if buffer[index + 6:index + 8] == '\\u' and 0xDC00 <= low < 0xE000:
+                    decoded.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    index += 12
+                    continue
+            decoded.append(chr(code))
+            index += 6
+
+        self._position = index
+        return ''.join(decoded)